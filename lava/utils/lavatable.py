@@ -1,10 +1,15 @@
 from __future__ import unicode_literals
 
+import datetime
+
 import django_tables2 as tables
+from django.utils import timezone
 from django.utils.safestring import mark_safe
 from django.utils.html import escape
 from django.db.models import Q
 
+from lava.utils.search import document_filter
+
 
 class LavaView(tables.SingleTableView):
 
@@ -21,8 +26,6 @@ class LavaView(tables.SingleTableView):
         """
         bespoke time-based field handling
         """
-        local_namespace = locals()
-        local_namespace["q"] = query
         time_queries = {}
         if hasattr(self.table_class.Meta, 'times'):
             # filter the possible list by the request
@@ -33,17 +36,12 @@ class LavaView(tables.SingleTableView):
                     self.terms[key] = "%s within %s %s" % (key, match, value)  # the label for this query in the search list
                     time_queries[key] = value
             for key, value in time_queries.items():
-                match = escape(self.request.GET.get(key))
-                # escape converts None into u'None'
-                if not match or match == "" or match == "None":
-                    continue
-                args = 'q = q.__and__(Q({0}__gte=datetime.now()-timedelta({1}={2})))'.format(key, value, match)
                 try:
-                    exec(args, globals(), local_namespace)  # sets the value of q
-                except SyntaxError:
-                    # should log the exception somewhere...
+                    delta = datetime.timedelta(**{value: int(self.request.GET.get(key))})
+                except (TypeError, ValueError):
                     continue  # just skip this term - results in a query matching All.
-        return local_namespace["q"]
+                query &= Q(**{"%s__gte" % key: timezone.now() - delta})
+        return query
 
     def get_table_data(self, prefix=None):
         """
@@ -54,6 +52,11 @@ class LavaView(tables.SingleTableView):
           queries - relational fields for which the table has explicit handlers for simple text searching
         - special knowledge of particular field types is handled as:
           times - fields which can be searched by a duration
+        - indexed search:
+          search_document - text column holding the words of the searches and queries columns.
+            When set, the search box is a full text match on this column
+            (see lava.utils.search), plus an exact match on the id if 'id' is in searches.
+            The explicit handlers of the queries are only used by the discrete searches.
         :return: filtered data
         """
         distinct = {}
@@ -93,66 +96,51 @@ class LavaView(tables.SingleTableView):
                 discrete_key = "%s%s" % (prefix, key) if prefix else key
                 self.discrete.append(discrete_key)
                 if self.request and self.request.GET.get(discrete_key):
-                    distinct[discrete_key] = escape(self.request.GET.get(discrete_key))
+                    distinct[discrete_key] = self.request.GET.get(discrete_key)
             self.search = sorted(self.search, key=lambda s: s.lower())
         if hasattr(self.table_class.Meta, 'queries'):
             for func, argument in self.table_class.Meta.queries.items():
                 request_argument = "%s%s" % (prefix, argument) if prefix else argument
                 self.discrete.append(request_argument)  # for __and__ queries
                 if self.request and self.request.GET.get(request_argument):
-                    distinct[func] = escape(self.request.GET.get(request_argument))
+                    distinct[func] = self.request.GET.get(request_argument)
             self.discrete = sorted(self.discrete, key=lambda s: s.lower())
         if not self.request:
             return data
 
-        local_namespace = locals()
-        local_namespace["q"] = Q()
+        q = Q()
         self.terms = {}
         # discrete searches
         for key, val in distinct.items():
             if key in self.table_class.Meta.searches:
-                args = 'q = q.__and__(Q({0}__contains="{1}"))'.format(key, val)
-                try:
-                    exec(args, globals(), local_namespace)  # sets the value of q
-                except SyntaxError:
-                    # should log exception somewhere...
-                    continue  # just skip this term - results in a query matching All.
+                q &= Q(**{"%s__contains" % key: val})
             if hasattr(self.table_class.Meta, 'queries') and key in self.table_class.Meta.queries.keys():
                 # note that this calls the function 'key' with the argument from the search
-                args = 'q = q.__and__(self.{0}("{1}"))'.format(key, val)
-                try:
-                    exec(args, globals(), local_namespace)
-                except SyntaxError:
-                    # should log exception somewhere...
-                    continue
+                q &= getattr(self, key)(val)
         # general OR searches
-        if self.request.GET.get(table_search):
-            self.terms["search"] = escape(self.request.GET.get(table_search))
-        if hasattr(self.table_class.Meta, 'searches') and 'search' in self.terms:
+        term = self.request.GET.get(table_search)
+        if term:
+            self.terms["search"] = escape(term)
+        if hasattr(self.table_class.Meta, 'search_document') and term:
+            search = document_filter(self.table_class.Meta.search_document, term)
+            if 'id' in getattr(self.table_class.Meta, 'searches', {}) and term.strip().isdigit():
+                search |= Q(id=int(term))
+            q &= search
+        elif hasattr(self.table_class.Meta, 'searches') and term:
+            search = Q()
             for key, val in self.table_class.Meta.searches.items():
-                # this is a little bit of magic - creates an OR clause in the query based
-                # on the iterable search hash passed in via the table_class
+                # every simple search column in the table is queried at the same time with OR
                 # e.g. self.searches = {'id', 'contains'}
-                # so every simple search column in the table is queried at the same time with OR
-                args = 'q = q.__or__(Q({0}__{1}=self.terms["search"]))'.format(key, val)
-                try:
-                    exec(args, globals(), local_namespace)  # sets the value of q
-                except SyntaxError:
-                    # should log exception somewhere...
-                    continue  # just skip this term - results in a query matching All.
+                search |= Q(**{"%s__%s" % (key, val): term})
             # call explicit handlers as simple text searches of relational fields.
             if hasattr(self.table_class.Meta, 'queries'):
                 for key in self.table_class.Meta.queries:
                     # note that this calls the function 'key' with the argument from the search
-                    args = 'q = q.__or__(self.{0}("{1}"))'.format(key, self.terms["search"].encode("utf-8"))
-                    try:
-                        exec(args, globals(), local_namespace)
-                    except SyntaxError:
-                        # should log exception somewhere...
-                        continue
+                    search |= getattr(self, key)(term)
+            q &= search
         # now add "class specials" - from an iterable hash
         # datetime uses (start_time__lte=datetime.now()-timedelta(days=3)
-        data = data.filter(self._time_filter(local_namespace["q"]))
+        data = data.filter(self._time_filter(q))
         return data
 
 
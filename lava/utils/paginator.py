@@ -0,0 +1,125 @@
+from __future__ import unicode_literals
+
+from django.core.exceptions import FieldDoesNotExist
+from django.core.paginator import Paginator
+from django.db import connection
+from django.db.models import Q
+from django.db.models.query import QuerySet
+from django.utils import six
+from django.utils.functional import cached_property
+
+# Below this estimated number of rows, counting is cheap enough
+ESTIMATE_THRESHOLD = 10000
+
+
+def estimated_count(model):
+    """
+    Number of rows of the model table according to the planner statistics
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT reltuples FROM pg_class WHERE oid = %s::regclass",
+                       [model._meta.db_table])
+        row = cursor.fetchone()
+    return int(row[0]) if row else 0
+
+
+def seek_filter(fields, values, descending):
+    """
+    Row comparison (fields) <= (values), or >= when ascending, written with
+    simple lookups: f1 < v1 OR (f1 = v1 AND (f2 < v2 OR ...))
+    """
+    lookup = "lt" if descending else "gt"
+    (field, value) = (fields[-1], values[-1])
+    query = Q(**{"%s__%se" % (field, lookup): value})
+    for field, value in reversed(list(zip(fields[:-1], values[:-1]))):
+        query = Q(**{"%s__%s" % (field, lookup): value}) | (Q(**{field: value}) & query)
+    return query
+
+
+class KeysetPaginator(Paginator):
+    """
+    Paginator for large tables, used with django-tables2:
+
+        RequestConfig(request, paginate={"per_page": table.length,
+                                         "paginator_class": KeysetPaginator})
+
+    - unfiltered tables are counted with the planner estimate
+    - when the table is ordered by non-null columns of the model, the page is
+      selected with a seek predicate on these columns (plus the primary key)
+      instead of an OFFSET. The first row of the page is found by a query
+      selecting only the ordering columns, which can be an index only scan.
+      Other orderings are paginated with OFFSET as usual.
+    """
+
+    def _table_data(self):
+        # django-tables2 paginates the BoundRows of the table: the queryset
+        # is the data of its TableQuerysetData
+        table_data = getattr(self.object_list, "data", None)
+        if isinstance(getattr(table_data, "data", None), QuerySet):
+            return table_data
+        return None
+
+    @cached_property
+    def count(self):
+        table_data = self._table_data()
+        if table_data is not None and not table_data.data.query.where:
+            estimate = estimated_count(table_data.data.model)
+            if estimate > ESTIMATE_THRESHOLD:
+                return estimate
+        return super(KeysetPaginator, self).count
+
+    def _seek_ordering(self, queryset):
+        """
+        Return the (fields, descending) of the ordering if it can be used to
+        seek, or None.
+        """
+        ordering = queryset.query.order_by or queryset.model._meta.ordering
+        if not ordering or queryset.query.extra_order_by:
+            return None
+        pk_name = queryset.model._meta.pk.name
+        fields = []
+        directions = set()
+        for item in ordering:
+            if not isinstance(item, six.string_types):
+                return None
+            name = item.lstrip("-")
+            if name == "pk":
+                name = pk_name
+            try:
+                field = queryset.model._meta.get_field(name)
+            except FieldDoesNotExist:
+                return None
+            if not field.concrete or field.null or field.is_relation:
+                return None
+            fields.append(name)
+            directions.add(item.startswith("-"))
+        if len(directions) != 1:
+            return None
+        if pk_name not in fields:
+            fields.append(pk_name)
+        return (fields, directions.pop())
+
+    def page(self, number):
+        number = self.validate_number(number)
+        table_data = self._table_data()
+        seek = None if table_data is None else self._seek_ordering(table_data.data)
+        if seek is None:
+            return super(KeysetPaginator, self).page(number)
+
+        (fields, descending) = seek
+        queryset = table_data.data.order_by(*[("-%s" % f) if descending else f for f in fields])
+        bottom = (number - 1) * self.per_page
+        if bottom:
+            boundary = list(queryset.values_list(*fields)[bottom:bottom + 1])
+            if not boundary:
+                return self._get_page([], number, self)
+            queryset = queryset.filter(seek_filter(fields, boundary[0], descending))
+
+        # Slice the rows of the table with the seek queryset as data
+        original = table_data.data
+        table_data.data = queryset
+        try:
+            rows = self.object_list[0:self.per_page]
+        finally:
+            table_data.data = original
+        return self._get_page(rows, number, self)
@@ -0,0 +1,58 @@
+from __future__ import unicode_literals
+
+import re
+
+from django.db.models import Lookup, Q, TextField, CharField
+
+# The text search configuration used by the search indexes. 'simple' does not
+# stem words so hostnames, job descriptions or test names are kept as written.
+SEARCH_CONFIG = "simple"
+
+
+@TextField.register_lookup
+@CharField.register_lookup
+class Matches(Lookup):
+    """
+    Full text search on a text column, the right-hand side being a tsquery.
+
+    The left-hand side is rendered as to_tsvector('simple'::regconfig, column)
+    so that an index created on the same expression is used:
+
+    CREATE INDEX ... USING gin (to_tsvector('simple'::regconfig, column))
+    """
+    lookup_name = 'matches'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        params = lhs_params + rhs_params
+        return "to_tsvector('%s'::regconfig, %s) @@ to_tsquery('%s'::regconfig, %s)" % (
+            SEARCH_CONFIG, lhs, SEARCH_CONFIG, rhs), params
+
+
+def build_tsquery(term):
+    """
+    Translate a search term into a tsquery matching every word of the term
+    as a prefix: "qemu-stag 4.14" => "qemu-stag:* & 4.14:*"
+    The words are only split on spaces and on the tsquery operators: the
+    database then splits them with the parser used to build the tsvector,
+    so "4.14" or "1234.0" are kept as one word, like in the document.
+    Return None if the term does not contain any word.
+    """
+    words = [word for word in re.split(r"[\s&|!():*<>'\\]+", term, flags=re.UNICODE) if word]
+    if not words:
+        return None
+    return " & ".join("%s:*" % word.lower() for word in words)
+
+
+def document_filter(field, term):
+    """
+    Return the Q object matching the words of the term as prefixes of the
+    words of the search document stored in 'field'. This is a single
+    predicate on the full text search index: the term is not matched inside
+    a word.
+    """
+    query = build_tsquery(term)
+    if query is None:
+        return Q(pk__in=[])
+    return Q(**{"%s__matches" % field: query})
@@ -17,6 +17,7 @@
 # along with LAVA Server.  If not, see <http://www.gnu.org/licenses/>.
 
 import csv
+import datetime
 import io
 import yaml
 import sys
@@ -24,14 +25,18 @@ import sys
 from linaro_django_xmlrpc.models import ExposedAPI
 
 from django.db.models.fields import FieldDoesNotExist
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 
 from lava_results_app.dbutils import (
     export_testcase,
+    export_testcases,
     testcase_export_fields,
     export_testsuite,
     testsuite_export_fields
 )
 from lava_results_app.models import (
+    MeasurementPoint,
     Query,
     QueryCondition,
     RefreshLiveQueryError,
@@ -41,7 +46,16 @@ from lava_results_app.models import (
     TestData,
     InvalidContentTypeError,
 )
-from lava_results_app.utils import get_testcases_with_limit
+from lava_results_app.regressions import (
+    DEFAULT_FLAKY,
+    DEFAULT_JOBS,
+    DEFAULT_SHIFT,
+    MAX_JOBS,
+    analyse,
+    jobs_for_device_type,
+    jobs_for_query,
+)
+from lava_results_app.utils import testcases_with_limit_queryset
 from lava_scheduler_app.models import TestJob
 
 if sys.version_info[0] == 2:
@@ -292,10 +306,8 @@ class ResultsAPI(ExposedAPI):
             if not job.can_view(self.user):
                 raise xmlrpclib.Fault(
                     401, "Permission denied for user to job %s" % job_id)
-            yaml_list = []
-            for test_suite in job.testsuite_set.all():
-                for test_case in test_suite.testcase_set.all():
-                    yaml_list.append(export_testcase(test_case))
+            test_cases = TestCase.objects.filter(suite__job=job).order_by('suite_id', 'id')
+            yaml_list = list(export_testcases(test_cases))
 
         except TestJob.DoesNotExist:
             raise xmlrpclib.Fault(404, "Specified job not found.")
@@ -387,9 +399,9 @@ class ResultsAPI(ExposedAPI):
                 extrasaction='ignore',
                 fieldnames=testcase_export_fields())
             writer.writeheader()
-            for test_suite in job.testsuite_set.all():
-                for row in test_suite.testcase_set.all():
-                    writer.writerow(export_testcase(row))
+            test_cases = TestCase.objects.filter(suite__job=job).order_by('suite_id', 'id')
+            for row in export_testcases(test_cases):
+                writer.writerow(row)
 
         except TestJob.DoesNotExist:
             raise xmlrpclib.Fault(404, "Specified job not found.")
@@ -519,11 +531,9 @@ class ResultsAPI(ExposedAPI):
             if not job.can_view(self.user):
                 raise xmlrpclib.Fault(
                     401, "Permission denied for user to job %s" % job_id)
-            yaml_list = []
             test_suite = job.testsuite_set.get(name=suite_name)
-            for test_case in get_testcases_with_limit(test_suite,
-                                                      limit, offset):
-                yaml_list.append(export_testcase(test_case))
+            test_cases = testcases_with_limit_queryset(test_suite, limit, offset)
+            yaml_list = list(export_testcases(test_cases))
 
         except TestJob.DoesNotExist:
             raise xmlrpclib.Fault(404, "Specified job not found.")
@@ -577,8 +587,9 @@ class ResultsAPI(ExposedAPI):
                 fieldnames=testcase_export_fields())
             writer.writeheader()
             test_suite = job.testsuite_set.get(name=suite_name)
-            for row in get_testcases_with_limit(test_suite, limit, offset):
-                writer.writerow(export_testcase(row))
+            test_cases = testcases_with_limit_queryset(test_suite, limit, offset)
+            for row in export_testcases(test_cases):
+                writer.writerow(row)
 
         except TestJob.DoesNotExist:
             raise xmlrpclib.Fault(404, "Specified job not found.")
@@ -621,7 +632,7 @@ class ResultsAPI(ExposedAPI):
                     401, "Permission denied for user to job %s" % job_id)
 
             test_suite = job.testsuite_set.get(name=suite_name)
-            test_case_count = test_suite.testcase_set.all().count()
+            test_case_count = test_suite.count_total
 
         except TestJob.DoesNotExist:
             raise xmlrpclib.Fault(404, "Specified job not found.")
@@ -668,7 +679,7 @@ class ResultsAPI(ExposedAPI):
                     401, "Permission denied for user to job %s" % job_id)
             test_suite = job.testsuite_set.get(name=suite_name)
             test_cases = test_suite.testcase_set.filter(name=case_name)
-            yaml_list = [export_testcase(test_case) for test_case in test_cases]
+            yaml_list = list(export_testcases(test_cases))
 
         except TestJob.DoesNotExist:
             raise xmlrpclib.Fault(404, "Specified job not found.")
@@ -735,3 +746,148 @@ class ResultsAPI(ExposedAPI):
             raise xmlrpclib.Fault(404, "Specified test case not found.")
 
         return output.getvalue()
+
+    def get_measurement_trend(self, suite_name, case_name, device_type=None,
+                              device=None, start=None, end=None, points=500):
+        """
+        Name
+        ----
+        `get_measurement_trend` (`suite_name`, `case_name`, `device_type=None`,
+                                 `device=None`, `start=None`, `end=None`,
+                                 `points=500`)
+
+        Description
+        -----------
+        Get the trend of a test case measurement across the finished jobs.
+        The measurements are grouped in at most `points` periods of the same
+        duration.
+
+        Arguments
+        ---------
+        `suite_name`: string
+            Name of the test suite.
+        `case_name`: string
+            Name of the test case.
+        `device_type`: string
+            Only include the jobs that ran on this device type.
+        `device`: string
+            Only include the jobs that ran on this device.
+        `start`: string
+            Start of the trend (YYYY-MM-DD or YYYY-MM-DD HH:MM:SS).
+            Default: 90 days before `end`.
+        `end`: string
+            End of the trend (YYYY-MM-DD or YYYY-MM-DD HH:MM:SS). Default: now.
+        `points`: integer
+            Maximum number of periods. Default: 500.
+
+        Return value
+        ------------
+        This function returns a list of dictionaries, one by period: start
+        (the end time of the first job of the period), average, minimum,
+        maximum, count (number of measurements) and failures.
+        """
+
+        self._authenticate()
+        try:
+            points = int(points)
+        except ValueError:
+            raise xmlrpclib.Fault(400, "Bad request: points should be an integer.")
+        if points <= 0:
+            raise xmlrpclib.Fault(400, "Bad request: points should be positive.")
+        end = self._parse_trend_time(end, timezone.now())
+        start = self._parse_trend_time(start, end - datetime.timedelta(days=90))
+        if start >= end:
+            raise xmlrpclib.Fault(400, "Bad request: start should be before end.")
+
+        measurements = MeasurementPoint.objects.filter(suite=suite_name, case=case_name)
+        if device_type:
+            measurements = measurements.filter(device_type=device_type)
+        if device:
+            measurements = measurements.filter(device=device)
+        trend = measurements.visible_by_user(self.user).downsample(start, end, points)
+        for period in trend:
+            period["start"] = str(period["start"])
+        return trend
+
+    @staticmethod
+    def _parse_trend_time(value, default):
+        if not value:
+            return default
+        parsed = parse_datetime(value)
+        if parsed is None:
+            parsed = parse_date(value)
+            if parsed is not None:
+                parsed = datetime.datetime.combine(parsed, datetime.time())
+        if parsed is None:
+            raise xmlrpclib.Fault(400, "Bad request: invalid date '%s'." % value)
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        return parsed
+
+    def get_regressions(self, device_type=None, query_name=None, username=None,
+                        jobs=DEFAULT_JOBS, flaky=DEFAULT_FLAKY, shift=DEFAULT_SHIFT):
+        """
+        Name
+        ----
+        `get_regressions` (`device_type=None`, `query_name=None`, `username=None`,
+                           `jobs=100`, `flaky=0.3`, `shift=0.1`)
+
+        Description
+        -----------
+        Compare the results of the last finished jobs of a device type or of
+        a query, test case by test case.
+
+        Arguments
+        ---------
+        `device_type`: string
+            Analyse the last jobs of this device type.
+        `query_name`: string
+            Analyse the last jobs of this query (when device_type is not set).
+        `username`: string
+            Owner of the query. Defaults to the authenticated user.
+        `jobs`: integer
+            Number of jobs to analyse. Defaults to 100, at most 1000.
+        `flaky`: float
+            Ratio of result changes between consecutive runs above which a
+            test case is flaky. Defaults to 0.3.
+        `shift`: float
+            Relative change of the average measurement of the last 5 runs,
+            compared with the previous runs, above which a measurement has
+            shifted. Defaults to 0.1.
+
+        Return value
+        ------------
+        A dictionary with the number of analysed jobs and the lists of
+        `regressions` (pass then fail), `progressions` (fail then pass),
+        `flaky` test cases and measurement `shifts`. Each test case is
+        described by its suite, case, number of runs and last job id.
+        """
+        self._authenticate()
+        try:
+            jobs = int(jobs)
+            flaky = float(flaky)
+            shift = float(shift)
+        except (TypeError, ValueError):
+            raise xmlrpclib.Fault(400, "Bad request: invalid parameters.")
+        if jobs < 1:
+            raise xmlrpclib.Fault(400, "Bad request: invalid number of jobs.")
+        jobs = min(jobs, MAX_JOBS)
+        if device_type:
+            job_ids = jobs_for_device_type(device_type, self.user, jobs)
+        elif query_name:
+            if not username:
+                username = self.user.username
+            try:
+                query = Query.objects.get(name=query_name, owner__username=username)
+            except Query.DoesNotExist:
+                raise xmlrpclib.Fault(
+                    404, "Query with name %s owned by user %s does not exist." %
+                    (query_name, username))
+            if not query.is_accessible_by(self.user):
+                raise xmlrpclib.Fault(
+                    403, "Permission denied for user to query %s" % query_name)
+            job_ids = jobs_for_query(query, self.user, jobs)
+        else:
+            raise xmlrpclib.Fault(400, "Bad request: device_type or query_name "
+                                  "should be specified.")
+        return analyse(job_ids, flaky=flaky, shift=shift)
@@ -23,6 +23,7 @@ from __future__ import unicode_literals
 
 import hashlib
 import os
+import simplejson
 import yaml
 import sys
 import logging
@@ -30,6 +31,7 @@ import decimal
 
 from collections import OrderedDict  # pylint: disable=unused-import
 from lava_results_app.models import (
+    BugLink,
     TestSuite,
     TestSet,
     TestCase,
@@ -38,7 +40,9 @@ from lava_results_app.models import (
     MetaType,
 )
 from lava_results_app.utils import debian_package_version
+from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import MultipleObjectsReturned
+from django.core.urlresolvers import reverse
 from lava_dispatcher.action import Timeout
 
 if sys.version_info[0] == 2:
@@ -112,6 +116,14 @@ def create_metadata_store(results, job):
     return meta_filename
 
 
+def json_metadata(data):
+    """
+    Convert the metadata of a test case to plain JSON types. The values
+    that JSON does not support (like dates) are stored as strings.
+    """
+    return simplejson.loads(simplejson.dumps(data, default=str, skipkeys=True))
+
+
 def map_scanned_results(results, job, meta_filename):  # pylint: disable=too-many-branches,too-many-statements,too-many-return-statements
     """
     Sanity checker on the logged results dictionary
@@ -134,12 +146,12 @@ def map_scanned_results(results, job, meta_filename):  # pylint: disable=too-man
     if 'extra' in results:
         results['extra'] = meta_filename
 
-    metadata = yaml.dump(results)
-    if len(metadata) > 4096:  # bug 2471 - test_length unit test
+    metadata = json_metadata(results)
+    if len(simplejson.dumps(metadata)) > 4096:  # bug 2471 - test_length unit test
         msg = "[%d] Result metadata is too long. %s" % (job.id, metadata)
         logger.error(msg)
         append_failure_comment(job, msg)
-        metadata = ""
+        metadata = None
 
     suite, _ = TestSuite.objects.get_or_create(name=results["definition"], job=job)
     testset = _check_for_testset(results, suite)
@@ -162,7 +174,7 @@ def map_scanned_results(results, job, meta_filename):  # pylint: disable=too-man
         test_case = TestCase(name=name,
                              suite=suite,
                              test_set=testset,
-                             metadata=metadata,
+                             metadata_json=metadata,
                              measurement=measurement,
                              units=units,
                              result=result_val)
@@ -188,7 +200,7 @@ def map_scanned_results(results, job, meta_filename):  # pylint: disable=too-man
                                  suite=suite,
                                  test_set=testset,
                                  result=TestCase.RESULT_MAP[result],
-                                 metadata=metadata,
+                                 metadata_json=metadata,
                                  measurement=measurement,
                                  units=units)
         except decimal.InvalidOperation:
@@ -475,6 +487,113 @@ def export_testcase(testcase, with_buglinks=False):
     return casedict
 
 
+# Columns read by export_testcases, in the order of the values_list tuples
+TESTCASE_EXPORT_VALUES = (
+    'id', 'name', 'result', 'measurement', 'units', 'logged', 'metadata',
+    'suite__name', 'suite__job_id', 'metadata_json',
+)
+TESTCASE_EXPORT_BATCH = 1000
+
+
+def _load_metadata_batch(batch):
+    """
+    Parse the metadata of a batch of test cases with a single call to the
+    C loader. The YAML strings are concatenated as a multi-document stream.
+    Fallback to one document at a time if the stream does not match the
+    batch (invalid YAML or a metadata string containing document markers).
+    :param batch: list of metadata strings (or None)
+    :return: list of parsed metadata, in the same order as batch
+    """
+    indexes = [index for (index, metadata) in enumerate(batch) if metadata]
+    ret = [None] * len(batch)
+    if not indexes:
+        return ret
+    stream = "\n---\n".join(batch[index] for index in indexes)
+    try:
+        documents = list(yaml.load_all(stream, Loader=yaml.CLoader))
+    except yaml.YAMLError:
+        documents = []
+    if len(documents) == len(indexes):
+        for (index, document) in zip(indexes, documents):
+            ret[index] = document
+        return ret
+    for index in indexes:
+        try:
+            ret[index] = yaml.load(batch[index], Loader=yaml.CLoader)
+        except yaml.YAMLError:
+            ret[index] = None
+    return ret
+
+
+def _export_rows(rows, url_template, buglinks):
+    # Only the test cases that were not converted to json need parsing
+    metadatas = _load_metadata_batch([row[6] if row[9] is None else None for row in rows])
+    for (row, action_metadata) in zip(rows, metadatas):
+        (case_id, name, result, measurement, units, logged, _, suite_name, job_id, metadata_json) = row
+        if metadata_json is not None:
+            action_metadata = metadata_json
+        metadata = dict(action_metadata) if action_metadata else {}
+        extra_data = metadata.get('extra', None)
+        if isinstance(extra_data, basestring) and os.path.exists(extra_data):
+            with open(extra_data, 'r') as extra_file:
+                items = yaml.load(extra_file, Loader=yaml.CLoader)
+            # hide the !!python OrderedDict prefix from the output.
+            metadata['extra'] = [{key: value} for (key, value) in items.items()]
+        casedict = {
+            'name': str(name),
+            'job': str(job_id),
+            'suite': str(suite_name),
+            'result': str(TestCase.RESULT_REVERSE[result]),
+            'measurement': str(measurement),
+            'unit': str(units),
+            'level': metadata.get('level', ''),
+            'url': url_template % case_id,
+            'id': str(case_id),
+            'logged': str(logged),
+            'metadata': metadata,
+        }
+        if buglinks is not None:
+            casedict['buglinks'] = buglinks.get(case_id, [])
+        yield casedict
+
+
+def _batch_buglinks(rows):
+    buglinks = {}
+    links = BugLink.objects.filter(
+        content_type=ContentType.objects.get_for_model(TestCase),
+        object_id__in=[row[0] for row in rows])
+    for (object_id, url) in links.values_list('object_id', 'url'):
+        buglinks.setdefault(object_id, []).append(str(url))
+    return buglinks
+
+
+def export_testcases(testcases, with_buglinks=False):
+    """
+    Bulk version of export_testcase, for exports of whole jobs or suites.
+    Rows are streamed from the database (server side cursor) with the suite
+    and the job joined, the URL is built from a template computed once and
+    the metadata is parsed in batches, keeping the memory usage constant.
+    The dictionaries are identical to the ones returned by export_testcase.
+    :param testcases: TestCase queryset
+    :return: generator of dictionaries formatted for export
+    """
+    url_template = reverse("lava.results.testcase", args=[0])
+    url_template = url_template.rsplit('/', 1)[0] + '/%d'
+    rows = testcases.values_list(*TESTCASE_EXPORT_VALUES).iterator()
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= TESTCASE_EXPORT_BATCH:
+            buglinks = _batch_buglinks(batch) if with_buglinks else None
+            for casedict in _export_rows(batch, url_template, buglinks):
+                yield casedict
+            batch = []
+    if batch:
+        buglinks = _batch_buglinks(batch) if with_buglinks else None
+        for casedict in _export_rows(batch, url_template, buglinks):
+            yield casedict
+
+
 def testsuite_export_fields():
     """
     Keep this list in sync with the keys in export_testsuite
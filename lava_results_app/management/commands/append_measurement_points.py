@@ -0,0 +1,50 @@
+# Copyright (C) 2018 Linaro Limited
+#
+# This file is part of LAVA Server.
+#
+# LAVA Server is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# LAVA Server is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along
+# with this program; if not, see <http://www.gnu.org/licenses>.
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from lava_results_app.models import MeasurementPoint
+from lava_scheduler_app.models import TestJob
+
+
+class Command(BaseCommand):
+    help = "Copy the measurements of the finished jobs that are missing from the charts table"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--job", default=None, type=int,
+                            help="Only append the measurements of this job")
+        parser.add_argument("--batch-size", default=1000, type=int,
+                            help="Number of jobs processed in each transaction. Default: 1000")
+
+    def handle(self, *args, **options):
+        jobs = TestJob.objects.filter(state=TestJob.STATE_FINISHED, end_time__isnull=False)
+        if options["job"] is not None:
+            jobs = jobs.filter(id=options["job"])
+
+        total = 0
+        last_id = 0
+        while True:
+            batch = list(jobs.filter(id__gt=last_id).order_by("id")
+                         .values_list("id", flat=True)[:options["batch_size"]])
+            if not batch:
+                break
+            with transaction.atomic():
+                total += MeasurementPoint.append(batch)
+            last_id = batch[-1]
+            self.stdout.write("%d measurements appended" % total)
@@ -0,0 +1,56 @@
+# Copyright (C) 2018 Linaro Limited
+#
+# This file is part of LAVA Server.
+#
+# LAVA Server is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# LAVA Server is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along
+# with this program; if not, see <http://www.gnu.org/licenses>.
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from lava_results_app.dbutils import _load_metadata_batch, json_metadata
+from lava_results_app.models import LavaResult, TestCase
+
+
+class Command(BaseCommand):
+    help = "Convert the YAML metadata of the test cases to json"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", default=1000, type=int,
+                            help="Number of test cases converted in each transaction. Default: 1000")
+
+    def handle(self, *args, **options):
+        cases = TestCase.objects.filter(metadata_json__isnull=True, metadata__isnull=False) \
+                                .exclude(metadata="").order_by("id")
+        (converted, invalid) = (0, 0)
+        last_id = 0
+        while True:
+            batch = list(cases.filter(id__gt=last_id).values_list("id", "metadata")[:options["batch_size"]])
+            if not batch:
+                break
+            last_id = batch[-1][0]
+            metadatas = _load_metadata_batch([metadata for (_, metadata) in batch])
+            with transaction.atomic():
+                for ((case_id, _), metadata) in zip(batch, metadatas):
+                    if not isinstance(metadata, dict):
+                        # Keep the YAML string, still shown as is
+                        invalid += 1
+                        continue
+                    TestCase.objects.filter(id=case_id).update(metadata_json=json_metadata(metadata),
+                                                               metadata=None)
+                    converted += 1
+            self.stdout.write("%d test cases converted" % converted)
+        if invalid:
+            self.stdout.write("%d test cases with invalid metadata were kept as YAML" % invalid)
+        self.stdout.write("%d lava results indexed" % LavaResult.refresh())
@@ -0,0 +1,49 @@
+# Copyright (C) 2018 Linaro Limited
+#
+# This file is part of LAVA Server.
+#
+# LAVA Server is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# LAVA Server is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along
+# with this program; if not, see <http://www.gnu.org/licenses>.
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from lava_results_app.models import TestSuite
+
+
+class Command(BaseCommand):
+    help = "Recompute the result counters of the test suites from the test cases"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--job", default=None, type=int,
+                            help="Only refresh the suites of this job")
+        parser.add_argument("--batch-size", default=10000, type=int,
+                            help="Number of suites refreshed in each transaction. Default: 10000")
+
+    def handle(self, *args, **options):
+        suites = TestSuite.objects.all()
+        if options["job"] is not None:
+            suites = suites.filter(job_id=options["job"])
+
+        total = 0
+        last_id = 0
+        while True:
+            batch = list(suites.filter(id__gt=last_id).order_by("id")
+                         .values_list("id", flat=True)[:options["batch_size"]])
+            if not batch:
+                break
+            with transaction.atomic():
+                total += TestSuite.objects.filter(id__in=batch).refresh_counters()
+            last_id = batch[-1]
+            self.stdout.write("%d suites refreshed" % total)
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.10 on 2018-03-05 10:12
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lava_results_app', '0015_add_test_case_result_index'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql="CREATE INDEX lava_results_app_testsuite_name_search ON lava_results_app_testsuite "
+                "USING gin (to_tsvector('simple'::regconfig, name))",
+            reverse_sql="DROP INDEX lava_results_app_testsuite_name_search"),
+    ]
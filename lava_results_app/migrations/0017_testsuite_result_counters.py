@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.10 on 2018-03-12 09:47
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lava_results_app', '0016_testsuite_name_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='testsuite',
+            name='count_pass',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='testsuite',
+            name='count_fail',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='testsuite',
+            name='count_skip',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='testsuite',
+            name='count_unknown',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='testsuite',
+            name='first_logged',
+            field=models.DateTimeField(blank=True, default=None, null=True),
+        ),
+        migrations.RunSQL(
+            sql="UPDATE lava_results_app_testsuite AS suite "
+                "SET count_pass = counts.count_pass, count_fail = counts.count_fail, "
+                "count_skip = counts.count_skip, count_unknown = counts.count_unknown, "
+                "first_logged = counts.first_logged "
+                "FROM (SELECT suite_id, COUNT(*) FILTER (WHERE result = 0) AS count_pass, "
+                "COUNT(*) FILTER (WHERE result = 1) AS count_fail, "
+                "COUNT(*) FILTER (WHERE result = 2) AS count_skip, "
+                "COUNT(*) FILTER (WHERE result = 3) AS count_unknown, "
+                "MIN(logged) AS first_logged "
+                "FROM lava_results_app_testcase GROUP BY suite_id) AS counts "
+                "WHERE suite.id = counts.suite_id",
+            reverse_sql=migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.10 on 2018-03-14 11:02
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations
+
+
+INDEXED_KEYS = ["level", "error_type", "duration", "test_definition_start"]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lava_results_app', '0017_testsuite_result_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='testcase',
+            name='metadata_json',
+            field=django.contrib.postgres.fields.jsonb.JSONField(blank=True, default=None, help_text="Metadata collected by the pipeline action. The 'extra' data is stored in a file, referenced by name.", null=True, verbose_name='Action meta data'),
+        ),
+    ] + [
+        migrations.RunSQL(
+            sql="CREATE INDEX lava_results_app_testcase_metadata_%s ON lava_results_app_testcase "
+                "((metadata_json -> '%s'))" % (key, key),
+            reverse_sql="DROP INDEX lava_results_app_testcase_metadata_%s" % key)
+        for key in INDEXED_KEYS
+    ]
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.10 on 2018-03-15 10:21
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lava_results_app', '0018_testcase_metadata_json'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LavaResult',
+            fields=[
+                ('testcase', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='lava_result', serialize=False, to='lava_results_app.TestCase')),
+                ('level', models.CharField(blank=True, default='', max_length=32)),
+                ('error_type', models.CharField(blank=True, db_index=True, default='', max_length=32)),
+                ('error_msg', models.TextField(blank=True, default='')),
+                ('definition', models.CharField(blank=True, default='', max_length=200)),
+                ('success', models.CharField(blank=True, default='', max_length=200)),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lava_results', to='lava_scheduler_app.TestJob')),
+            ],
+        ),
+        migrations.RunSQL(
+            sql="INSERT INTO lava_results_app_lavaresult "
+                "(testcase_id, job_id, level, error_type, error_msg, definition, success) "
+                "SELECT testcase.id, suite.job_id, "
+                "LEFT(COALESCE(testcase.metadata_json ->> 'level', ''), 32), "
+                "LEFT(COALESCE(testcase.metadata_json ->> 'error_type', ''), 32), "
+                "COALESCE(testcase.metadata_json ->> 'error_msg', ''), "
+                "LEFT(COALESCE(testcase.metadata_json ->> 'test_definition_start', ''), 200), "
+                "LEFT(COALESCE(testcase.metadata_json ->> 'success', ''), 200) "
+                "FROM lava_results_app_testcase AS testcase "
+                "JOIN lava_results_app_testsuite AS suite ON suite.id = testcase.suite_id "
+                "WHERE suite.name = 'lava' AND jsonb_typeof(testcase.metadata_json) = 'object' "
+                "AND testcase.metadata_json ?| ARRAY['level', 'error_type', 'error_msg', "
+                "'test_definition_start', 'success']",
+            reverse_sql=migrations.RunSQL.noop),
+    ]
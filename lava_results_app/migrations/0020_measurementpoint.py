@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.10 on 2018-03-16 14:05
+from __future__ import unicode_literals
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lava_results_app', '0019_lavaresult'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MeasurementPoint',
+            fields=[
+                ('testcase', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='measurement_point', serialize=False, to='lava_results_app.TestCase')),
+                ('end_time', models.DateTimeField()),
+                ('device', models.CharField(blank=True, default='', max_length=200)),
+                ('device_type', models.CharField(blank=True, default='', max_length=200)),
+                ('suite', models.CharField(blank=True, default='', max_length=200)),
+                ('case', models.TextField()),
+                ('measurement', models.FloatField()),
+                ('result', models.PositiveSmallIntegerField(choices=[(0, 'Test passed'), (1, 'Test failed'), (2, 'Test skipped'), (3, 'Unknown outcome')])),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='measurement_points', to='lava_scheduler_app.TestJob')),
+            ],
+        ),
+        # Fill the table before creating the indexes, in end_time order
+        migrations.RunSQL(
+            sql="INSERT INTO lava_results_app_measurementpoint "
+                "(testcase_id, job_id, end_time, device, device_type, suite, \"case\", measurement, result) "
+                "SELECT testcase.id, job.id, job.end_time, COALESCE(job.actual_device_id, ''), "
+                "COALESCE(device.device_type_id, job.requested_device_type_id, ''), "
+                "COALESCE(suite.name, ''), testcase.name, testcase.measurement, testcase.result "
+                "FROM lava_results_app_testcase AS testcase "
+                "JOIN lava_results_app_testsuite AS suite ON suite.id = testcase.suite_id "
+                "JOIN lava_scheduler_app_testjob AS job ON job.id = suite.job_id "
+                "LEFT JOIN lava_scheduler_app_device AS device ON device.hostname = job.actual_device_id "
+                "WHERE testcase.measurement IS NOT NULL AND job.end_time IS NOT NULL "
+                "ORDER BY job.end_time",
+            reverse_sql=migrations.RunSQL.noop),
+        migrations.AddIndex(
+            model_name='measurementpoint',
+            index=django.contrib.postgres.indexes.BrinIndex(fields=['end_time'], name='measurement_end_time_brin'),
+        ),
+        migrations.AddIndex(
+            model_name='measurementpoint',
+            index=models.Index(fields=['suite', 'case', 'end_time'], name='measurement_series_idx'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.10 on 2018-03-19 09:12
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lava_results_app', '0020_measurementpoint'),
+    ]
+
+    operations = [
+        # The values can be too long for a btree index: index their md5
+        migrations.RunSQL(
+            sql="CREATE INDEX lava_results_app_namedtestattribute_name_value "
+                "ON lava_results_app_namedtestattribute (content_type_id, name, md5(value))",
+            reverse_sql="DROP INDEX lava_results_app_namedtestattribute_name_value"),
+    ]
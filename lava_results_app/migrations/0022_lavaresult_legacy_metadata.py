@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.10 on 2018-03-22 14:05
+from __future__ import unicode_literals
+
+from django.db import migrations
+from lava_results_app.dbutils import _load_metadata_batch
+
+
+BATCH_SIZE = 1000
+# LavaResult field, metadata key and maximum length
+FIELDS = [
+    ('level', 'level', 32),
+    ('error_type', 'error_type', 32),
+    ('error_msg', 'error_msg', None),
+    ('definition', 'test_definition_start', 200),
+    ('success', 'success', 200),
+]
+
+
+def index_legacy_metadata(apps, schema_editor):
+    # Index the lava suite test cases whose metadata is still stored as
+    # YAML, until migrate_testcase_metadata converts them.
+    TestCase = apps.get_model("lava_results_app", "TestCase")
+    LavaResult = apps.get_model("lava_results_app", "LavaResult")
+    db_alias = schema_editor.connection.alias
+    cases = TestCase.objects.using(db_alias) \
+                            .filter(suite__name="lava", metadata_json__isnull=True,
+                                    metadata__isnull=False, lava_result__isnull=True) \
+                            .exclude(metadata="").order_by("id")
+    last_id = 0
+    while True:
+        batch = list(cases.filter(id__gt=last_id)
+                     .values_list("id", "suite__job_id", "metadata")[:BATCH_SIZE])
+        if not batch:
+            break
+        last_id = batch[-1][0]
+        results = []
+        metadatas = _load_metadata_batch([metadata for (_, _, metadata) in batch])
+        for ((case_id, job_id, _), metadata) in zip(batch, metadatas):
+            if not isinstance(metadata, dict):
+                continue
+            values = {}
+            for (field, key, max_length) in FIELDS:
+                value = metadata.get(key)
+                values[field] = ('%s' % value)[:max_length] if value is not None else ''
+            if any(values.values()):
+                results.append(LavaResult(testcase_id=case_id, job_id=job_id, **values))
+        LavaResult.objects.using(db_alias).bulk_create(results)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lava_results_app', '0021_namedtestattribute_name_value_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(index_legacy_metadata, migrations.RunPython.noop),
+    ]
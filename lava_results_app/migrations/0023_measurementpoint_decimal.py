@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.10 on 2018-03-26 10:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lava_results_app', '0022_lavaresult_legacy_metadata'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='measurementpoint',
+            name='measurement',
+            field=models.DecimalField(decimal_places=10, max_digits=30),
+        ),
+        # Copy the exact values again from the test cases
+        migrations.RunSQL(
+            sql="UPDATE lava_results_app_measurementpoint AS point "
+                "SET measurement = testcase.measurement "
+                "FROM lava_results_app_testcase AS testcase "
+                "WHERE testcase.id = point.testcase_id",
+            reverse_sql=migrations.RunSQL.noop),
+    ]
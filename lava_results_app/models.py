@@ -30,7 +30,10 @@ TestCase is a single lava-test-case record or Action result.
 
 from __future__ import unicode_literals
 
+import collections
+import hashlib
 import logging
+import simplejson
 import sys
 import yaml
 
@@ -40,15 +43,18 @@ from django.contrib.admin.models import LogEntry, ADDITION
 from django.contrib.auth.models import User, Group
 from django.contrib.contenttypes import fields
 from django.contrib.contenttypes.models import ContentType
+from django.contrib.postgres.fields import JSONField
+from django.contrib.postgres.indexes import BrinIndex
 from django.core.validators import (
     MaxValueValidator,
     MinValueValidator
 )
 from django.db import models, connection, transaction
-from django.db.models import Q, Lookup
+from django.db.models import F, Q, Lookup
 from django.db.models.fields import Field
 from django.db.models.signals import pre_save
 from django.dispatch import receiver
+from django.utils.functional import cached_property
 from django.utils.translation import ugettext_lazy as _
 from django.utils import timezone
 
@@ -58,6 +64,7 @@ from lava_scheduler_app.models import (
     Device
 )
 from lava_scheduler_app.managers import (
+    MeasurementPointQuerySet,
     RestrictedTestJobQuerySet,
     RestrictedTestCaseQuerySet,
     RestrictedTestSuiteQuerySet
@@ -219,18 +226,49 @@ class TestSuite(models.Model, Queryable):
         max_length=200
     )
 
+    # Number of test cases by result, updated in the transaction that saves
+    # the test cases. See update_counters() and refresh_counters().
+    count_pass = models.PositiveIntegerField(default=0)
+    count_fail = models.PositiveIntegerField(default=0)
+    count_skip = models.PositiveIntegerField(default=0)
+    count_unknown = models.PositiveIntegerField(default=0)
+    first_logged = models.DateTimeField(null=True, blank=True, default=None)
+
+    @property
+    def count_total(self):
+        return self.count_pass + self.count_fail + self.count_skip + self.count_unknown
+
+    @staticmethod
+    def update_counters(test_cases):
+        """
+        Add the test cases that were just saved to the counters of their
+        suites.
+        """
+        results = collections.defaultdict(collections.Counter)
+        first_logged = {}
+        for test_case in test_cases:
+            results[test_case.suite_id][test_case.result] += 1
+            if test_case.logged is not None:
+                first_logged[test_case.suite_id] = min(first_logged.get(test_case.suite_id, test_case.logged),
+                                                       test_case.logged)
+
+        for (suite_id, counts) in results.items():
+            fields = {name: F(name) + counts[result]
+                      for (result, name) in RESULT_COUNTERS.items() if counts[result]}
+            suites = TestSuite.objects.filter(pk=suite_id)
+            suites.update(**fields)
+            if suite_id in first_logged:
+                suites.filter(Q(first_logged__isnull=True) | Q(first_logged__gt=first_logged[suite_id])) \
+                      .update(first_logged=first_logged[suite_id])
+
     def get_passfail_results(self):
         # Get pass fail results per lava_results_app.testsuite.
         results = {}
         results[self.name] = {
-            'pass': self.testcase_set.filter(
-                result=TestCase.RESULT_MAP['pass']).count(),
-            'fail': self.testcase_set.filter(
-                result=TestCase.RESULT_MAP['fail']).count(),
-            'skip': self.testcase_set.filter(
-                result=TestCase.RESULT_MAP['skip']).count(),
-            'unknown': self.testcase_set.filter(
-                result=TestCase.RESULT_MAP['unknown']).count()
+            'pass': self.count_pass,
+            'fail': self.count_fail,
+            'skip': self.count_skip,
+            'unknown': self.count_unknown
         }
         return results
 
@@ -383,6 +421,8 @@ class TestCase(models.Model, Queryable):
         verbose_name=_(u"Measurement"),
     )
 
+    # Test cases created before metadata_json are converted by
+    # "lava-server manage migrate_testcase_metadata"
     metadata = models.CharField(
         blank=True,
         max_length=4096,
@@ -391,6 +431,15 @@ class TestCase(models.Model, Queryable):
         verbose_name=_(u"Action meta data as a YAML string")
     )
 
+    metadata_json = JSONField(
+        blank=True,
+        null=True,
+        default=None,
+        help_text=_(u"Metadata collected by the pipeline action. The "
+                    u"'extra' data is stored in a file, referenced by name."),
+        verbose_name=_(u"Action meta data")
+    )
+
     suite = models.ForeignKey(
         TestSuite,
     )
@@ -409,8 +458,10 @@ class TestCase(models.Model, Queryable):
 
     buglinks = fields.GenericRelation(BugLink)
 
-    @property
+    @cached_property
     def action_metadata(self):
+        if self.metadata_json is not None:
+            return self.metadata_json
         if not self.metadata:
             return None
         try:
@@ -471,6 +522,8 @@ class TestCase(models.Model, Queryable):
             value = "%s" % self.measurement
             if self.units:
                 value = "%s%s" % (self.measurement, self.units)
+        elif self.metadata_json:
+            value = yaml.dump(self.metadata_json)
         elif self.metadata:
             value = self.metadata
         else:
@@ -508,6 +561,188 @@ class TestCase(models.Model, Queryable):
         return self.RESULT_REVERSE[self.result]
 
 
+# TestSuite counter of each result
+RESULT_COUNTERS = {
+    TestCase.RESULT_PASS: "count_pass",
+    TestCase.RESULT_FAIL: "count_fail",
+    TestCase.RESULT_SKIP: "count_skip",
+    TestCase.RESULT_UNKNOWN: "count_unknown",
+}
+
+
+# Index the lava suite test cases stored as json, see LavaResult.refresh()
+LAVA_RESULT_SQL = (
+    "INSERT INTO lava_results_app_lavaresult "
+    "(testcase_id, job_id, level, error_type, error_msg, definition, success) "
+    "SELECT testcase.id, suite.job_id, "
+    "LEFT(COALESCE(testcase.metadata_json ->> 'level', ''), 32), "
+    "LEFT(COALESCE(testcase.metadata_json ->> 'error_type', ''), 32), "
+    "COALESCE(testcase.metadata_json ->> 'error_msg', ''), "
+    "LEFT(COALESCE(testcase.metadata_json ->> 'test_definition_start', ''), 200), "
+    "LEFT(COALESCE(testcase.metadata_json ->> 'success', ''), 200) "
+    "FROM lava_results_app_testcase AS testcase "
+    "JOIN lava_results_app_testsuite AS suite ON suite.id = testcase.suite_id "
+    "WHERE suite.name = 'lava' AND jsonb_typeof(testcase.metadata_json) = 'object' "
+    "AND testcase.metadata_json ?| ARRAY['level', 'error_type', 'error_msg', "
+    "'test_definition_start', 'success']"
+)
+
+
+class LavaResult(models.Model):
+    """
+    Fields of the lava suite test cases that the job pages and the job
+    errors view look up. Written when the test cases are saved so these
+    pages do not have to load and parse the metadata of every test case.
+    """
+
+    testcase = models.OneToOneField(
+        TestCase,
+        primary_key=True,
+        related_name='lava_result',
+        on_delete=models.CASCADE
+    )
+    job = models.ForeignKey(
+        TestJob,
+        related_name='lava_results',
+        on_delete=models.CASCADE
+    )
+    level = models.CharField(max_length=32, blank=True, default='')
+    error_type = models.CharField(max_length=32, blank=True, default='', db_index=True)
+    error_msg = models.TextField(blank=True, default='')
+    # name of the test definition, from test_definition_start
+    definition = models.CharField(max_length=200, blank=True, default='')
+    # uuid of the test definition
+    success = models.CharField(max_length=200, blank=True, default='')
+
+    @classmethod
+    def from_test_case(cls, test_case, job_id):
+        """
+        Return the LavaResult of a lava suite test case or None when the
+        metadata has none of the indexed fields.
+        """
+        metadata = test_case.action_metadata
+        if not isinstance(metadata, dict):
+            return None
+        fields = {
+            'level': metadata.get('level'),
+            'error_type': metadata.get('error_type'),
+            'error_msg': metadata.get('error_msg'),
+            'definition': metadata.get('test_definition_start'),
+            'success': metadata.get('success'),
+        }
+        if not any(fields.values()):
+            return None
+        for (name, value) in fields.items():
+            max_length = cls._meta.get_field(name).max_length
+            fields[name] = ('%s' % value)[:max_length] if value is not None else ''
+        return cls(testcase_id=test_case.pk, job_id=job_id, **fields)
+
+    @staticmethod
+    def index(test_cases):
+        """
+        Index the lava suite test cases that were just saved.
+        """
+        results = []
+        for test_case in test_cases:
+            if test_case.pk is None or test_case.suite.name != 'lava':
+                continue
+            result = LavaResult.from_test_case(test_case, test_case.suite.job_id)
+            if result is not None:
+                results.append(result)
+        if results:
+            LavaResult.objects.bulk_create(results)
+
+    @staticmethod
+    def refresh(job_ids=None):
+        """
+        Index the lava suite test cases stored as json that are not indexed
+        yet, for every job or only for job_ids.
+        """
+        sql = LAVA_RESULT_SQL
+        params = []
+        if job_ids is not None:
+            sql += " AND suite.job_id = ANY(%s)"
+            params = [list(job_ids)]
+        with connection.cursor() as cursor:
+            cursor.execute(sql + " ON CONFLICT (testcase_id) DO NOTHING", params)
+            return cursor.rowcount
+
+    def __str__(self):
+        return _(u"Lava result {0}/{1}").format(self.job_id, self.testcase_id)
+
+
+# Append the measurements of the finished jobs, see MeasurementPoint.append()
+MEASUREMENT_POINT_SQL = (
+    "INSERT INTO lava_results_app_measurementpoint "
+    "(testcase_id, job_id, end_time, device, device_type, suite, \"case\", measurement, result) "
+    "SELECT testcase.id, job.id, job.end_time, COALESCE(job.actual_device_id, ''), "
+    "COALESCE(device.device_type_id, job.requested_device_type_id, ''), "
+    "COALESCE(suite.name, ''), testcase.name, testcase.measurement, testcase.result "
+    "FROM lava_results_app_testcase AS testcase "
+    "JOIN lava_results_app_testsuite AS suite ON suite.id = testcase.suite_id "
+    "JOIN lava_scheduler_app_testjob AS job ON job.id = suite.job_id "
+    "LEFT JOIN lava_scheduler_app_device AS device ON device.hostname = job.actual_device_id "
+    "WHERE testcase.measurement IS NOT NULL AND job.end_time IS NOT NULL"
+)
+
+
+class MeasurementPoint(models.Model):
+    """
+    Measurements of the finished jobs, copied in a narrow table ordered by
+    time so that the trend charts do not have to join the test cases with
+    their suites, jobs and devices. The rows are appended when the job
+    finishes and deleted along with the test case.
+    """
+
+    objects = models.Manager.from_queryset(MeasurementPointQuerySet)()
+
+    testcase = models.OneToOneField(
+        TestCase,
+        primary_key=True,
+        related_name='measurement_point',
+        on_delete=models.CASCADE
+    )
+    job = models.ForeignKey(
+        TestJob,
+        related_name='measurement_points',
+        on_delete=models.CASCADE
+    )
+    end_time = models.DateTimeField()
+    device = models.CharField(max_length=200, blank=True, default='')
+    device_type = models.CharField(max_length=200, blank=True, default='')
+    suite = models.CharField(max_length=200, blank=True, default='')
+    case = models.TextField()
+    # Same precision as the test case
+    measurement = models.DecimalField(decimal_places=10, max_digits=30)
+    result = models.PositiveSmallIntegerField(choices=TestCase.RESULT_CHOICES)
+
+    class Meta:
+        indexes = [
+            # The rows are appended in end_time order
+            BrinIndex(fields=['end_time'], name='measurement_end_time_brin'),
+            models.Index(fields=['suite', 'case', 'end_time'], name='measurement_series_idx'),
+        ]
+
+    @staticmethod
+    def append(job_ids=None):
+        """
+        Append the measurements of the given finished jobs (or of every
+        finished job) that are not stored yet.
+        """
+        sql = MEASUREMENT_POINT_SQL
+        params = []
+        if job_ids is not None:
+            sql += " AND job.id = ANY(%s)"
+            params = [list(job_ids)]
+        with connection.cursor() as cursor:
+            cursor.execute(sql + " ON CONFLICT (testcase_id) DO NOTHING", params)
+            return cursor.rowcount
+
+    def __str__(self):
+        return _(u"Measurement {0}/{1}/{2} {3}").format(self.job_id, self.suite, self.case,
+                                                        self.measurement)
+
+
 class MetaType(models.Model):
     """
     name will be a label, like a deployment type (NFS) or a boot type (bootz)
@@ -881,6 +1116,27 @@ class Query(models.Model):
                 id__in=omitted_list).order_by(*order_by).visible_by_user(
                     user)
 
+    @staticmethod
+    def attribute_filter(model, condition):
+        """
+        Compile a NamedTestAttribute condition into a semi-join: the jobs
+        whose TestData has a matching attribute. Unlike a join through the
+        generic relation, each condition is an independent lookup in the
+        (content_type, name, md5(value)) index and does not multiply the
+        rows of the other conditions.
+        """
+        attributes = NamedTestAttribute.objects.filter(
+            content_type=ContentType.objects.get_for_model(TestData),
+            name=condition.field,
+            **{'value__%s' % condition.operator: condition.value})
+        if condition.operator == QueryCondition.EXACT:
+            attributes = attributes.extra(
+                where=["md5(lava_results_app_namedtestattribute.value) = md5(%s)"],
+                params=[condition.value])
+        jobs = TestData.objects.filter(
+            id__in=attributes.values('object_id')).values('testjob_id')
+        return Q(**{'%s__in' % QueryCondition.JOB_RELATION[model]: jobs})
+
     @classmethod
     def get_queryset(cls, content_type, conditions, limit=None,
                      order_by=['-id']):
@@ -898,6 +1154,7 @@ class Query(models.Model):
 
         logger = logging.getLogger('lava_results_app')
         filters = {}
+        attribute_filters = []
 
         for condition in conditions:
 
@@ -911,15 +1168,8 @@ class Query(models.Model):
                 raise
 
             if condition.table.model_class() == NamedTestAttribute:
-                # For custom attributes, need two filters since
-                # we're comparing the key(name) and the value.
-                filter_key_name = '{0}__name'.format(relation_string)
-                filter_key_value = '{0}__value'.format(relation_string)
-                filter_key_value = '{0}__{1}'.format(filter_key_value,
-                                                     condition.operator)
-
-                filters[filter_key_name] = condition.field
-                filters[filter_key_value] = condition.value
+                attribute_filters.append(cls.attribute_filter(
+                    content_type.model_class(), condition))
 
             else:
                 if condition.table == content_type:
@@ -968,7 +1218,7 @@ class Query(models.Model):
                 filters[filter_key] = condition.value
 
         query_results = content_type.model_class().objects.filter(
-            **filters).distinct().order_by(*order_by).extra(select={
+            *attribute_filters, **filters).distinct().order_by(*order_by).extra(select={
                 '%s_ptr_id' % content_type.model:
                 '%s.id' % content_type.model_class()._meta.db_table})[:limit]
 
@@ -1177,6 +1427,13 @@ class QueryCondition(models.Model):
         }
     }
 
+    # Relation to the job of each content type, for the attribute conditions
+    JOB_RELATION = {
+        TestJob: 'id',
+        TestSuite: 'job',
+        TestCase: 'suite__job',
+    }
+
     # Allowed fields for condition entities.
     FIELD_CHOICES = {
         TestJob: [
@@ -1238,28 +1495,25 @@ class QueryCondition(models.Model):
             self.query.is_changed = True
             self.query.save()
 
-    @classmethod
-    def get_condition_choices(cls, job=None):
-        # Create a dict with all possible operators based on the all available
-        # field types, used for validation.
-        # If job is supplied, return available metadata field names as well.
+    # Catalogue of the fields and operators, built once per process
+    _condition_catalogue = None
 
-        condition_choices = {}
-        for model in cls.FIELD_CHOICES:
-            condition_choice = {}
-            condition_choice['fields'] = {}
-            content_type = ContentType.objects.get_for_model(model)
-
-            if job and model == NamedTestAttribute:
-                testdata = TestData.objects.filter(testjob=job).first()
-                if testdata:
-                    for attribute in NamedTestAttribute.objects.filter(
-                            object_id=testdata.id,
-                            content_type=ContentType.objects.get_for_model(
-                                TestData)):
-                        condition_choice['fields'][attribute.name] = {}
+    @classmethod
+    def get_condition_catalogue(cls):
+        """
+        Return the catalogue of the fields and operators of every model, as
+        a (choices, json, etag) tuple. The catalogue only depends on the
+        code so it is built once per process.
+        """
+        if cls._condition_catalogue is None:
+            # Create a dict with all possible operators based on the all
+            # available field types, used for validation.
+            condition_choices = {}
+            for model in cls.FIELD_CHOICES:
+                condition_choice = {}
+                condition_choice['fields'] = {}
+                content_type = ContentType.objects.get_for_model(model)
 
-            else:
                 for field_name in cls.FIELD_CHOICES[model]:
                     field = {}
 
@@ -1274,12 +1528,42 @@ class QueryCondition(models.Model):
 
                     condition_choice['fields'][field_name] = field
 
-            condition_choices[content_type.id] = condition_choice
+                condition_choices[content_type.id] = condition_choice
             condition_choices['date_format'] = settings.\
                 DATETIME_INPUT_FORMATS[0]
 
+            # Sort the keys so that every process computes the same etag
+            data = simplejson.dumps({str(key): value for (key, value) in condition_choices.items()},
+                                    sort_keys=True)
+            etag = hashlib.sha1(data.encode("utf-8")).hexdigest()
+            cls._condition_catalogue = (condition_choices, data, etag)
+        return cls._condition_catalogue
+
+    @classmethod
+    def get_condition_choices(cls, job=None):
+        # Return the catalogue of the fields and operators.
+        # If job is supplied, return available metadata field names as well.
+        condition_choices = cls.get_condition_catalogue()[0]
+        if job is None:
+            return condition_choices
+
+        content_type = ContentType.objects.get_for_model(NamedTestAttribute)
+        condition_choices = dict(condition_choices)
+        condition_choices[content_type.id] = {
+            'fields': {name: {} for name in cls.get_job_attribute_names(job)}}
         return condition_choices
 
+    @classmethod
+    def get_job_attribute_names(cls, job):
+        # Names of the metadata fields generated by the job.
+        testdata = TestData.objects.filter(testjob=job).first()
+        if not testdata:
+            return []
+        return list(NamedTestAttribute.objects.filter(
+            object_id=testdata.id,
+            content_type=ContentType.objects.get_for_model(TestData))
+            .order_by('name').values_list('name', flat=True).distinct())
+
     @classmethod
     def get_similar_job_content_types(cls):
         # Create a dict with all available content types.
@@ -1650,9 +1934,64 @@ class ChartQuery(models.Model):
 
         return data
 
+    @staticmethod
+    def get_measurement_results(model, ids):
+        """
+        Measurement results of the jobs, suites or test cases:
+        {pk: {name: {measurement, fail}}}, the same values as calling
+        get_measurement_results() on each object.
+        The measurements of the finished jobs are read from the measurement
+        points. The test cases without a point (no measurement, unfinished
+        jobs or points not appended yet) are read from the test cases.
+        """
+        results = collections.defaultdict(dict)
+        pending = TestCase.objects.filter(measurement_point__isnull=True)
+        if issubclass(model, TestJob):
+            # Average of each suite, like TestJob.get_measurement_results()
+            pending_jobs = set(pending.filter(suite__job_id__in=ids, measurement__isnull=False)
+                                      .values_list('suite__job_id', flat=True).distinct())
+            points = MeasurementPoint.objects.filter(job_id__in=set(ids) - pending_jobs) \
+                                             .values_list('job_id', 'suite') \
+                                             .annotate(average=models.Avg('measurement'))
+            averages = {(job_id, suite): average for (job_id, suite, average) in points}
+            if pending_jobs:
+                cases = TestCase.objects.filter(suite__job_id__in=pending_jobs) \
+                                        .values_list('suite__job_id', 'suite__name') \
+                                        .annotate(average=models.Avg('measurement'))
+                averages.update(((job_id, suite), average) for (job_id, suite, average) in cases)
+            for (job_id, name, count_fail) in TestSuite.objects.filter(job_id__in=ids) \
+                                                               .values_list('job_id', 'name', 'count_fail'):
+                results[job_id][name] = {'measurement': averages.get((job_id, name)),
+                                         'fail': count_fail}
+            return results
+
+        # Rows of (testcase_id, pk, name, measurement, result)
+        if issubclass(model, TestSuite):
+            points = MeasurementPoint.objects.filter(testcase__suite_id__in=ids) \
+                                             .values_list('testcase_id', 'testcase__suite_id', 'case',
+                                                          'measurement', 'result')
+            pending = pending.filter(suite_id__in=ids) \
+                             .values_list('id', 'suite_id', 'name', 'measurement', 'result')
+        else:
+            points = [(pk, pk, name, measurement, result) for (pk, name, measurement, result)
+                      in MeasurementPoint.objects.filter(testcase_id__in=ids)
+                      .values_list('testcase_id', 'case', 'measurement', 'result')]
+            pending = [(pk, pk, name, measurement, result) for (pk, name, measurement, result)
+                       in pending.filter(id__in=ids).values_list('id', 'name', 'measurement', 'result')]
+        rows = sorted(list(points) + list(pending), key=lambda row: row[0])
+        for (_case_id, pk, name, measurement, result) in rows:
+            results[pk][name] = {'measurement': measurement,
+                                 'fail': result != TestCase.RESULT_PASS}
+        return results
+
     def get_chart_measurement_data(self, user, query_results):
 
         data = []
+        query_results = list(query_results)
+        if not query_results:
+            return data
+        measurements = self.get_measurement_results(query_results[0].__class__,
+                                                    [item.id for item in query_results])
         for item in query_results:
 
             # Set attribute based on xaxis_attribute.
@@ -1665,7 +2004,7 @@ class ChartQuery(models.Model):
             date = str(item.get_end_datetime())
             attribute = attribute if attribute is not None else date
 
-            measurement_results = item.get_measurement_results()
+            measurement_results = measurements.get(item.id, {})
             for result in measurement_results:
 
                 if result:
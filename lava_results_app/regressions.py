@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2018 Linaro Limited
+#
+# This file is part of LAVA.
+#
+# LAVA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License version 3
+# as published by the Free Software Foundation
+#
+# LAVA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Regression detection across the results of a set of jobs.
+
+The test cases of the jobs (identified by their suite and case names) are
+ordered by the end time of their job. For each test case, the analysis
+reports:
+* regressions: the last run failed while the previous one passed, and
+  progressions, the opposite
+* flaky cases: the ratio of pass/fail changes between consecutive runs
+  is above the flaky threshold
+* measurement shifts: the average of the last runs moved from the average
+  of the previous runs by more than the shift threshold
+
+The whole job x test case matrix is processed by a single SQL statement
+using window functions: only the reported test cases are loaded. As the
+results of finished jobs do not change, the reports are cached by set of
+jobs and parameters.
+"""
+
+from __future__ import unicode_literals
+
+import hashlib
+
+from django.core.cache import cache
+from django.db import connection
+
+from lava_results_app.models import TestCase, TestSuite
+from lava_scheduler_app.models import TestJob
+
+
+# Number of jobs analysed by default
+DEFAULT_JOBS = 100
+# Maximum number of jobs analysed at once
+MAX_JOBS = 1000
+# Ratio of changes between two consecutive runs for a flaky test case
+DEFAULT_FLAKY = 0.3
+# Relative change of the average measurement for a shift
+DEFAULT_SHIFT = 0.1
+# Number of last runs compared with the previous ones for the shifts
+DEFAULT_WINDOW = 5
+CACHE_TIMEOUT = 3600
+
+ANALYSIS_SQL = """
+WITH runs AS (
+    SELECT suite.name AS suite, testcase.name AS name, testcase.result AS result,
+           testcase.measurement AS measurement, job.id AS job_id,
+           LAG(testcase.result) OVER (PARTITION BY suite.name, testcase.name
+                                      ORDER BY job.end_time, job.id) AS previous,
+           ROW_NUMBER() OVER (PARTITION BY suite.name, testcase.name
+                              ORDER BY job.end_time DESC, job.id DESC) AS position
+    FROM lava_results_app_testcase AS testcase
+    JOIN lava_results_app_testsuite AS suite ON suite.id = testcase.suite_id
+    JOIN lava_scheduler_app_testjob AS job ON job.id = suite.job_id
+    WHERE job.id = ANY(%(jobs)s)
+), cases AS (
+    SELECT suite, name, COUNT(*) AS runs,
+           COUNT(*) FILTER (WHERE previous IN (%(pass)s, %(fail)s) AND result IN (%(pass)s, %(fail)s)
+                            AND previous <> result) AS flips,
+           MAX(job_id) FILTER (WHERE position = 1) AS last_job,
+           BOOL_OR(position = 1 AND previous = %(pass)s AND result = %(fail)s) AS regression,
+           BOOL_OR(position = 1 AND previous = %(fail)s AND result = %(pass)s) AS progression,
+           AVG(measurement) FILTER (WHERE position <= %(window)s) AS recent,
+           AVG(measurement) FILTER (WHERE position > %(window)s) AS baseline
+    FROM runs
+    GROUP BY suite, name
+)
+SELECT suite, name, runs, flips, last_job, regression, progression, recent, baseline
+FROM cases
+WHERE regression OR progression
+   OR (runs > 1 AND flips >= %(flaky)s * (runs - 1))
+   OR (baseline IS NOT NULL AND recent IS NOT NULL
+       AND ABS(recent - baseline) > %(shift)s * ABS(baseline))
+ORDER BY suite, name
+"""
+
+
+def jobs_for_device_type(device_type, user, limit=DEFAULT_JOBS):
+    """
+    Ids of the last finished jobs of the device type visible by the user
+    """
+    jobs = TestJob.objects.filter(state=TestJob.STATE_FINISHED, end_time__isnull=False,
+                                  actual_device__device_type=device_type)
+    return list(jobs.visible_by_user(user).order_by("-end_time")
+                .values_list("id", flat=True)[:limit])
+
+
+def jobs_for_query(query, user, limit=DEFAULT_JOBS):
+    """
+    Ids of the last finished jobs of the query results
+    """
+    results = query.get_results(user, order_by=["-id"])
+    model = query.content_type.model_class()
+    if model == TestJob:
+        ids = results.values("id")
+    elif model == TestSuite:
+        ids = results.values("job_id")
+    else:
+        ids = results.values("suite__job_id")
+    jobs = TestJob.objects.filter(id__in=ids, state=TestJob.STATE_FINISHED, end_time__isnull=False)
+    return list(jobs.order_by("-end_time").values_list("id", flat=True)[:limit])
+
+
+def analyse(job_ids, flaky=DEFAULT_FLAKY, shift=DEFAULT_SHIFT, window=DEFAULT_WINDOW):
+    """
+    Find the regressions, progressions, flaky test cases and measurement
+    shifts across the given jobs.
+    """
+    job_ids = sorted(set(job_ids))
+    key = "regressions-%s" % hashlib.sha1(
+        ("%s|%s|%s|%s" % (",".join(str(job_id) for job_id in job_ids),
+                          flaky, shift, window)).encode("utf-8")).hexdigest()
+    report = cache.get(key)
+    if report is not None:
+        return report
+
+    report = {"jobs": len(job_ids), "regressions": [], "progressions": [],
+              "flaky": [], "shifts": []}
+    if job_ids:
+        params = {"jobs": job_ids, "flaky": flaky, "shift": shift, "window": window,
+                  "pass": TestCase.RESULT_PASS, "fail": TestCase.RESULT_FAIL}
+        with connection.cursor() as cursor:
+            cursor.execute(ANALYSIS_SQL, params)
+            rows = cursor.fetchall()
+        for (suite, name, runs, flips, last_job, regression, progression, recent, baseline) in rows:
+            case = {"suite": suite, "case": name, "runs": runs, "job": last_job}
+            if regression:
+                report["regressions"].append(case)
+            if progression:
+                report["progressions"].append(case)
+            if runs > 1 and flips >= flaky * (runs - 1):
+                report["flaky"].append(dict(case, flip_rate=round(float(flips) / (runs - 1), 3)))
+            if recent is not None and baseline is not None:
+                (recent, baseline) = (float(recent), float(baseline))
+                if abs(recent - baseline) > shift * abs(baseline):
+                    report["shifts"].append(dict(case, recent=recent, baseline=baseline))
+    cache.set(key, report, CACHE_TIMEOUT)
+    return report
@@ -27,7 +27,7 @@ from django.utils.safestring import mark_safe
 from django.utils.html import escape
 
 from lava.utils.lavatable import LavaTable
-from lava_scheduler_app.tables import RestrictedIDLinkColumn
+from lava_scheduler_app.tables import RestrictedIDLinkColumn, visible_jobs
 from lava_results_app.models import (
     TestCase,
     BugLink,
@@ -54,11 +54,10 @@ class JobRestrictionColumn(RestrictedIDLinkColumn):
 class IndexResultsColumn(RestrictedIDLinkColumn):
 
     def render(self, record, table=None):
-        user = table.context.get('request').user
-        if record.job.can_view(user):
+        if record.job_id in visible_jobs(table):
             return results_pklink(record.job)
         else:
-            return record.job.pk
+            return record.job_id
 
 
 class ResultsTable(LavaTable):
@@ -74,8 +73,7 @@ class ResultsTable(LavaTable):
         """
         Slightly different purpose to RestrictedIDLinkColumn.render
         """
-        user = table.context.get('request').user
-        return bool(record.job.can_view(user))
+        return record.job_id in visible_jobs(table)
 
     def render_submitter(self, record, table=None):
         if not self._check_job(record, table):
@@ -85,40 +83,24 @@ class ResultsTable(LavaTable):
     def render_passes(self, record, table=None):
         if not self._check_job(record, table):
             return ''
-        return TestCase.objects.filter(
-            suite__job=record.job,
-            suite=record,
-            result=TestCase.RESULT_MAP['pass']
-        ).count()
+        return record.count_pass
 
     def render_fails(self, record, table=None):
         if not self._check_job(record, table):
             return ''
-        return TestCase.objects.filter(
-            suite__job=record.job,
-            suite=record,
-            result=TestCase.RESULT_MAP['fail']
-        ).count()
+        return record.count_fail
 
     def render_total(self, record, table=None):
         if not self._check_job(record, table):
             return ''
-        return TestCase.objects.filter(
-            suite__job=record.job,
-            suite=record,
-        ).count()
+        return record.count_total
 
     def render_logged(self, record, table=None):
         if not self._check_job(record, table):
             return ''
-        if not TestCase.objects.filter(
-                suite__job=record.job,
-                suite=record):
+        if record.first_logged is None:
             return record.job.start_time
-        return TestCase.objects.filter(
-            suite__job=record.job,
-            suite=record,
-        )[0].logged
+        return record.first_logged
 
     def render_buglinks(self, record, table=None):
 
@@ -165,6 +147,7 @@ class ResultsTable(LavaTable):
         searches = {
             'name': 'contains'
         }
+        search_document = 'name'
         sequence = {
             'job_id', 'actions'
         }
@@ -184,6 +167,7 @@ class ResultsIndexTable(ResultsTable):
         searches = {
             'name': 'contains'
         }
+        search_document = 'name'
 
 
 class TestJobResultsTable(ResultsTable):
@@ -203,6 +187,7 @@ class TestJobResultsTable(ResultsTable):
         searches = {
             'name': 'contains'
         }
+        search_document = 'name'
 
 
 class SuiteTable(LavaTable):
@@ -0,0 +1,76 @@
+from __future__ import unicode_literals
+
+import csv
+import gzip
+import io
+import simplejson
+from django.core.urlresolvers import reverse
+
+from lava_results_app.models import TestCase, TestSuite
+from lava_results_app.tests.test_names import TestCaseWithFactory
+from lava_scheduler_app.models import TestJob
+
+
+class TestQueryExport(TestCaseWithFactory):  # pylint: disable=too-many-ancestors
+
+    def setUp(self):
+        super(TestQueryExport, self).setUp()
+        self.user.set_password("test")
+        self.user.save()
+        self.client.login(username=self.user.username, password="test")
+        job = TestJob.from_yaml_and_user(self.factory.make_job_yaml(), self.user)
+        suite = TestSuite.objects.create(name="smoke-tests", job=job)
+        TestCase.objects.create(name="linux-linaro-ubuntu-pwd", suite=suite,
+                                result=TestCase.RESULT_PASS)
+        TestCase.objects.create(name="boot-time", suite=suite, result=TestCase.RESULT_FAIL,
+                                measurement="12.5", units="seconds")
+
+    def export(self, **params):
+        params.setdefault("conditions", "")
+        params["entity"] = "testcase"
+        response = self.client.get(reverse("lava.results.query_export_custom"), params)
+        self.assertEqual(response.status_code, 200)
+        return (response, b"".join(response.streaming_content))
+
+    def csv_rows(self, data):
+        rows = list(csv.DictReader(io.StringIO(data.decode("utf-8"))))
+        return sorted(rows, key=lambda row: int(row["id"]))
+
+    def jsonl_rows(self, data):
+        rows = [simplejson.loads(line, use_decimal=True) for line in data.decode("utf-8").splitlines()]
+        # Same representation as the CSV cells
+        rows = [dict((key, "" if value is None else str(value)) for (key, value) in row.items())
+                for row in rows]
+        return sorted(rows, key=lambda row: int(row["id"]))
+
+    def test_csv(self):
+        (response, data) = self.export()
+        self.assertEqual(response["Content-Type"], "text/csv")
+        rows = self.csv_rows(data)
+        self.assertEqual(sorted(row["name"] for row in rows),
+                         ["boot-time", "linux-linaro-ubuntu-pwd"])
+        boot = [row for row in rows if row["name"] == "boot-time"][0]
+        self.assertEqual(boot["units"], "seconds")
+        self.assertEqual(float(boot["measurement"]), 12.5)
+        self.assertEqual(boot["suite"], str(TestSuite.objects.get().id))
+
+    def test_jsonl(self):
+        (response, data) = self.export(format="jsonl")
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertEqual(self.jsonl_rows(data), self.csv_rows(self.export()[1]))
+
+        (_, data) = self.export(format="jsonl", conditions="name__exact__boot-time")
+        self.assertEqual([row["name"] for row in self.jsonl_rows(data)], ["boot-time"])
+
+    def test_gzip(self):
+        for export_format in ["csv", "jsonl"]:
+            (response, data) = self.export(format=export_format, compress="gzip")
+            self.assertEqual(response["Content-Type"], "application/gzip")
+            self.assertTrue(response["Content-Disposition"].endswith(".%s.gz" % export_format))
+            self.assertEqual(gzip.GzipFile(fileobj=io.BytesIO(data)).read(),
+                             self.export(format=export_format)[1])
+
+    def test_unknown_format(self):
+        response = self.client.get(reverse("lava.results.query_export_custom"),
+                                   {"entity": "testcase", "format": "xml"})
+        self.assertEqual(response.status_code, 404)
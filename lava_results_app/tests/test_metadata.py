@@ -20,8 +20,10 @@ from lava_results_app.dbutils import (
     _get_action_metadata, _get_device_metadata,  # pylint: disable=protected-access
     testcase_export_fields,
     export_testcase,
+    export_testcases,
 )
 from lava_results_app.models import ActionData, MetaType, TestData, TestCase, TestSuite
+from lava_results_app.utils import convert_description, description_data, description_json_filename
 from lava_dispatcher.parser import JobParser
 from lava_dispatcher.device import PipelineDevice
 from lava_dispatcher.test.test_defs import allow_missing_path
@@ -101,6 +103,67 @@ class TestMetaTypes(TestCaseWithFactory):
             )
         )
 
+    def test_bulk_export(self):
+        job = TestJob.from_yaml_and_user(
+            self.factory.make_job_yaml(), self.user)
+        test_suite = TestSuite.objects.get_or_create(name='lava', job=job)[0]
+        TestCase.objects.create(
+            name='first', suite=test_suite, result=TestCase.RESULT_PASS,
+            metadata=yaml.dump({'level': '1.2', 'case': 'first', 'result': 'pass'}))
+        TestCase.objects.create(
+            name='second', suite=test_suite, result=TestCase.RESULT_FAIL,
+            measurement=decimal.Decimal('1.5'), units='s')
+        TestCase.objects.create(
+            name='third', suite=test_suite, result=TestCase.RESULT_SKIP,
+            metadata='{invalid: yaml')
+        test_cases = TestCase.objects.filter(suite__job=job).order_by('id')
+        self.assertEqual(
+            list(export_testcases(test_cases)),
+            [export_testcase(test_case) for test_case in test_cases])
+        self.assertEqual(
+            list(export_testcases(test_cases, with_buglinks=True)),
+            [export_testcase(test_case, with_buglinks=True) for test_case in test_cases])
+
+    def test_description(self):
+        job = TestJob.from_yaml_and_user(
+            self.factory.make_job_yaml(), self.user)
+        mkdir(job.output_dir)
+        shutil.copy(os.path.join(os.path.dirname(__file__), '..', '..', 'lava_scheduler_app', 'tests',
+                                 'pipeline_refs', 'connection-description.yaml'),
+                    os.path.join(job.output_dir, 'description.yaml'))
+        data = description_data(job)
+        self.assertEqual(data['job']['actions'][0]['deploy']['to'], 'ssh')
+        self.assertIs(description_data(job), data)
+
+        self.assertTrue(convert_description(job))
+        self.assertTrue(os.path.exists(description_json_filename(job)))
+        converted = description_data(job)
+        self.assertIsNot(converted, data)
+        self.assertEqual(converted['job']['actions'][0]['deploy']['to'], 'ssh')
+        self.assertEqual(len(converted['pipeline']), len(data['pipeline']))
+        self.assertEqual(list(converted['job'].keys()), list(data['job'].keys()))
+        self.assertEqual(list(converted['pipeline'][0].keys()), list(data['pipeline'][0].keys()))
+        # The python objects are stored as their attributes
+        self.assertEqual(converted['pipeline'][0]['connection_timeout'],
+                         {'duration': 300.0, 'name': 'deploy', 'protected': False})
+        self.assertEqual(converted['device'], dict(data['device']))
+        deploy = data['job']['actions'][0]['deploy']
+        self.assertEqual(converted['job']['actions'][0]['deploy']['deployment_data'],
+                         {'__data__': deploy['deployment_data'].__data__})
+        shutil.rmtree(job.output_dir)
+
+    def test_description_unknown_type(self):
+        job = TestJob.from_yaml_and_user(
+            self.factory.make_job_yaml(), self.user)
+        mkdir(job.output_dir)
+        with open(os.path.join(job.output_dir, 'description.yaml'), 'w') as f_out:
+            f_out.write("job: {actions: []}\nvalue: !!python/complex 1+2j\n")
+        # The description is not converted but is still readable
+        self.assertFalse(convert_description(job))
+        self.assertFalse(os.path.exists(description_json_filename(job)))
+        self.assertEqual(description_data(job)['value'], 1 + 2j)
+        shutil.rmtree(job.output_dir)
+
     def test_duration(self):
         TestJob.from_yaml_and_user(
             self.factory.make_job_yaml(), self.user)
@@ -175,7 +238,7 @@ class TestMetaTypes(TestCaseWithFactory):
         self.assertIsNotNone(ret)
         ret.save()
         self.assertEqual(TestCase.objects.filter(name='unit-test').count(), 1)
-        test_data = yaml.load(TestCase.objects.filter(name='unit-test')[0].metadata, Loader=yaml.CLoader)
+        test_data = TestCase.objects.filter(name='unit-test')[0].action_metadata
         self.assertEqual(test_data['extra'], meta_filename)
         self.assertTrue(os.path.exists(meta_filename))
         with open(test_data['extra'], 'r') as extra_file:
@@ -3,10 +3,15 @@ from __future__ import unicode_literals
 import os
 import yaml
 import logging
+from datetime import timedelta
+from decimal import Decimal
 from django.contrib.auth.models import User
+from django.core.management import call_command
 from django.core.validators import URLValidator
+from django.db import connection
+from django.utils import timezone
 from lava_results_app.models import (
-    TestCase, TestSuite
+    ChartQuery, LavaResult, MeasurementPoint, TestCase, TestSuite
 )
 from lava_results_app.dbutils import map_scanned_results
 from lava_scheduler_app.models import (
@@ -14,8 +19,8 @@ from lava_scheduler_app.models import (
     DeviceType
 )
 from django_testscenarios.ubertest import TestCase as DjangoTestCase
+from six import StringIO
 
-from six import string_types
 
 # note: when creating extensions, ensure a urls.py and views.py exist
 
@@ -137,10 +142,28 @@ class TestTestSuite(TestCaseWithFactory):
         ret.save()
         self.assertEqual(1, TestCase.objects.filter(suite=suite).count())
         testcase = TestCase.objects.get(suite=suite)
-        self.assertTrue(isinstance(testcase.metadata, string_types))
+        self.assertIsNone(testcase.metadata)
+        self.assertEqual(testcase.metadata_json["level"], "1.3.3.2")
+        self.assertEqual(testcase.action_metadata, testcase.metadata_json)
+        self.assertEqual(TestCase.objects.get(suite=suite, metadata_json__level="1.3.3.2"), testcase)
         self.assertEqual(testcase.result, TestCase.RESULT_PASS)
         self.factory.cleanup()
 
+    def test_legacy_metadata(self):
+        job = TestJob.from_yaml_and_user(
+            self.factory.make_job_yaml(), self.user)
+        suite = TestSuite.objects.create(job=job, name='lava')
+        testcase = TestCase.objects.create(
+            name='test-overlay', suite=suite, result=TestCase.RESULT_PASS,
+            metadata=yaml.dump({"case": "test-overlay", "definition": "lava", "level": "1.3.3.2"}))
+        self.assertEqual(testcase.action_metadata["level"], "1.3.3.2")
+        call_command('migrate_testcase_metadata', stdout=StringIO())
+        testcase = TestCase.objects.get(id=testcase.id)
+        self.assertIsNone(testcase.metadata)
+        self.assertEqual(testcase.metadata_json,
+                         {"case": "test-overlay", "definition": "lava", "level": "1.3.3.2"})
+        self.factory.cleanup()
+
     def test_bad_input(self):
         job = TestJob.from_yaml_and_user(
             self.factory.make_job_yaml(), self.user)
@@ -186,3 +209,149 @@ class TestTestSuite(TestCaseWithFactory):
             self.assertTrue(testcase.name.startswith('linux-INLINE-'))
             val('http://localhost/%s' % testcase.get_absolute_url())
         self.factory.cleanup()
+
+    def test_counters(self):
+        job = TestJob.from_yaml_and_user(
+            self.factory.make_job_yaml(), self.user)
+        result_samples = [
+            {"case": "linux-INLINE-lscpu", "definition": "smoke-tests-basic", "result": "pass"},
+            {"case": "linux-INLINE-lspci", "definition": "smoke-tests-basic", "result": "fail"},
+            {"case": "linux-INLINE-lsusb", "definition": "smoke-tests-basic", "result": "skip"},
+            {"case": "linux-INLINE-uname", "definition": "smoke-tests-basic", "result": "pass"},
+            {"case": "job", "definition": "lava", "result": "pass"}
+        ]
+        test_cases = [map_scanned_results(results=sample, job=job, meta_filename=None)
+                      for sample in result_samples]
+        TestCase.objects.bulk_create(test_cases)
+        TestSuite.update_counters(test_cases)
+
+        suite = TestSuite.objects.get(job=job, name="smoke-tests-basic")
+        self.assertEqual((suite.count_pass, suite.count_fail, suite.count_skip, suite.count_unknown),
+                         (2, 1, 1, 0))
+        self.assertEqual(suite.count_total, 4)
+        self.assertIsNotNone(suite.first_logged)
+        self.assertEqual(job.get_passfail_results(), {
+            "smoke-tests-basic": {"pass": 2, "fail": 1, "skip": 1, "unknown": 0},
+            "lava": {"pass": 1, "fail": 0, "skip": 0, "unknown": 0}})
+
+        # Counters can be recomputed from the test cases
+        TestCase.objects.filter(suite=suite, result=TestCase.RESULT_PASS).delete()
+        self.assertEqual(TestSuite.objects.filter(job=job).refresh_counters(), 2)
+        suite.refresh_from_db()
+        self.assertEqual((suite.count_pass, suite.count_fail, suite.count_skip), (0, 1, 1))
+        self.factory.cleanup()
+
+    def test_lava_results(self):
+        job = TestJob.from_yaml_and_user(
+            self.factory.make_job_yaml(), self.user)
+        result_samples = [
+            {"case": "0_smoke-tests", "definition": "lava", "result": "pass", "level": "3.1",
+             "test_definition_start": "smoke-tests", "success": "1234_1.3.2.3.1"},
+            {"case": "job", "definition": "lava", "result": "fail", "level": "4",
+             "error_type": "Infrastructure", "error_msg": "Connection closed"},
+            {"case": "linux-INLINE-lscpu", "definition": "smoke-tests-basic", "result": "pass"},
+        ]
+        test_cases = [map_scanned_results(results=sample, job=job, meta_filename=None)
+                      for sample in result_samples]
+        TestCase.objects.bulk_create(test_cases)
+        LavaResult.index(test_cases)
+
+        self.assertEqual(LavaResult.objects.filter(job=job).count(), 2)
+        result = LavaResult.objects.get(job=job, error_type="Infrastructure")
+        self.assertEqual(result.testcase.name, "job")
+        self.assertEqual((result.level, result.error_msg), ("4", "Connection closed"))
+        self.assertEqual(list(LavaResult.objects.filter(job=job).exclude(definition='')
+                              .values_list('definition', 'success')),
+                         [("smoke-tests", "1234_1.3.2.3.1")])
+
+        # Rebuilt from the json metadata
+        LavaResult.objects.filter(job=job).delete()
+        self.assertEqual(LavaResult.refresh([job.id]), 2)
+        self.assertEqual(LavaResult.refresh([job.id]), 0)
+        self.assertEqual(LavaResult.objects.get(job=job, definition="smoke-tests").level, "3.1")
+        self.factory.cleanup()
+
+    def test_measurement_points(self):
+        job = TestJob.from_yaml_and_user(
+            self.factory.make_job_yaml(), self.user)
+        result_samples = [
+            {"case": "boot-time", "definition": "smoke-tests-basic", "result": "pass",
+             "measurement": 12.5, "units": "seconds"},
+            {"case": "latency", "definition": "smoke-tests-basic", "result": "fail",
+             "measurement": 3, "units": "ms"},
+            {"case": "linux-INLINE-lscpu", "definition": "smoke-tests-basic", "result": "pass"},
+        ]
+        test_cases = [map_scanned_results(results=sample, job=job, meta_filename=None)
+                      for sample in result_samples]
+        TestCase.objects.bulk_create(test_cases)
+        TestSuite.update_counters(test_cases)
+
+        suite = TestSuite.objects.get(job=job, name="smoke-tests-basic")
+        expected = {
+            "boot-time": {"measurement": 12.5, "fail": False},
+            "latency": {"measurement": 3.0, "fail": True},
+            "linux-INLINE-lscpu": {"measurement": None, "fail": False}}
+
+        # Only the finished jobs are appended: the charts of the running
+        # jobs read the test cases
+        self.assertEqual(MeasurementPoint.append([job.id]), 0)
+        self.assertEqual(ChartQuery.get_measurement_results(TestSuite, [suite.id])[suite.id], expected)
+        self.assertEqual(ChartQuery.get_measurement_results(TestJob, [job.id])[job.id],
+                         {"smoke-tests-basic": {"measurement": 7.75, "fail": 1}})
+        job.end_time = timezone.now()
+        job.save()
+        self.assertEqual(MeasurementPoint.append([job.id]), 2)
+        self.assertEqual(MeasurementPoint.append([job.id]), 0)
+        point = MeasurementPoint.objects.get(job=job, case="boot-time")
+        self.assertEqual((point.suite, point.measurement, point.result),
+                         ("smoke-tests-basic", Decimal("12.5"), TestCase.RESULT_PASS))
+
+        # Same results once appended, the test cases without measurement included
+        self.assertEqual(ChartQuery.get_measurement_results(TestSuite, [suite.id])[suite.id], expected)
+        self.assertEqual(ChartQuery.get_measurement_results(TestJob, [job.id])[job.id],
+                         {"smoke-tests-basic": {"measurement": 7.75, "fail": 1}})
+        cases = TestCase.objects.filter(suite=suite).order_by("id")
+        self.assertEqual(ChartQuery.get_measurement_results(TestCase, [case.id for case in cases]),
+                         {case.id: {case.name: expected[case.name]} for case in cases})
+        for case in cases:
+            self.assertEqual(ChartQuery.get_measurement_results(TestCase, [case.id])[case.id],
+                             case.get_measurement_results())
+        self.assertEqual(ChartQuery.get_measurement_results(TestSuite, [suite.id])[suite.id],
+                         suite.get_measurement_results())
+
+        trend = MeasurementPoint.objects.filter(suite="smoke-tests-basic", case="latency") \
+                                        .visible_by_user(self.user) \
+                                        .downsample(job.end_time - timedelta(days=1),
+                                                    job.end_time + timedelta(days=1), 10)
+        self.assertEqual(len(trend), 1)
+        self.assertEqual((trend[0]["average"], trend[0]["count"], trend[0]["failures"]), (3.0, 1, 1))
+        self.factory.cleanup()
+
+    def test_measurement_points_canceled(self):
+        job = TestJob.from_yaml_and_user(
+            self.factory.make_job_yaml(), self.user)
+        test_case = map_scanned_results(
+            results={"case": "boot-time", "definition": "smoke-tests-basic", "result": "skip",
+                     "measurement": 12.5, "units": "seconds"}, job=job, meta_filename=None)
+        test_case.save()
+
+        # Canceling a submitted job finishes it: the points are appended
+        # when the transaction is committed
+        callbacks = len(connection.run_on_commit)
+        job.go_state_canceling()
+        job.save()
+        self.assertEqual(job.health, TestJob.HEALTH_CANCELED)
+        for (_, func) in connection.run_on_commit[callbacks:]:
+            func()
+        point = MeasurementPoint.objects.get(job=job)
+        self.assertEqual((point.measurement, point.result), (12.5, TestCase.RESULT_SKIP))
+
+        trend = MeasurementPoint.objects.filter(job=job).downsample(
+            job.end_time - timedelta(days=1), job.end_time + timedelta(days=1), 10)
+        self.assertEqual(trend[0]["failures"], 1)
+
+        # Backfill of the jobs finished before the upgrade
+        point.delete()
+        call_command('append_measurement_points', stdout=StringIO())
+        self.assertEqual(MeasurementPoint.objects.filter(job=job).count(), 1)
+        self.factory.cleanup()
@@ -0,0 +1,91 @@
+from __future__ import unicode_literals
+
+from django.contrib.auth.models import AnonymousUser, Group
+from django.contrib.contenttypes.models import ContentType
+
+from lava_results_app.models import (
+    NamedTestAttribute, Query, QueryCondition, TestCase, TestData, TestSuite
+)
+from lava_results_app.tests.test_names import TestCaseWithFactory
+from lava_scheduler_app.models import TestJob
+
+
+class TestQueryConditions(TestCaseWithFactory):  # pylint: disable=too-many-ancestors
+
+    def test_attribute_conditions(self):
+        attributes = [
+            {"target.device_type": "qemu", "boot.0.method": "qemu"},
+            {"target.device_type": "qemu", "boot.0.method": "u-boot"},
+            {"target.device_type": "beaglebone-black", "boot.0.method": "u-boot"},
+        ]
+        jobs = []
+        for values in attributes:
+            job = TestJob.from_yaml_and_user(
+                self.factory.make_job_yaml(), self.user)
+            TestSuite.objects.create(job=job, name="lava")
+            testdata = TestData.objects.create(testjob=job)
+            for (name, value) in values.items():
+                testdata.attributes.create(name=name, value=value)
+            jobs.append(job)
+
+        table = ContentType.objects.get_for_model(NamedTestAttribute)
+        conditions = [
+            QueryCondition(table=table, field="target.device_type",
+                           operator=QueryCondition.EXACT, value="qemu"),
+            QueryCondition(table=table, field="boot.0.method",
+                           operator=QueryCondition.ICONTAINS, value="boot"),
+        ]
+        for (model, expected) in [(TestJob, [jobs[1].id]),
+                                  (TestSuite, [jobs[1].testsuite_set.get().id])]:
+            results = Query.get_queryset(ContentType.objects.get_for_model(model), conditions)
+            self.assertEqual([item.id for item in results], expected)
+        self.factory.cleanup()
+
+    def test_visibility(self):
+        group = Group.objects.create(name="viewers")
+        viewer = self.factory.make_user()
+        viewer.groups.add(group)
+        other = self.factory.make_user()
+        suites = {}
+        for visibility in [TestJob.VISIBLE_PUBLIC, TestJob.VISIBLE_PERSONAL, TestJob.VISIBLE_GROUP]:
+            job = TestJob.from_yaml_and_user(
+                self.factory.make_job_yaml(), self.user)
+            job.is_public = visibility == TestJob.VISIBLE_PUBLIC
+            job.visibility = visibility
+            job.save()
+            if visibility == TestJob.VISIBLE_GROUP:
+                job.viewing_groups.add(group)
+            suite = TestSuite.objects.create(job=job, name="lava")
+            TestCase.objects.create(name="case", suite=suite, result=TestCase.RESULT_PASS)
+            suites[visibility] = suite
+
+        for (user, visible) in [
+                (AnonymousUser(), [TestJob.VISIBLE_PUBLIC]),
+                (other, [TestJob.VISIBLE_PUBLIC]),
+                (viewer, [TestJob.VISIBLE_PUBLIC, TestJob.VISIBLE_GROUP]),
+                (self.user, [TestJob.VISIBLE_PUBLIC, TestJob.VISIBLE_PERSONAL, TestJob.VISIBLE_GROUP])]:
+            expected = sorted(suites[visibility].id for visibility in visible)
+            self.assertEqual(sorted(TestSuite.objects.visible_by_user(user)
+                                    .values_list("id", flat=True)), expected)
+            self.assertEqual(sorted(TestCase.objects.visible_by_user(user)
+                                    .values_list("suite_id", flat=True)), expected)
+        self.factory.cleanup()
+
+    def test_condition_choices(self):
+        (choices, data, etag) = QueryCondition.get_condition_catalogue()
+        self.assertIs(QueryCondition.get_condition_catalogue()[0], choices)
+        self.assertIs(QueryCondition.get_condition_choices(), choices)
+        testcase = ContentType.objects.get_for_model(TestCase)
+        self.assertIn("result", choices[testcase.id]["fields"])
+        self.assertIn(str(testcase.id), data)
+
+        job = TestJob.from_yaml_and_user(
+            self.factory.make_job_yaml(), self.user)
+        testdata = TestData.objects.create(testjob=job)
+        testdata.attributes.create(name="target.device_type", value="qemu")
+        attribute = ContentType.objects.get_for_model(NamedTestAttribute)
+        job_choices = QueryCondition.get_condition_choices(job)
+        self.assertEqual(job_choices[attribute.id], {"fields": {"target.device_type": {}}})
+        self.assertEqual(choices[attribute.id], {"fields": {}})
+        self.assertEqual(QueryCondition.get_condition_catalogue()[2], etag)
+        self.factory.cleanup()
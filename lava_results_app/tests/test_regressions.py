@@ -0,0 +1,55 @@
+from __future__ import unicode_literals
+
+from datetime import timedelta
+from django.core.urlresolvers import reverse
+from django.utils import timezone
+
+from lava_results_app.dbutils import map_scanned_results
+from lava_results_app.regressions import MAX_JOBS, analyse
+from lava_results_app.tests.test_names import TestCaseWithFactory
+from lava_scheduler_app.models import TestJob
+
+
+class TestRegressions(TestCaseWithFactory):  # pylint: disable=too-many-ancestors
+
+    def test_regressions(self):
+        results = [
+            {"boot": "pass", "network": "pass", "usb": "pass", "latency": 10},
+            {"boot": "pass", "network": "fail", "usb": "pass", "latency": 10},
+            {"boot": "pass", "network": "pass", "usb": "pass", "latency": 20},
+            {"boot": "pass", "network": "fail", "usb": "fail", "latency": 20},
+        ]
+        job_ids = []
+        for (index, cases) in enumerate(results):
+            job = TestJob.from_yaml_and_user(
+                self.factory.make_job_yaml(), self.user)
+            job.end_time = timezone.now() + timedelta(minutes=index)
+            job.save()
+            job_ids.append(job.id)
+            for (name, value) in cases.items():
+                sample = {"case": name, "definition": "smoke-tests-basic", "result": value}
+                if name == "latency":
+                    sample.update({"result": "pass", "measurement": value})
+                map_scanned_results(results=sample, job=job, meta_filename=None).save()
+
+        report = analyse(job_ids, flaky=0.5, shift=0.1, window=2)
+        self.assertEqual(report["jobs"], 4)
+        self.assertEqual([(case["case"], case["job"]) for case in report["regressions"]],
+                         [("network", job_ids[-1]), ("usb", job_ids[-1])])
+        self.assertEqual(report["progressions"], [])
+        self.assertEqual([(case["case"], case["flip_rate"]) for case in report["flaky"]],
+                         [("network", 1.0)])
+        self.assertEqual([(case["case"], case["recent"], case["baseline"]) for case in report["shifts"]],
+                         [("latency", 20.0, 10.0)])
+        self.factory.cleanup()
+
+    def test_regressions_view(self):
+        url = reverse("lava.results.regressions")
+        for jobs in ["many", "0", "-5"]:
+            response = self.client.get(url, {"device_type": "qemu", "jobs": jobs})
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(url, {"device_type": "qemu", "flaky": "a"}).status_code, 400)
+
+        response = self.client.get(url, {"device_type": "qemu", "jobs": "1000000"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["jobs"], MAX_JOBS)
@@ -26,6 +26,7 @@ from lava_results_app.views import (
     get_bug_links_json,
     index,
     metadata_export,
+    regressions,
     suite,
     suite_csv_stream,
     suite_csv,
@@ -46,6 +47,7 @@ from lava_results_app.views.query.views import (
     query_add,
     query_add_condition,
     query_add_group,
+    query_condition_choices,
     query_copy,
     query_custom,
     query_delete,
@@ -87,6 +89,7 @@ from lava_results_app.views.chart.views import (
 urlpatterns = [
     url(r'^$', index, name='lava_results'),
     url(r'^query$', query_list, name='lava.results.query_list'),
+    url(r'^regressions$', regressions, name='lava.results.regressions'),
     url(r'^query/\+add$', query_add, name='lava.results.query_add'),
     url(r'^query/\+custom$', query_custom, name='lava.results.query_custom'),
     url(r'^query/~(?P<username>[^/]+)/(?P<name>[a-zA-Z0-9-_]+)$',
@@ -118,6 +121,8 @@ urlpatterns = [
     url(r'^query/\+get-group-names$', get_query_group_names, name='get_query_group_names'),
     url(r'^query/\+get-query-names$', get_query_names,
         name='lava.results.get_query_names'),
+    url(r'^query/\+condition-choices$', query_condition_choices,
+        name='lava.results.query_condition_choices'),
     url(r'^(?P<job>[0-9]+|[0-9]+\.[0-9]+)$', testjob, name='lava.results.testjob'),
     url(r'^(?P<job>[0-9]+|[0-9]+\.[0-9]+)/csv$', testjob_csv, name='lava.results.testjob_csv'),
     url(r'^(?P<job>[0-9]+|[0-9]+\.[0-9]+)/yaml$', testjob_yaml, name='lava.results.testjob_yaml'),
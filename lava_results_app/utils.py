@@ -1,4 +1,10 @@
+import collections
+import datetime
+import numbers
 import os
+import simplejson
+import threading
+import types
 import yaml
 import logging
 import subprocess
@@ -56,18 +62,122 @@ V2Loader.add_multi_constructor(
     V2Loader.remove_pipeline_module_new)
 
 
-def description_data(job):
+# Number of parsed descriptions kept by each process
+DESCRIPTION_CACHE_SIZE = 32
+DESCRIPTION_CACHE = collections.OrderedDict()
+DESCRIPTION_CACHE_LOCK = threading.Lock()
+
+
+def description_json_filename(job):
+    return os.path.join(job.output_dir, 'description.json')
+
+
+def _load_description_yaml(job, filename):
     logger = logging.getLogger('lava_results_app')
-    filename = description_filename(job)
-    if not filename:
-        return {}
     try:
-        data = yaml.load(open(filename, 'r'), Loader=V2Loader)
+        with open(filename, 'r') as f_in:
+            return yaml.load(f_in, Loader=V2Loader)
     except yaml.YAMLError:
         logger.error("Unable to parse description for %s" % job.id)
         return {}
+
+
+def _description_to_json(data):
+    """
+    Convert the objects created by the V2Loader to json types: the python
+    objects are replaced by their attributes and the python names by their
+    dotted names. Raise a ValueError for any other type.
+    """
+    if data is None or isinstance(data, (bool, numbers.Integral, float, type(u''), str)):
+        return data
+    if isinstance(data, (datetime.date, datetime.datetime)):
+        return data.isoformat()
+    if isinstance(data, dict):
+        # Including the dictionaries of python/object/new
+        result = collections.OrderedDict()
+        for (key, value) in data.items():
+            if key is not None and not isinstance(key, (bool, numbers.Integral, float, type(u''), str)):
+                raise ValueError("Invalid key %r" % key)
+            result[key] = _description_to_json(value)
+        return result
+    if isinstance(data, (list, tuple)):
+        return [_description_to_json(item) for item in data]
+    if isinstance(data, (type, types.FunctionType, types.BuiltinFunctionType)):
+        # python/name
+        return "%s.%s" % (data.__module__, data.__name__)
+    if hasattr(data, '__dict__'):
+        # python/object
+        return _description_to_json(vars(data))
+    raise ValueError("Unable to convert %s" % type(data).__name__)
+
+
+def convert_description(job):
+    """
+    Store the description of a finished job as json, which is much faster
+    to load than description.yaml with the pure python V2Loader. The
+    description does not change once the job is finished.
+    """
+    logger = logging.getLogger('lava_results_app')
+    filename = description_filename(job)
+    if not filename:
+        return False
+    data = _load_description_yaml(job, filename)
+    if not data:
+        return False
+    try:
+        data = _description_to_json(data)
+    except ValueError as exc:
+        # Keep reading description.yaml
+        logger.error("Unable to convert the description of %s: %s", job.id, exc)
+        return False
+    json_filename = description_json_filename(job)
+    with open(json_filename + '.tmp', 'w') as f_out:
+        simplejson.dump(data, f_out)
+    os.rename(json_filename + '.tmp', json_filename)
+    return True
+
+
+def description_data(job):
+    """
+    Parsed description of the job, read from description.json when it was
+    converted, otherwise from description.yaml.
+    The last descriptions are cached by job id and modification time: the
+    returned dictionary is shared and should not be modified.
+    """
+    logger = logging.getLogger('lava_results_app')
+    filename = description_json_filename(job)
+    try:
+        mtime = os.stat(filename).st_mtime
+    except OSError:
+        filename = description_filename(job)
+        if not filename:
+            return {}
+        mtime = os.stat(filename).st_mtime
+
+    key = (job.id, filename, mtime)
+    with DESCRIPTION_CACHE_LOCK:
+        data = DESCRIPTION_CACHE.pop(key, None)
+        if data is not None:
+            DESCRIPTION_CACHE[key] = data
+            return data
+
+    if filename.endswith('.json'):
+        try:
+            with open(filename, 'r') as f_in:
+                # Keep the order of the keys, as when loading the yaml
+                data = simplejson.load(f_in, object_pairs_hook=collections.OrderedDict)
+        except ValueError:
+            logger.error("Unable to parse description for %s" % job.id)
+            data = {}
+    else:
+        data = _load_description_yaml(job, filename)
     if not data:
         return {}
+
+    with DESCRIPTION_CACHE_LOCK:
+        DESCRIPTION_CACHE[key] = data
+        while len(DESCRIPTION_CACHE) > DESCRIPTION_CACHE_SIZE:
+            DESCRIPTION_CACHE.popitem(last=False)
     return data
 
 
@@ -132,3 +242,26 @@ def get_testcases_with_limit(testsuite, limit=None, offset=None):
         testcases = list(testsuite.testcase_set.all().order_by('id'))
 
     return testcases
+
+
+def testcases_with_limit_queryset(testsuite, limit=None, offset=None):
+    """
+    Same as get_testcases_with_limit but return a queryset that is not
+    evaluated, to be used with the bulk exporters.
+    """
+    logger = logging.getLogger('lava_results_app')
+    testcases = testsuite.testcase_set.all().order_by('id')
+    if not limit:
+        return testcases
+    try:
+        limit = int(limit)
+        offset = int(offset) if offset else 0
+    except ValueError as e:
+        logger.warning(
+            "Offset and limit must be integers: %s" % str(e))
+        return testcases.none()
+    if offset < 0 or limit < 0:
+        logger.warning(
+            "Offset and limit must be positive integers: %d, %d" % (offset, limit))
+        return testcases.none()
+    return testcases[offset:offset + limit]
@@ -32,7 +32,8 @@ from collections import OrderedDict
 from django.contrib.auth.decorators import login_required
 from django.contrib.contenttypes.models import ContentType
 from django.core import serializers
-from django.http import Http404
+from django.core.exceptions import PermissionDenied
+from django.http import Http404, HttpResponseBadRequest
 from django.http.response import HttpResponse, StreamingHttpResponse
 from django.shortcuts import render, loader
 from lava_server.views import index as lava_index
@@ -47,9 +48,19 @@ from lava_results_app.tables import (
     ResultsIndexTable,
     TestJobResultsTable
 )
+from lava_results_app.regressions import (
+    DEFAULT_FLAKY,
+    DEFAULT_JOBS,
+    DEFAULT_SHIFT,
+    MAX_JOBS,
+    analyse,
+    jobs_for_device_type,
+    jobs_for_query,
+)
 from lava_results_app.utils import StreamEcho
 from lava_results_app.dbutils import (
     export_testcase,
+    export_testcases,
     testcase_export_fields,
     export_testsuite
 )
@@ -58,9 +69,14 @@ from lava_scheduler_app.models import TestJob
 from lava_scheduler_app.tables import pklink
 from lava_scheduler_app.views import get_restricted_job
 from django_tables2 import RequestConfig
-from lava_results_app.utils import check_request_auth, get_testcases_with_limit
+from lava_results_app.utils import (
+    check_request_auth,
+    testcases_with_limit_queryset,
+)
 from lava_results_app.models import (
     BugLink,
+    LavaResult,
+    Query,
     QueryCondition,
     TestSuite,
     TestCase,
@@ -77,7 +93,7 @@ class ResultsView(LavaView):
     Base results view
     """
     def get_queryset(self):
-        return TestSuite.objects.all().select_related('job').prefetch_related(
+        return TestSuite.objects.all().select_related('job', 'job__submitter').prefetch_related(
             'job__actual_device', 'job__actual_device__device_type'
         ).order_by('-job__id', 'name')
 
@@ -106,6 +122,47 @@ def index(request):
         }, request=request))
 
 
+@BreadCrumb("Regressions", parent=index)
+def regressions(request):
+    """
+    Regressions, flaky test cases and measurement shifts across the last
+    jobs of a device type (?device_type=) or of a query (?query=~owner/name)
+    """
+    try:
+        limit = int(request.GET.get('jobs', DEFAULT_JOBS))
+        flaky = float(request.GET.get('flaky', DEFAULT_FLAKY))
+        shift = float(request.GET.get('shift', DEFAULT_SHIFT))
+    except ValueError:
+        return HttpResponseBadRequest("Invalid parameters")
+    if limit < 1:
+        return HttpResponseBadRequest("Invalid number of jobs")
+    limit = min(limit, MAX_JOBS)
+    device_type = request.GET.get('device_type')
+    query_name = request.GET.get('query', '')
+    if device_type:
+        job_ids = jobs_for_device_type(device_type, request.user, limit)
+    elif query_name.startswith('~') and '/' in query_name:
+        (username, name) = query_name[1:].split('/', 1)
+        query = get_object_or_404(Query, owner__username=username, name=name)
+        if not request.user.is_superuser and not query.is_published and query.owner != request.user:
+            raise PermissionDenied
+        job_ids = jobs_for_query(query, request.user, limit)
+    else:
+        job_ids = []
+    template = loader.get_template("lava_results_app/regressions.html")
+    return HttpResponse(template.render(
+        {
+            'bread_crumb_trail': BreadCrumbTrail.leading_to(regressions),
+            'device_type': device_type,
+            'query_name': query_name,
+            'jobs': limit,
+            'max_jobs': MAX_JOBS,
+            'flaky': flaky,
+            'shift': shift,
+            'report': analyse(job_ids, flaky=flaky, shift=shift),
+        }, request=request))
+
+
 @BreadCrumb("Query", parent=index)
 def query(request):
     template = loader.get_template("lava_results_app/query_list.html")
@@ -127,26 +184,22 @@ def testjob(request, job):
     yaml_dict = OrderedDict()
     if TestData.objects.filter(testjob=job).exists():
         # some duplicates can exist, so get would fail here and [0] is quicker than try except.
-        testdata = TestData.objects.filter(
-            testjob=job).prefetch_related('actionlevels__testcase', 'actionlevels__testcase__suite')[0]
+        testdata = TestData.objects.filter(testjob=job)[0]
         if job.state == TestJob.STATE_FINISHED:
-            # returns something like ['singlenode-advanced', 'smoke-tests-basic', 'smoke-tests-basic']
-            executed = [
-                {
-                    case.action_metadata['test_definition_start']:
-                        case.action_metadata.get('success', '')}
-                for case in TestCase.objects.filter(
-                    suite__in=TestSuite.objects.filter(job=job))
-                if case.action_metadata and 'test_definition_start' in
-                case.action_metadata and case.suite.name == 'lava']
+            # returns something like [('singlenode-advanced', uuid), ('smoke-tests-basic', uuid)]
+            executed = set(LavaResult.objects.filter(job=job).exclude(definition='')
+                           .values_list('definition', 'success'))
 
             submitted = [
-                actiondata.testcase.action_metadata for actiondata in
-                testdata.actionlevels.all() if actiondata.testcase and
-                'test-runscript-overlay' in actiondata.action_name]
-            # compare with a dict similar to created in executed
+                result.testcase.action_metadata for result in
+                LavaResult.objects.filter(
+                    job=job,
+                    testcase__actionlevels__testdata=testdata,
+                    testcase__actionlevels__action_name__contains='test-runscript-overlay')
+                .select_related('testcase').distinct()]
+            # compare with the (name, uuid) tuples of executed
             for item in submitted:
-                if executed and {item['name']: item['success']} not in executed:
+                if executed and (item['name'], item['success']) not in executed:
                     comparison = {}
                     if item['from'] != 'inline':
                         comparison['repository'] = item['repository']
@@ -169,9 +222,6 @@ def testjob(request, job):
             'suite_table': suite_table,
             'metadata': yaml_dict,
             'failed_definitions': failed_definitions,
-            'condition_choices': simplejson.dumps(
-                QueryCondition.get_condition_choices(job)
-            ),
             'available_content_types': simplejson.dumps(
                 QueryCondition.get_similar_job_content_types()
             ),
@@ -182,7 +232,7 @@ def testjob_csv(request, job):
     job = get_object_or_404(TestJob, pk=job)
     check_request_auth(request, job)
 
-    def testjob_stream(suites, pseudo_buffer):
+    def testjob_stream(testcases, pseudo_buffer):
         fieldnames = testcase_export_fields()
         writer = csv.DictWriter(pseudo_buffer,
                                 fieldnames=fieldnames)
@@ -190,13 +240,12 @@ def testjob_csv(request, job):
         # does. Copy writeheader code from csv.py and yield the value.
         yield writer.writerow(dict(zip(fieldnames, fieldnames)))
 
-        for test_suite in suites:
-            for test_case in test_suite.testcase_set.all():
-                yield writer.writerow(export_testcase(test_case))
+        for row in export_testcases(testcases):
+            yield writer.writerow(row)
 
-    suites = job.testsuite_set.all().prefetch_related('test_sets__test_cases__actionlevels')
+    testcases = TestCase.objects.filter(suite__job=job).order_by('suite_id', 'id')
     pseudo_buffer = StreamEcho()
-    response = StreamingHttpResponse(testjob_stream(suites, pseudo_buffer),
+    response = StreamingHttpResponse(testjob_stream(testcases, pseudo_buffer),
                                      content_type="text/csv")
     filename = "lava_%s.csv" % job.id
     response['Content-Disposition'] = 'attachment; filename="%s"' % filename
@@ -206,14 +255,11 @@ def testjob_csv(request, job):
 def testjob_yaml(request, job):
     job = get_object_or_404(TestJob, pk=job)
     check_request_auth(request, job)
-    suites = job.testsuite_set.all().prefetch_related(
-        'test_sets__test_cases__actionlevels')
+    testcases = TestCase.objects.filter(suite__job=job).order_by('suite_id', 'id')
 
     def test_case_stream():
-        for test_suite in suites:
-            for test_case in test_suite.testcase_set.all():
-                yield yaml.dump([export_testcase(test_case)],
-                                Dumper=yaml.CDumper)
+        for row in export_testcases(testcases):
+            yield yaml.dump([row], Dumper=yaml.CDumper)
 
     response = StreamingHttpResponse(test_case_stream(),
                                      content_type="text/yaml")
@@ -281,9 +327,9 @@ def suite_csv(request, job, pk):
         extrasaction='ignore',
         fieldnames=testcase_export_fields())
     writer.writeheader()
-    testcases = get_testcases_with_limit(test_suite, limit, offset)
-    for row in testcases:
-        writer.writerow(export_testcase(row))
+    testcases = testcases_with_limit_queryset(test_suite, limit, offset)
+    for row in export_testcases(testcases):
+        writer.writerow(row)
     return response
 
 
@@ -306,9 +352,9 @@ def suite_csv_stream(request, job, pk):
 
     pseudo_buffer = StreamEcho()
     writer = csv.writer(pseudo_buffer)
-    testcases = get_testcases_with_limit(test_suite, limit, offset)
+    testcases = testcases_with_limit_queryset(test_suite, limit, offset)
     response = StreamingHttpResponse(
-        (writer.writerow(export_testcase(row)) for row in testcases),
+        (writer.writerow(row) for row in export_testcases(testcases)),
         content_type="text/csv")
     filename = "lava_stream_%s.csv" % test_suite.name
     response['Content-Disposition'] = 'attachment; filename="%s"' % filename
@@ -325,10 +371,8 @@ def suite_yaml(request, job, pk):
     response = HttpResponse(content_type='text/yaml')
     filename = "lava_%s.yaml" % test_suite.name
     response['Content-Disposition'] = 'attachment; filename="%s"' % filename
-    yaml_list = []
-    testcases = get_testcases_with_limit(test_suite, limit, offset)
-    for test_case in testcases:
-        yaml_list.append(export_testcase(test_case))
+    testcases = testcases_with_limit_queryset(test_suite, limit, offset)
+    yaml_list = list(export_testcases(testcases))
     yaml.dump(yaml_list, response, Dumper=yaml.CDumper)
     return response
 
@@ -337,7 +381,7 @@ def suite_testcase_count(request, job, pk):
     job = get_object_or_404(TestJob, pk=job)
     check_request_auth(request, job)
     test_suite = get_object_or_404(TestSuite, name=pk, job=job)
-    test_case_count = test_suite.testcase_set.all().count()
+    test_case_count = test_suite.count_total
     return HttpResponse(test_case_count, content_type='text/plain')
 
 
@@ -426,11 +470,8 @@ def testcase(request, case_id, job=None, pk=None):
     extra_source = {}
     logger = logging.getLogger('lava-master')
     for extra_case in test_cases:
-        try:
-            f_metadata = yaml.load(extra_case.metadata, Loader=yaml.CLoader)
-            if not f_metadata:
-                continue
-        except TypeError:
+        f_metadata = extra_case.action_metadata
+        if not f_metadata:
             logger.info("Unable to load extra case metadata for %s", extra_case)
             continue
         extra_data = f_metadata.get('extra')
@@ -188,7 +188,7 @@ class QueryTestCaseTable(SuiteTable):
         attrs = {"class": "table table-hover", "id": "query-results-table"}
         per_page_field = "length"
         exclude = [
-            'metadata',
+            'metadata', 'metadata_json',
         ]
 
 
@@ -215,3 +215,7 @@ class QueryTestSuiteTable(ResultsTable):
         model = TestSuite
         attrs = {"class": "table table-hover", "id": "query-results-table"}
         per_page_field = "length"
+        exclude = [
+            'count_pass', 'count_fail', 'count_skip', 'count_unknown',
+            'first_logged',
+        ]
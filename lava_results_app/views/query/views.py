@@ -17,11 +17,8 @@
 # along with Lava Server.  If not, see <http://www.gnu.org/licenses/>.
 
 import csv
-import os
-import shutil
 import simplejson
-import sys
-import tempfile
+import zlib
 
 from django.db import IntegrityError
 from django.db.models import Q
@@ -39,16 +36,20 @@ from django.core.urlresolvers import reverse
 from django.http import (
     Http404,
     HttpResponse,
-    HttpResponseRedirect
+    HttpResponseRedirect,
+    StreamingHttpResponse
 )
 from django.shortcuts import get_object_or_404, loader
 from django.template import defaultfilters
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import etag
 
 from lava_server.bread_crumbs import (
     BreadCrumb,
     BreadCrumbTrail,
 )
 
+from lava_results_app.utils import StreamEcho
 from lava_results_app.views import index
 from lava_results_app.views.query.decorators import ownership_required
 from lava_results_app.views.query.forms import (
@@ -86,9 +87,6 @@ from django_tables2 import (
 
 from lava.utils.lavatable import LavaView
 
-if sys.version_info[0] == 3:
-    basestring = str
-
 
 class QueryViewDoesNotExistError(Exception):
     """ Raise when corresponding query materialized view does not exist. """
@@ -407,7 +405,7 @@ def query_export(request, username, name):
 
     results = query.get_results(request.user)
     filename = "query_%s_%s_export" % (query.owner.username, query.name)
-    return _export_query(results, query.content_type, filename)
+    return _export_query(request, results, query.content_type, filename)
 
 
 @login_required
@@ -444,7 +442,7 @@ def query_export_custom(request):
         messages.error(request, e)
         raise Http404()
 
-    return _export_query(results, content_type, filename)
+    return _export_query(request, results, content_type, filename)
 
 
 @login_required
@@ -638,6 +636,18 @@ def query_include_result(request, username, name, id):
     return HttpResponseRedirect(query.get_absolute_url())
 
 
+@cache_control(public=True, max_age=3600)
+@etag(lambda request: QueryCondition.get_condition_catalogue()[2])
+def query_condition_choices(request):
+    """
+    Catalogue of the fields and operators of the query conditions. The
+    catalogue only changes with the code: clients revalidate it with the
+    etag.
+    """
+    return HttpResponse(QueryCondition.get_condition_catalogue()[1],
+                        content_type='application/json')
+
+
 def get_query_names(request):
 
     term = request.GET['term']
@@ -710,55 +720,96 @@ def query_condition_form(request, query,
                             content_type='application/json')
 
 
-def _remove_dir(path):
-    """ Removes directory @path. Doesn't raise exceptions. """
-    try:
-        # Delete directory.
-        shutil.rmtree(path)
-    except OSError:
-        # Silent exception whatever happens. If it's unexisting dir, we don't
-        # care.
-        pass
+# Remove non-relevant columns for exported files.
+EXPORT_REMOVED_FIELDS = [
+    # TestJob fields:
+    "user_id", "actual_device_id", "definition",
+    "group_id", "id", "original_definition",
+    "sub_id", "submitter_id", "testdata", "testsuite",
+    # TestSuite fields:
+    "job_id",
+    # TestCase fields:
+    "actionlevels", "suite_id", "test_set_id"
+]
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "jsonl": ("application/x-ndjson", "jsonl"),
+}
+
+
+def _export_columns(content_type):
+    """
+    Return the list of (column name, attribute name) to export. Attribute
+    name is None for the fields that are not stored in the model table
+    (reverse and many to many relations): these columns are left empty.
+    """
+    columns = []
+    for field in content_type.model_class()._meta.get_fields():
+        if field.name in EXPORT_REMOVED_FIELDS:
+            continue
+        if field.concrete and not field.many_to_many:
+            columns.append((field.name, field.attname))
+        else:
+            columns.append((field.name, None))
+    return sorted(columns)
+
+
+def _export_rows(query_results, columns):
+    """ Stream the rows as dictionaries using a server side cursor. """
+    attnames = [attname for (_, attname) in columns if attname is not None]
+    for values in query_results.values_list(*attnames).iterator():
+        row = dict.fromkeys([name for (name, _) in columns], "")
+        row.update(zip([name for (name, attname) in columns if attname is not None], values))
+        yield row
+
+
+def _export_csv_stream(query_results, columns):
+    pseudo_buffer = StreamEcho()
+    fieldnames = [name for (name, _) in columns]
+    writer = csv.DictWriter(pseudo_buffer, quoting=csv.QUOTE_ALL,
+                            extrasaction='ignore', fieldnames=fieldnames)
+    yield writer.writerow(dict(zip(fieldnames, fieldnames)))
+    for row in _export_rows(query_results, columns):
+        yield writer.writerow(row)
+
+
+def _export_jsonl_stream(query_results, columns):
+    for row in _export_rows(query_results, columns):
+        yield simplejson.dumps(row, default=str) + "\n"
+
+
+def _gzip_stream(stream):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for data in stream:
+        chunk = compressor.compress(data.encode("utf-8"))
+        if chunk:
+            yield chunk
+    yield compressor.flush()
+
+
+def _export_query(request, query_results, content_type, filename):
+    """
+    Stream the query results directly from the database.
+    The format is selected with the "format" parameter (csv or jsonl) and
+    the output is compressed when "compress=gzip" is given.
+    """
+    export_format = request.GET.get("format", "csv")
+    if export_format not in EXPORT_FORMATS:
+        raise Http404("Unknown export format '%s'" % export_format)
+    (mime_type, extension) = EXPORT_FORMATS[export_format]
+
+    columns = _export_columns(content_type)
+    if export_format == "jsonl":
+        stream = _export_jsonl_stream(query_results, columns)
+    else:
+        stream = _export_csv_stream(query_results, columns)
 
+    filename = "%s.%s" % (filename, extension)
+    if request.GET.get("compress") == "gzip":
+        stream = _gzip_stream(stream)
+        mime_type = "application/gzip"
+        filename += ".gz"
 
-def _export_query(query_results, content_type, filename):
-
-    tmp_dir = tempfile.mkdtemp()
-    file_path = os.path.join(tmp_dir, "%s.csv" % filename)
-
-    query_keys = [field.name for field in content_type.model_class()._meta.get_fields()]
-
-    query_keys.sort()
-    # Remove non-relevant columns for CSV file.
-    removed_fields = [
-        # TestJob fields:
-        "user_id", "actual_device_id", "definition",
-        "group_id", "id", "original_definition",
-        "sub_id", "submitter_id", "testdata", "testsuite",
-        # TestSuite fields:
-        "job_id",
-        # TestCase fields:
-        "actionlevels", "suite_id", "test_set_id"
-    ]
-    for field in removed_fields:
-        if field in query_keys:
-            query_keys.remove(field)
-
-    with open(file_path, 'wb+') as csv_file:
-        out = csv.DictWriter(csv_file, quoting=csv.QUOTE_ALL,
-                             extrasaction='ignore',
-                             fieldnames=query_keys)
-        out.writeheader()
-
-        for result in query_results:
-            result_dict = result.__dict__.copy()
-            # Encode the strings if necessary.
-            out.writerow({k: (v.encode('utf8') if isinstance(v, basestring) else v) for k, v in result_dict.items()})
-
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = "attachment; filename=%s.csv" % filename
-    with open(file_path, 'r') as csv_file:
-        response.write(csv_file.read())
-
-    _remove_dir(tmp_dir)
+    response = StreamingHttpResponse(stream, content_type=mime_type)
+    response['Content-Disposition'] = "attachment; filename=%s" % filename
     return response
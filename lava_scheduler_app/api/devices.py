@@ -29,6 +29,7 @@ from lava_scheduler_app.models import (
     Device,
     DeviceType,
     Tag,
+    TestJob,
     Worker
 )
 
@@ -235,17 +236,20 @@ class SchedulerDevicesAPI(ExposedV2API):
         devices = Device.objects.all()
         if not show_all:
             devices = Device.objects.exclude(health=Device.HEALTH_RETIRED)
-        devices = devices.order_by("hostname")
+        devices = devices.select_related("device_type", "user", "group").order_by("hostname")
+        # Current job of every device, in one query
+        current_jobs = dict(TestJob.objects.filter(actual_device__isnull=False)
+                            .exclude(state=TestJob.STATE_FINISHED)
+                            .values_list("actual_device_id", "id"))
 
         ret = []
         for device in devices:
             if device.is_visible_to(self.user):
-                current_job = device.current_job()
                 device_dict = {"hostname": device.hostname,
                                "type": device.device_type.name,
                                "health": device.get_health_display(),
                                "state": device.get_state_display(),
-                               "current_job": current_job.pk if current_job else None,
+                               "current_job": current_jobs.get(device.hostname),
                                "pipeline": True}
                 ret.append(device_dict)
 
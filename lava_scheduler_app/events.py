@@ -0,0 +1,180 @@
+# Copyright (C) 2018 Linaro Limited
+#
+# This file is part of LAVA Server.
+#
+# LAVA Server is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# LAVA Server is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along
+# with this program; if not, see <http://www.gnu.org/licenses>.
+
+from __future__ import unicode_literals
+
+import collections
+import itertools
+import mmap
+import os
+import struct
+
+import simplejson
+
+
+def with_sequence(frames, sequence):
+    """
+    Return the frames of an event with the sequence number added to the
+    json data (the fifth frame), so that the event keeps its five frames.
+    Events without json data are returned unchanged.
+    """
+    if len(frames) != 5:
+        return frames
+    try:
+        data = simplejson.loads(frames[4].decode("utf-8"))
+    except (UnicodeDecodeError, ValueError):
+        return frames
+    if not isinstance(data, dict):
+        return frames
+    data["sequence"] = sequence
+    return frames[:4] + [simplejson.dumps(data).encode("utf-8")]
+
+
+class EventBuffer(object):
+    """
+    Ring buffer of the last events published by lava-publisher.
+
+    Every event gets the next sequence number. The buffer keeps the last
+    'size' events so that a subscriber can replay the events it missed.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.sequence = 0
+        self.events = collections.deque(maxlen=size)
+
+    @property
+    def oldest(self):
+        """
+        Sequence number of the oldest event still available
+        """
+        return max(1, self.sequence - len(self.events) + 1)
+
+    def append(self, frames):
+        self.sequence += 1
+        self.events.append(frames)
+        return self.sequence
+
+    def since(self, sequence, limit):
+        """
+        Return the (sequence, frames) of at most 'limit' events published
+        after 'sequence'.
+        """
+        start = max(sequence + 1, self.oldest)
+        end = min(self.sequence, start + limit - 1)
+        if end < start:
+            return []
+        first = len(self.events) - (self.sequence - start) - 1
+        return list(zip(range(start, end + 1),
+                        itertools.islice(self.events, first, first + end - start + 1)))
+
+    def close(self):
+        pass
+
+
+class MappedEventBuffer(EventBuffer):
+    """
+    Event ring buffer stored in a memory-mapped file, so that the events and
+    the sequence number are kept when lava-publisher restarts.
+
+    The file is made of a header and 'size' slots of 'slot_size' bytes.
+    Events bigger than a slot are published but not kept.
+    """
+
+    MAGIC = b"LAVAEVT1"
+    # magic, number of slots, slot size, last sequence number
+    HEADER = struct.Struct("<8sIIQ")
+    # sequence number, length of the serialized frames
+    SLOT = struct.Struct("<QI")
+    FRAME = struct.Struct("<I")
+
+    def __init__(self, filename, size, slot_size=4096):
+        super(MappedEventBuffer, self).__init__(size)
+        self.slot_size = slot_size
+        length = self.HEADER.size + size * slot_size
+
+        fd = os.open(filename, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size != length:
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, length)
+            self.map = mmap.mmap(fd, length)
+        finally:
+            os.close(fd)
+
+        (magic, slots, current_slot_size, sequence) = self.HEADER.unpack_from(self.map, 0)
+        if (magic, slots, current_slot_size) == (self.MAGIC, size, slot_size):
+            self.sequence = sequence
+        else:
+            # New file or new geometry: start from scratch
+            self.map[:] = b"\x00" * length
+            self.sequence = 0
+            self._write_header()
+
+    def _write_header(self):
+        self.HEADER.pack_into(self.map, 0, self.MAGIC, self.size,
+                              self.slot_size, self.sequence)
+
+    def _slot(self, sequence):
+        return self.HEADER.size + (sequence % self.size) * self.slot_size
+
+    @property
+    def oldest(self):
+        return max(1, self.sequence - self.size + 1)
+
+    def append(self, frames):
+        self.sequence += 1
+        data = b"".join(self.FRAME.pack(len(frame)) + frame for frame in frames)
+        offset = self._slot(self.sequence)
+        if self.SLOT.size + len(data) > self.slot_size:
+            # Too big: mark the slot as empty
+            self.SLOT.pack_into(self.map, offset, self.sequence, 0)
+        else:
+            self.SLOT.pack_into(self.map, offset, self.sequence, len(data))
+            self.map[offset + self.SLOT.size:offset + self.SLOT.size + len(data)] = data
+        self._write_header()
+        return self.sequence
+
+    def _read(self, sequence):
+        offset = self._slot(sequence)
+        (stored, length) = self.SLOT.unpack_from(self.map, offset)
+        if stored != sequence or not length:
+            return None
+        offset += self.SLOT.size
+        end = offset + length
+        frames = []
+        while offset < end:
+            (size,) = self.FRAME.unpack_from(self.map, offset)
+            offset += self.FRAME.size
+            frames.append(self.map[offset:offset + size])
+            offset += size
+        return frames
+
+    def since(self, sequence, limit):
+        start = max(sequence + 1, self.oldest)
+        end = min(self.sequence, start + limit - 1)
+        events = []
+        for current in range(start, end + 1):
+            frames = self._read(current)
+            if frames is not None:
+                events.append((current, frames))
+        return events
+
+    def close(self):
+        self.map.flush()
+        self.map.close()
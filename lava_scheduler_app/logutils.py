@@ -0,0 +1,104 @@
+# Copyright (C) 2018 Linaro Limited
+#
+# This file is part of LAVA Server.
+#
+# LAVA Server is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# LAVA Server is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along
+# with this program; if not, see <http://www.gnu.org/licenses>.
+
+from __future__ import unicode_literals
+
+import re
+import simplejson
+import yaml
+
+from zmq.utils.strtypes import u
+
+
+# Allowed values for the level and timestamp frames, written verbatim
+LEVEL_RE = re.compile(r"^[a-z]+$")
+TIMESTAMP_RE = re.compile(r"^[0-9T:.+-]+$")
+# Characters escaped when writing a JSON document as YAML
+ESCAPED_RE = re.compile(r"[^\x20-\x7e]")
+SURROGATE_RE = re.compile("[\ud800-\udfff]")
+
+
+class LogMessageError(Exception):
+    pass
+
+
+def _yaml_escape(match):
+    code = ord(match.group(0))
+    if code > 0xffff:
+        return "\\U%08x" % code
+    return "\\u%04x" % code
+
+
+def json_to_yaml(data):
+    """
+    Serialize the decoded JSON data as a YAML flow collection on one line.
+
+    Not every JSON document is valid YAML: the characters outside of the
+    BMP are escaped by JSON encoders as surrogate pairs that YAML rejects,
+    as well as the lone surrogates. The data is encoded again with every
+    non-ASCII character escaped the YAML way.
+    """
+    dumped = simplejson.dumps(data, ensure_ascii=False)
+    if SURROGATE_RE.search(dumped) is not None:
+        raise LogMessageError("the message contains a lone surrogate")
+    return ESCAPED_RE.sub(_yaml_escape, dumped)
+
+
+def parse_log_message(frames):
+    """
+    Parse a log message sent by a dispatcher to lava-logs.
+
+    Two formats are accepted:
+    * [job_id, line]: the line being a YAML dictionary with the "dt", "lvl"
+      and "msg" keys. The line is parsed to find the level.
+    * [job_id, lvl, dt, msg]: msg being encoded as JSON. The line is built
+      from the frames, msg being decoded and encoded again as YAML.
+
+    Return (job_id, lvl, results, line) where results is the decoded message
+    for the "results" level (None otherwise) and line is the item to append
+    to output.yaml.
+    """
+    if len(frames) == 2:
+        (job_id, message) = (u(m) for m in frames)
+        try:
+            scanned = yaml.load(message, Loader=yaml.CLoader)
+        except yaml.YAMLError:
+            raise LogMessageError("data are not valid YAML")
+        try:
+            (lvl, msg) = (scanned["lvl"], scanned["msg"])
+        except TypeError:
+            raise LogMessageError("not a dictionary")
+        except KeyError:
+            raise LogMessageError("invalid log line, missing \"lvl\" or \"msg\" keys: %s" % message)
+        return (job_id, lvl, msg if lvl == "results" else None, "- %s" % message)
+
+    if len(frames) == 4:
+        (job_id, lvl, dt, message) = (u(m) for m in frames)
+        if LEVEL_RE.match(lvl) is None or TIMESTAMP_RE.match(dt) is None:
+            raise LogMessageError("invalid level or timestamp")
+        try:
+            data = simplejson.loads(message)
+        except ValueError:
+            raise LogMessageError("data are not valid JSON")
+        if lvl == "results" and not isinstance(data, dict):
+            raise LogMessageError("not a dictionary")
+        # Each item is written on exactly one line
+        line = '- {"dt": "%s", "lvl": "%s", "msg": %s}' % (dt, lvl, json_to_yaml(data))
+        return (job_id, lvl, data if lvl == "results" else None, line)
+
+    raise LogMessageError("invalid number of frames")
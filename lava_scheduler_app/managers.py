@@ -18,57 +18,130 @@
 
 from __future__ import unicode_literals
 
-from django.db import models
-from django.db.models import Q
+from django.db import connection, models
+from django.db.models import Avg, Case, Count, Max, Min, Q, When
+from django.db.models.expressions import RawSQL
 
 from django_restricted_resource.managers import RestrictedResourceQuerySet
 
 
-class RestrictedTestJobQuerySet(RestrictedResourceQuerySet):
+def viewing_group_ids(user):
+    """
+    Ids of the groups of the user, cached on the user object so that the
+    visibility of every queryset built for the same request does not query
+    the groups again.
+    """
+    if not hasattr(user, "_lava_group_ids"):
+        user._lava_group_ids = list(user.groups.values_list("id", flat=True))
+    return user._lava_group_ids
+
+
+def job_visibility(user, prefix=""):
+    """
+    Conditions on the visibility columns of the jobs, reached through
+    prefix (like "suite__job__"), for the jobs visible by the user.
+    Return None when the user can see every job.
+    """
+    from lava_scheduler_app.models import TestJob
+
+    def field(name):
+        return prefix + name
+
+    # Pipeline jobs.
+    if not user or user.is_anonymous():
+        return Q(**{field("is_public"): True})
+    if user.is_superuser or user.has_perm('lava_scheduler_app.cancel_resubmit_testjob') or \
+            user.has_perm('lava_scheduler_app.change_device'):
+        return None
+
+    conditions = (
+        Q(**{field("is_public"): True}) |
+        Q(**{field("submitter"): user}) |
+        (~Q(**{field("actual_device"): None}) & Q(**{field("actual_device__user"): user})) |
+        Q(**{field("visibility"): TestJob.VISIBLE_PUBLIC}) |
+        Q(**{field("visibility"): TestJob.VISIBLE_PERSONAL, field("submitter"): user})
+    )
+    group_ids = viewing_group_ids(user)
+    if group_ids:
+        # NOTE: this supposedly does OR and we need user to be in
+        # all the visibility groups if we allow multiple groups in
+        # field viewing groups.
+        viewing = TestJob.viewing_groups.through.objects.filter(group_id__in=group_ids)
+        conditions |= Q(**{field("visibility"): TestJob.VISIBLE_GROUP,
+                           field("id__in"): viewing.values("testjob_id")})
+    return conditions
 
-    def visible_by_user(self, user):
 
-        from lava_scheduler_app.models import TestJob
-
-        conditions = Q()
-        # Pipeline jobs.
-        if not user or user.is_anonymous():
-            conditions = Q(is_public=True)
-        elif not user.is_superuser and not user.has_perm('lava_scheduler_app.cancel_resubmit_testjob') and not user.has_perm('lava_scheduler_app.change_device'):
-            # continue adding conditions only if user is not superuser and
-            # does not have admin permission for jobs or devices.
-            conditions = (
-                Q(is_public=True) |
-                Q(submitter=user) |
-                (~Q(actual_device=None) & Q(actual_device__user=user)) |
-                Q(visibility=TestJob.VISIBLE_PUBLIC) |
-                Q(visibility=TestJob.VISIBLE_PERSONAL, submitter=user) |
-                # NOTE: this supposedly does OR and we need user to be in
-                # all the visibility groups if we allow multiple groups in
-                # field viewing groups.
-                Q(visibility=TestJob.VISIBLE_GROUP,
-                  viewing_groups__in=user.groups.all())
-            )
+class RestrictedTestJobQuerySet(RestrictedResourceQuerySet):
 
+    def visible_by_user(self, user):
+        conditions = job_visibility(user)
+        if conditions is None:
+            return self
         return self.filter(conditions)
 
 
 class RestrictedTestCaseQuerySet(RestrictedResourceQuerySet):
 
     def visible_by_user(self, user):
-
-        from lava_scheduler_app.models import TestJob
-        jobs = TestJob.objects.filter(
-            testsuite__testcase__in=self).visible_by_user(user)
-
-        return self.filter(suite__job__in=jobs)
+        conditions = job_visibility(user, "suite__job__")
+        if conditions is None:
+            return self
+        return self.filter(conditions)
 
 
 class RestrictedTestSuiteQuerySet(models.QuerySet):
 
     def visible_by_user(self, user):
+        conditions = job_visibility(user, "job__")
+        if conditions is None:
+            return self
+        return self.filter(conditions)
+
+    def refresh_counters(self):
+        """
+        Recompute the result counters of the suites from their test cases
+        """
+        suite_ids = list(self.values_list("id", flat=True))
+        if not suite_ids:
+            return 0
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "UPDATE lava_results_app_testsuite AS suite "
+                "SET (count_pass, count_fail, count_skip, count_unknown, first_logged) = ("
+                "SELECT COUNT(*) FILTER (WHERE result = 0), COUNT(*) FILTER (WHERE result = 1), "
+                "COUNT(*) FILTER (WHERE result = 2), COUNT(*) FILTER (WHERE result = 3), MIN(logged) "
+                "FROM lava_results_app_testcase WHERE suite_id = suite.id) "
+                "WHERE suite.id = ANY(%s)", [suite_ids])
+            return cursor.rowcount
+
+
+class MeasurementPointQuerySet(models.QuerySet):
 
-        from lava_scheduler_app.models import TestJob
-        jobs = TestJob.objects.filter(testsuite__in=self).visible_by_user(user)
+    def visible_by_user(self, user):
+        conditions = job_visibility(user, "job__")
+        if conditions is None:
+            return self
+        return self.filter(conditions)
 
-        return self.filter(job__in=jobs)
+    def downsample(self, start, end, points):
+        """
+        Aggregate the measurements between start and end in (at most)
+        points buckets of the same duration, computed by the database.
+        """
+        width = max((end - start).total_seconds() / points, 1.0)
+        # Like the charts, every result but pass (0) is a failure
+        failures = Count(Case(When(~Q(result=0), then=1)))
+        bucket = RawSQL("FLOOR(EXTRACT(EPOCH FROM lava_results_app_measurementpoint.end_time) / %s)",
+                        [width])
+        buckets = self.filter(end_time__gte=start, end_time__lte=end) \
+                      .annotate(bucket=bucket).values("bucket") \
+                      .annotate(start=Min("end_time"), average=Avg("measurement"),
+                                minimum=Min("measurement"), maximum=Max("measurement"),
+                                count=Count("pk"), failures=failures) \
+                      .order_by("bucket")
+        # The measurements are decimals: return floats like the average
+        return [{"start": item["start"], "average": item["average"],
+                 "minimum": float(item["minimum"]), "maximum": float(item["maximum"]),
+                 "count": item["count"], "failures": item["failures"]}
+                for item in buckets]
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.10 on 2018-03-05 10:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lava_scheduler_app', '0036_remove_is_pipeline'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='testjob',
+            name='search_document',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.RunSQL(
+            sql="""UPDATE lava_scheduler_app_testjob SET search_document = concat_ws(' ',
+    NULLIF(sub_id, ''),
+    NULLIF(description, ''),
+    (SELECT username FROM auth_user WHERE auth_user.id = submitter_id),
+    actual_device_id,
+    requested_device_type_id)""",
+            reverse_sql=migrations.RunSQL.noop),
+        migrations.RunSQL(
+            sql="CREATE INDEX lava_scheduler_app_testjob_search_document ON lava_scheduler_app_testjob "
+                "USING gin (to_tsvector('simple'::regconfig, search_document))",
+            reverse_sql="DROP INDEX lava_scheduler_app_testjob_search_document"),
+    ]
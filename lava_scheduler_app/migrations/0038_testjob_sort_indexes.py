@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.10 on 2018-03-07 14:31
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lava_scheduler_app', '0037_testjob_search_document'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='testjob',
+            index_together=set([('health', 'state', 'requested_device_type'), ('submit_time', 'id')]),
+        ),
+        # Indexes on the sort expressions of all_jobs_with_custom_sort
+        migrations.RunSQL(
+            sql="CREATE INDEX lava_scheduler_app_testjob_device_sort ON lava_scheduler_app_testjob "
+                "((coalesce(actual_device_id, requested_device_type_id)))",
+            reverse_sql="DROP INDEX lava_scheduler_app_testjob_device_sort"),
+        migrations.RunSQL(
+            sql="CREATE INDEX lava_scheduler_app_testjob_duration_sort ON lava_scheduler_app_testjob "
+                "((date_trunc('second', end_time - start_time)))",
+            reverse_sql="DROP INDEX lava_scheduler_app_testjob_duration_sort"),
+    ]
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.10 on 2018-03-12 09:47
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lava_scheduler_app', '0038_testjob_sort_indexes'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql="""UPDATE lava_scheduler_app_testjob SET search_document = concat_ws(' ',
+    CASE state
+        WHEN 0 THEN 'Submitted'
+        WHEN 1 THEN 'Scheduling'
+        WHEN 2 THEN 'Scheduled'
+        WHEN 3 THEN 'Running'
+        WHEN 4 THEN 'Canceling'
+        WHEN 5 THEN 'Finished'
+    END,
+    NULLIF(search_document, ''))""",
+            reverse_sql="""UPDATE lava_scheduler_app_testjob
+    SET search_document = substring(search_document from position(' ' in search_document) + 1)"""),
+    ]
@@ -14,11 +14,14 @@ import socket
 import sys
 import yaml
 
+from collections import OrderedDict
+
 from django.db.models import Q
 from django.conf import settings
 from django.contrib.auth.models import User, Group
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.admin.models import LogEntry, ADDITION, CHANGE
+from django.contrib.postgres.aggregates import ArrayAgg
 from django.contrib.postgres.fields import ArrayField
 from django.contrib.sites.models import Site
 from django.core.cache import cache
@@ -31,7 +34,7 @@ from django.core.exceptions import (
 from django.core.mail import send_mail
 from django.core.urlresolvers import reverse
 from django.core.validators import validate_email
-from django.db import models, IntegrityError
+from django.db import models, transaction, IntegrityError
 from django.db.models.signals import pre_save
 from django.dispatch import receiver
 from django.shortcuts import get_object_or_404
@@ -46,7 +49,7 @@ from django_restricted_resource.models import (
     RestrictedResource,
     RestrictedResourceManager
 )
-from lava_scheduler_app.managers import RestrictedTestJobQuerySet
+from lava_scheduler_app.managers import RestrictedTestJobQuerySet, viewing_group_ids
 from lava_scheduler_app.schema import (
     validate_submission,
     handle_include_option,
@@ -387,10 +390,18 @@ class DeviceType(models.Model):
         :param user: User to check
         :return: True if some devices of this DeviceType are visible
         """
+        # Already checked for this user object, usually in the same request
+        checked = getattr(user, "_lava_visible_device_types", None)
+        if checked is None:
+            checked = user._lava_visible_device_types = {}
+        if self.name in checked:
+            return checked[self.name]
+
         # Grab the key from the cache if available
         version = user.id if user.id is not None else -1
         cached_value = cache.get(self.name, version=version)
         if cached_value is not None:
+            checked[self.name] = cached_value
             return cached_value
 
         devices = Device.objects.filter(device_type=self) \
@@ -407,6 +418,7 @@ class DeviceType(models.Model):
             result = devices.exists()
         # Cache the value for 30 seconds
         cache.set(self.name, result, 30, version=version)
+        checked[self.name] = result
         return result
 
 
@@ -1281,7 +1293,9 @@ class TestJob(RestrictedResource):
     A test job is a test process that will be run on a Device.
     """
     class Meta:
-        index_together = ["health", "state", "requested_device_type"]
+        index_together = [["health", "state", "requested_device_type"],
+                          # used by the keyset pagination of the job tables
+                          ["submit_time", "id"]]
 
     objects = RestrictedResourceManager.from_queryset(
         RestrictedTestJobQuerySet)()
@@ -1352,6 +1366,14 @@ class TestJob(RestrictedResource):
         default=None
     )
 
+    # Words matched by the search box of the job tables, indexed with a full
+    # text search index. Kept up to date by update_search_document.
+    search_document = models.TextField(
+        blank=True,
+        default="",
+        editable=False
+    )
+
     health_check = models.BooleanField(default=False)
 
     # Only one of requested_device_type or dynamic_connection should be
@@ -1406,6 +1428,13 @@ class TestJob(RestrictedResource):
             return None
         return self.end_time - self.start_time
 
+    def build_search_document(self):
+        # The state should be the first word, see update_search_document
+        return " ".join([word for word in [
+            self.get_state_display(), self.sub_id, self.description,
+            self.submitter.username, self.actual_device_id,
+            self.requested_device_type_id] if word])
+
     STATE_SUBMITTED, STATE_SCHEDULING, STATE_SCHEDULED, STATE_RUNNING, STATE_CANCELING, STATE_FINISHED = range(6)
     STATE_CHOICES = (
         (STATE_SUBMITTED, "Submitted"),
@@ -1542,6 +1571,12 @@ class TestJob(RestrictedResource):
         self.state = TestJob.STATE_FINISHED
 
         self.end_time = timezone.now()
+        # Copy the measurements for the charts once the job is saved. The
+        # callers save the job in the same transaction.
+        from lava_results_app.models import MeasurementPoint
+        job_id = self.id
+        transaction.on_commit(lambda: MeasurementPoint.append([job_id]))
+
         # TODO: check that self.actual_device is locked by the
         # select_for_update on the TestJob
         # Skip non-scheduled jobs and dynamic_connections
@@ -1809,6 +1844,64 @@ class TestJob(RestrictedResource):
 
         return False
 
+    @classmethod
+    def can_view_ids(cls, user, job_ids):
+        """
+        Ids of the jobs in job_ids that the user can view, with the rules of
+        can_view, checked in one query for every job.
+        :param user:  the user making the request
+        :param job_ids: ids of the jobs to check
+        :return: set of ids
+        """
+        if not job_ids:
+            return set()
+        if user.is_superuser:
+            return set(job_ids)
+        if user.is_anonymous():
+            (user_id, group_ids, change_device) = (None, set(), False)
+        else:
+            user_id = user.id
+            group_ids = set(viewing_group_ids(user))
+            change_device = user.has_perm('lava_scheduler_app.change_device')
+
+        jobs = cls.objects.filter(id__in=job_ids).values(
+            "id", "submitter_id", "is_public", "visibility",
+            "requested_device_type_id", "requested_device_type__owners_only",
+            "actual_device_id", "actual_device__user_id", "actual_device__group_id"
+        ).annotate(groups=ArrayAgg("viewing_groups__id"))
+        visible = set()
+        device_types = {}
+        for job in jobs:
+            # _can_admin
+            if user_id is not None and job["submitter_id"] == user_id:
+                visible.add(job["id"])
+                continue
+            if job["actual_device_id"] is not None:
+                # Device.can_admin: owned by the user, or by one of his
+                # groups when the device has no owner
+                if job["actual_device__user_id"] is not None:
+                    owner = user_id is not None and job["actual_device__user_id"] == user_id
+                else:
+                    owner = job["actual_device__group_id"] in group_ids
+                if owner or change_device:
+                    visible.add(job["id"])
+                    continue
+            device_type = job["requested_device_type_id"]
+            if device_type and job["requested_device_type__owners_only"]:
+                if device_type not in device_types:
+                    device_types[device_type] = DeviceType(
+                        name=device_type, owners_only=True).some_devices_visible_to(user)
+                if not device_types[device_type]:
+                    continue
+            if job["is_public"]:
+                visible.add(job["id"])
+            elif job["visibility"] == cls.VISIBLE_GROUP:
+                # The user should be member of every groups
+                groups = set(group for group in job["groups"] if group is not None)
+                if groups.issubset(group_ids):
+                    visible.add(job["id"])
+        return visible
+
     def _can_admin(self, user, resubmit=True):
         """
         used to check for things like if the user can cancel or annotate
@@ -2004,34 +2097,27 @@ class TestJob(RestrictedResource):
     def get_passfail_results(self):
         # Get pass fail results per lava_results_app.testsuite.
         results = {}
-        from lava_results_app.models import TestCase
         for suite in self.testsuite_set.all():
             results[suite.name] = {
-                'pass': suite.testcase_set.filter(
-                    result=TestCase.RESULT_MAP['pass']).count(),
-                'fail': suite.testcase_set.filter(
-                    result=TestCase.RESULT_MAP['fail']).count(),
-                'skip': suite.testcase_set.filter(
-                    result=TestCase.RESULT_MAP['skip']).count(),
-                'unknown': suite.testcase_set.filter(
-                    result=TestCase.RESULT_MAP['unknown']).count()
+                'pass': suite.count_pass,
+                'fail': suite.count_fail,
+                'skip': suite.count_skip,
+                'unknown': suite.count_unknown
             }
         return results
 
     def get_measurement_results(self):
         # Get measurement values per lava_results_app.testcase.
         # TODO: add min, max
-        from lava_results_app.models import TestSuite, TestCase
+        from lava_results_app.models import TestSuite
 
         results = {}
-        for suite in TestSuite.objects.filter(job=self).prefetch_related(
-                'testcase_set').annotate(
-                    test_case_avg=models.Avg('testcase__measurement')):
+        for suite in TestSuite.objects.filter(job=self).annotate(
+                test_case_avg=models.Avg('testcase__measurement')):
             if suite.name not in results:
                 results[suite.name] = {}
             results[suite.name]['measurement'] = suite.test_case_avg
-            results[suite.name]['fail'] = suite.testcase_set.filter(
-                result=TestCase.RESULT_MAP['fail']).count()
+            results[suite.name]['fail'] = suite.count_fail
 
         return results
 
@@ -2308,12 +2394,9 @@ class TestJob(RestrictedResource):
                 left_suites_count = {}
                 for suite in left_suites_intersection:
                     left_suites_count[suite.name] = (
-                        suite.testcase_set.filter(
-                            result=TestCase.RESULT_PASS).count(),
-                        suite.testcase_set.filter(
-                            result=TestCase.RESULT_FAIL).count(),
-                        suite.testcase_set.filter(
-                            result=TestCase.RESULT_SKIP).count()
+                        suite.count_pass,
+                        suite.count_fail,
+                        suite.count_skip
                     )
 
                 right_suites_intersection = old_suites.filter(
@@ -2324,12 +2407,9 @@ class TestJob(RestrictedResource):
                 right_suites_count = {}
                 for suite in right_suites_intersection:
                     right_suites_count[suite.name] = (
-                        suite.testcase_set.filter(
-                            result=TestCase.RESULT_PASS).count(),
-                        suite.testcase_set.filter(
-                            result=TestCase.RESULT_FAIL).count(),
-                        suite.testcase_set.filter(
-                            result=TestCase.RESULT_SKIP).count()
+                        suite.count_pass,
+                        suite.count_fail,
+                        suite.count_skip
                     )
 
                 kwargs["query"]["left_suites_count"] = left_suites_count
@@ -2677,7 +2757,8 @@ class Notification(models.Model):
 
     def get_callback_data(self):
 
-        from lava_results_app.dbutils import export_testcase
+        from lava_results_app.dbutils import export_testcases
+        from lava_results_app.models import TestCase
 
         if self.callback_method == Notification.GET:
             return None
@@ -2714,12 +2795,16 @@ class Notification(models.Model):
             # Results.
             if self.callback_dataset in [Notification.RESULTS,
                                          Notification.ALL]:
-                data["results"] = {}
+                results = OrderedDict()
                 for test_suite in self.test_job.testsuite_set.all():
-                    yaml_list = []
-                    for test_case in test_suite.testcase_set.all():
-                        yaml_list.append(export_testcase(test_case))
-                    data["results"][test_suite.name] = yaml.dump(yaml_list)
+                    results[test_suite.name] = []
+                test_cases = TestCase.objects.filter(
+                    suite__job=self.test_job).order_by('suite_id', 'id')
+                for row in export_testcases(test_cases):
+                    results[row['suite']].append(row)
+                data["results"] = {}
+                for (name, yaml_list) in results.items():
+                    data["results"][name] = yaml.dump(yaml_list)
 
             return data
 
@@ -2864,6 +2949,29 @@ def process_notifications(sender, **kwargs):
                     new_job.send_notifications()
 
 
+@receiver(pre_save, sender=TestJob, dispatch_uid="update_search_document")
+def update_search_document(sender, **kwargs):
+    """
+    The search document holds the state, sub id, description, submitter,
+    device and requested device type of the job. The job id is not known
+    before the first save and is matched separately.
+    Only the state and the device can change once the job is submitted: the
+    first word of the document is replaced by the current state and the
+    device is appended, without loading the submitter again.
+    """
+    job = kwargs["instance"]
+    if not job.search_document:
+        # The submitter is set by the caller, no need to query it
+        job.search_document = job.build_search_document()
+        return
+    words = job.search_document.split(" ", 1)
+    words[0] = job.get_state_display()
+    if job.actual_device_id is not None and \
+            job.actual_device_id not in words[-1].split():
+        words.append(job.actual_device_id)
+    job.search_document = " ".join(words)
+
+
 @python_2_unicode_compatible
 class TestJobUser(models.Model):
 
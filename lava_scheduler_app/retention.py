@@ -0,0 +1,360 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2017 Linaro Limited
+#
+# This file is part of LAVA.
+#
+# LAVA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License version 3
+# as published by the Free Software Foundation
+#
+# LAVA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Retention of test jobs.
+
+A retention policy selects the jobs to purge from the database and from
+MEDIA_ROOT/job-output. The engine deletes the selected jobs by batches of
+ids using set-based DELETE statements (children first), removes the output
+directories on a pool of threads and records its progress in an optional
+checkpoint file so that an interrupted run can be resumed.
+"""
+
+from __future__ import unicode_literals
+
+import datetime
+import errno
+import json
+import os
+import re
+import shutil
+import time
+from multiprocessing.pool import ThreadPool
+
+import yaml
+
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.utils import timezone
+
+from lava_results_app.models import (
+    ActionData,
+    BugLink,
+    LavaResult,
+    MeasurementPoint,
+    NamedTestAttribute,
+    QueryOmitResult,
+    TestCase,
+    TestData,
+    TestSet,
+    TestSuite,
+)
+from lava_scheduler_app.models import (
+    Device,
+    DeviceType,
+    Notification,
+    NotificationRecipient,
+    TestJob,
+    TestJobUser,
+)
+
+
+JOB_STATES = {
+    "SUBMITTED": TestJob.STATE_SUBMITTED,
+    "SCHEDULING": TestJob.STATE_SCHEDULING,
+    "SCHEDULED": TestJob.STATE_SCHEDULED,
+    "RUNNING": TestJob.STATE_RUNNING,
+    "CANCELING": TestJob.STATE_CANCELING,
+    "FINISHED": TestJob.STATE_FINISHED
+}
+
+JOB_HEALTHS = {
+    "UNKNOWN": TestJob.HEALTH_UNKNOWN,
+    "COMPLETE": TestJob.HEALTH_COMPLETE,
+    "INCOMPLETE": TestJob.HEALTH_INCOMPLETE,
+    "CANCELED": TestJob.HEALTH_CANCELED
+}
+
+
+class RetentionError(Exception):
+    """ Invalid retention policy or checkpoint """
+
+
+def parse_age(value):
+    """
+    Parse an age of the form "12h" (hours) or "30d" (days).
+    """
+    match = re.match(r"^(?P<time>\d+)(?P<unit>(h|d))$", str(value))
+    if match is None:
+        raise RetentionError("Invalid age '%s'" % value)
+    if match.group("unit") == "d":
+        return datetime.timedelta(days=int(match.group("time")))
+    return datetime.timedelta(hours=int(match.group("time")))
+
+
+class RetentionPolicy(object):
+    """
+    Select the jobs matching every given criteria.
+
+    older_than applies to the end time of the job, the other criteria are
+    either a single value or a list of values.
+    """
+
+    KEYS = ["older_than", "state", "health", "submitter", "device_type"]
+
+    def __init__(self, older_than=None, state=None, health=None,
+                 submitter=None, device_type=None):
+        if not any([older_than, state, health, submitter, device_type]):
+            raise RetentionError("A policy should specify at least one filtering option")
+        self.older_than = parse_age(older_than) if older_than else None
+        self.states = self._lookup(state, JOB_STATES, "state")
+        self.healths = self._lookup(health, JOB_HEALTHS, "health")
+        self.submitters = self._as_list(submitter)
+        self.device_types = self._as_list(device_type)
+
+    @classmethod
+    def from_dict(cls, data):
+        if not isinstance(data, dict):
+            raise RetentionError("A policy should be a dictionary")
+        unknown = set(data.keys()) - set(cls.KEYS)
+        if unknown:
+            raise RetentionError("Unknown policy keys: %s" % ", ".join(sorted(unknown)))
+        return cls(**data)
+
+    @staticmethod
+    def _as_list(value):
+        if value is None:
+            return []
+        if isinstance(value, (list, tuple)):
+            return [str(v) for v in value]
+        return [str(value)]
+
+    def _lookup(self, value, choices, name):
+        ret = []
+        for item in self._as_list(value):
+            if item.upper() not in choices:
+                raise RetentionError("Invalid %s '%s'" % (name, item))
+            ret.append(choices[item.upper()])
+        return ret
+
+    def queryset(self):
+        jobs = TestJob.objects.all()
+        if self.older_than is not None:
+            jobs = jobs.filter(end_time__lt=(timezone.now() - self.older_than))
+        if self.states:
+            jobs = jobs.filter(state__in=self.states)
+        if self.healths:
+            jobs = jobs.filter(health__in=self.healths)
+        if self.submitters:
+            users = User.objects.filter(username__in=self.submitters)
+            if users.count() != len(set(self.submitters)):
+                missing = set(self.submitters) - set(users.values_list("username", flat=True))
+                raise RetentionError("Unable to find submitter '%s'" % "', '".join(sorted(missing)))
+            jobs = jobs.filter(submitter__in=users)
+        if self.device_types:
+            dts = DeviceType.objects.filter(name__in=self.device_types)
+            jobs = jobs.filter(requested_device_type__in=dts)
+        return jobs
+
+
+def load_policies(filename):
+    """
+    Load the retention policies from a yaml file:
+
+    policies:
+    - older_than: 30d
+      health: [complete, canceled]
+    - older_than: 7d
+      submitter: lava-health
+    """
+    try:
+        with open(filename, "r") as f_in:
+            data = yaml.safe_load(f_in)
+    except (IOError, OSError) as exc:
+        raise RetentionError("Unable to read '%s': %s" % (filename, exc))
+    except yaml.YAMLError as exc:
+        raise RetentionError("Invalid policy file '%s': %s" % (filename, exc))
+    if not isinstance(data, dict) or not isinstance(data.get("policies"), list):
+        raise RetentionError("'%s' should contain a list of policies" % filename)
+    return [RetentionPolicy.from_dict(policy) for policy in data["policies"]]
+
+
+def _rmtree(path):
+    try:
+        shutil.rmtree(path)
+    except OSError as exc:
+        if exc.errno == errno.ENOENT:
+            return None
+        return "%s: %s" % (path, exc)
+    return None
+
+
+class RetentionEngine(object):
+    """
+    Purge the jobs selected by the policies.
+
+    duty_cycle is the fraction of the time spent working: after each batch
+    the engine sleeps for a duration proportional to the time taken by the
+    batch, so the purge slows down by itself when the database or the
+    filesystem is loaded.
+    """
+
+    def __init__(self, policies, batch_size=1000, workers=4, duty_cycle=1.0,
+                 checkpoint=None, dry_run=False, output=None):
+        if not policies:
+            raise RetentionError("No retention policy")
+        if batch_size < 1:
+            raise RetentionError("The batch size should be a positive integer")
+        if workers < 1:
+            raise RetentionError("The number of workers should be a positive integer")
+        if not 0 < duty_cycle <= 1:
+            raise RetentionError("The duty cycle should be in ]0, 1]")
+        self.policies = policies
+        self.batch_size = batch_size
+        self.workers = workers
+        self.duty_cycle = duty_cycle
+        self.checkpoint = checkpoint
+        self.dry_run = dry_run
+        self.output = output if output is not None else (lambda msg: None)
+
+    def jobs(self):
+        ret = self.policies[0].queryset()
+        for policy in self.policies[1:]:
+            ret = ret | policy.queryset()
+        return ret.order_by("id")
+
+    # Checkpoint handling
+    def _load_checkpoint(self):
+        if self.checkpoint is None:
+            return {"last_id": 0, "directories": []}
+        try:
+            with open(self.checkpoint, "r") as f_in:
+                data = json.load(f_in)
+        except IOError as exc:
+            if exc.errno == errno.ENOENT:
+                return {"last_id": 0, "directories": []}
+            raise RetentionError("Unable to read the checkpoint: %s" % exc)
+        except ValueError as exc:
+            raise RetentionError("Invalid checkpoint '%s': %s" % (self.checkpoint, exc))
+        return {"last_id": int(data.get("last_id", 0)),
+                "directories": list(data.get("directories", []))}
+
+    def _save_checkpoint(self, last_id, directories):
+        if self.checkpoint is None or self.dry_run:
+            return
+        tmp = self.checkpoint + ".tmp"
+        with open(tmp, "w") as f_out:
+            json.dump({"last_id": last_id, "directories": directories}, f_out)
+            f_out.flush()
+            os.fsync(f_out.fileno())
+        os.rename(tmp, self.checkpoint)
+
+    # Purging
+    def _delete_rows(self, job_ids):
+        """
+        Delete the jobs and every dependent row, leaves first, without
+        loading the objects in memory.
+        """
+        # pylint: disable=protected-access
+        testcase_ct = ContentType.objects.get_for_model(TestCase)
+        testsuite_ct = ContentType.objects.get_for_model(TestSuite)
+        testjob_ct = ContentType.objects.get_for_model(TestJob)
+        testdata_ct = ContentType.objects.get_for_model(TestData)
+
+        suites = TestSuite.objects.filter(job_id__in=job_ids).values("id")
+        cases = TestCase.objects.filter(suite__job_id__in=job_ids).values("id")
+        testdata = TestData.objects.filter(testjob_id__in=job_ids).values("id")
+
+        querysets = [
+            BugLink.objects.filter(content_type=testcase_ct, object_id__in=cases),
+            BugLink.objects.filter(content_type=testsuite_ct, object_id__in=suites),
+            QueryOmitResult.objects.filter(content_type=testcase_ct, object_id__in=cases),
+            QueryOmitResult.objects.filter(content_type=testsuite_ct, object_id__in=suites),
+            QueryOmitResult.objects.filter(content_type=testjob_ct, object_id__in=job_ids),
+            ActionData.objects.filter(testdata_id__in=testdata),
+            ActionData.objects.filter(testcase_id__in=cases),
+            NamedTestAttribute.objects.filter(content_type=testdata_ct, object_id__in=testdata),
+            TestData.objects.filter(testjob_id__in=job_ids),
+            LavaResult.objects.filter(job_id__in=job_ids),
+            MeasurementPoint.objects.filter(job_id__in=job_ids),
+            TestCase.objects.filter(suite__job_id__in=job_ids),
+            TestSet.objects.filter(suite__job_id__in=job_ids),
+            TestSuite.objects.filter(job_id__in=job_ids),
+            NotificationRecipient.objects.filter(notification__test_job_id__in=job_ids),
+            Notification.objects.filter(test_job_id__in=job_ids),
+            TestJobUser.objects.filter(test_job_id__in=job_ids),
+            TestJob.tags.through.objects.filter(testjob_id__in=job_ids),
+            TestJob.viewing_groups.through.objects.filter(testjob_id__in=job_ids),
+            TestJob.failure_tags.through.objects.filter(testjob_id__in=job_ids),
+        ]
+        with transaction.atomic():
+            for query in querysets:
+                query._raw_delete(query.db)
+            Device.objects.filter(last_health_report_job_id__in=job_ids).update(last_health_report_job=None)
+            TestJob.objects.filter(id__in=job_ids)._raw_delete(TestJob.objects.db)
+
+    def _remove_directories(self, pool, directories):
+        for error in pool.imap_unordered(_rmtree, directories):
+            if error is not None:
+                self.output("  -> Unable to remove the directory %s" % error)
+
+    def run(self):
+        """
+        Purge the jobs and return the number of removed jobs.
+        """
+        state = self._load_checkpoint()
+        pool = ThreadPool(self.workers)
+        try:
+            # Finish the removals interrupted during the previous run
+            if state["directories"] and not self.dry_run:
+                self.output("Resuming: removing %d directories" % len(state["directories"]))
+                self._remove_directories(pool, state["directories"])
+                self._save_checkpoint(state["last_id"], [])
+
+            jobs = self.jobs()
+            if state["last_id"]:
+                jobs = jobs.filter(id__gt=state["last_id"])
+            self.output("Removing %d jobs" % jobs.count())
+
+            last_id = state["last_id"]
+            removed = 0
+            while True:
+                start = time.time()
+                batch = list(jobs.filter(id__gt=last_id).values_list("id", "end_time", "submit_time")[:self.batch_size])
+                if not batch:
+                    break
+                job_ids = [job[0] for job in batch]
+                directories = [TestJob(id=job[0], submit_time=job[2]).output_dir for job in batch]
+                for (job_id, end_time, _), directory in zip(batch, directories):
+                    self.output("* %d (%s): %s" % (job_id, end_time, directory))
+                last_id = job_ids[-1]
+                removed += len(job_ids)
+
+                if not self.dry_run:
+                    # Record the directories before removing the rows: they
+                    # would be lost if the process is killed in-between.
+                    self._save_checkpoint(last_id, directories)
+                    self._delete_rows(job_ids)
+                    self._remove_directories(pool, directories)
+                    self._save_checkpoint(last_id, [])
+
+                if self.duty_cycle < 1:
+                    delay = (time.time() - start) * (1 - self.duty_cycle) / self.duty_cycle
+                    self.output("sleeping %.1fs..." % delay)
+                    time.sleep(delay)
+        finally:
+            pool.close()
+            pool.join()
+
+        if self.checkpoint is not None and not self.dry_run:
+            try:
+                os.unlink(self.checkpoint)
+            except OSError:
+                pass
+        return removed
@@ -36,11 +36,31 @@ from lava_scheduler_app.models import (
     TestJob,
     Worker
 )
+from lava_server import metrics
+from lava_server.tracing import TRACER
+
+
+SCHEDULE_DURATION = metrics.histogram(
+    "lava_scheduler_pass_seconds", "Duration of the scheduling passes", ["step"])
+SCHEDULED_JOBS = metrics.counter(
+    "lava_scheduler_jobs_scheduled_total", "Jobs scheduled", ["kind"])
+JOBS_PER_PASS = metrics.histogram(
+    "lava_scheduler_jobs_per_pass", "Jobs scheduled by each scheduling pass",
+    buckets=(0, 1, 5, 10, 25, 50, 100, 250, 500))
+
+
+def scheduled_jobs():
+    return sum(child.value for child in SCHEDULED_JOBS.children.values())
 
 
 def schedule(logger):
-    available_devices = schedule_health_checks(logger)
-    schedule_jobs(logger, available_devices)
+    before = scheduled_jobs()
+    with SCHEDULE_DURATION.labels("total").time(), TRACER.trace("schedule"):
+        with SCHEDULE_DURATION.labels("health-checks").time(), TRACER.span("health-checks"):
+            available_devices = schedule_health_checks(logger)
+        with SCHEDULE_DURATION.labels("jobs").time(), TRACER.span("jobs"):
+            schedule_jobs(logger, available_devices)
+    JOBS_PER_PASS.observe(scheduled_jobs() - before)
 
 
 def schedule_health_checks(logger):
@@ -56,10 +76,11 @@ def schedule_health_checks(logger):
             devices = devices.filter(health__in=[Device.HEALTH_GOOD,
                                                  Device.HEALTH_UNKNOWN])
             devices = devices.order_by("hostname")
-            available_devices[dt.name] = list(devices.values_list("hostname", flat=True))
+            with TRACER.span("available devices", device_type=dt.name):
+                available_devices[dt.name] = list(devices.values_list("hostname", flat=True))
 
         else:
-            with transaction.atomic():
+            with TRACER.span("health-checks", device_type=dt.name), transaction.atomic():
                 available_devices[dt.name] = schedule_health_checks_for_device_type(logger, dt)
 
     # Print disabled device types
@@ -77,36 +98,16 @@ def schedule_health_checks_for_device_type(logger, dt):
                                          Device.HEALTH_UNKNOWN,
                                          Device.HEALTH_LOOPING])
     devices = devices.order_by("hostname")
+    with TRACER.span("lock devices"):
+        devices = list(devices)
 
     print_header = True
     available_devices = []
     for device in devices:
-        # Do we have an health check
-        health_check = device.get_health_check()
-        if health_check is None:
-            available_devices.append(device.hostname)
-            continue
+        with TRACER.span("health-check lookup", device=device.hostname):
+            (health_check, scheduling) = health_check_required(device, dt)
 
-        # Do we have to schedule an health check?
-        scheduling = False
-        if device.health in [Device.HEALTH_UNKNOWN, Device.HEALTH_LOOPING]:
-            scheduling = True
-        elif device.last_health_report_job is None:
-            scheduling = True
-        else:
-            submit_time = device.last_health_report_job.submit_time
-            if dt.health_denominator == DeviceType.HEALTH_PER_JOB:
-                count = device.testjobs.filter(health_check=False,
-                                               start_time__gte=submit_time).count()
-
-                scheduling = count >= dt.health_frequency
-            else:
-                frequency = datetime.timedelta(hours=dt.health_frequency)
-                now = timezone.now()
-
-                scheduling = submit_time + frequency < now
-
-        if not scheduling:
+        if health_check is None or not scheduling:
             available_devices.append(device.hostname)
             continue
 
@@ -120,7 +121,8 @@ def schedule_health_checks_for_device_type(logger, dt):
                      device.get_health_display())
         logger.debug("  |--> scheduling health check")
         try:
-            schedule_health_check(device, health_check)
+            with TRACER.span("schedule health-check", device=device.hostname):
+                schedule_health_check(device, health_check)
         except Exception as exc:
             # If the health check cannot be schedule, set health to BAD to exclude the device
             logger.error("  |--> Unable to schedule health check")
@@ -133,12 +135,42 @@ def schedule_health_checks_for_device_type(logger, dt):
     return available_devices
 
 
+def health_check_required(device, dt):
+    """
+    Return the health check definition of the device (or None) and whether
+    it should be scheduled now.
+    """
+    # Do we have an health check
+    health_check = device.get_health_check()
+    if health_check is None:
+        return (None, False)
+
+    # Do we have to schedule an health check?
+    if device.health in [Device.HEALTH_UNKNOWN, Device.HEALTH_LOOPING]:
+        return (health_check, True)
+    if device.last_health_report_job is None:
+        return (health_check, True)
+
+    submit_time = device.last_health_report_job.submit_time
+    if dt.health_denominator == DeviceType.HEALTH_PER_JOB:
+        count = device.testjobs.filter(health_check=False,
+                                       start_time__gte=submit_time).count()
+
+        return (health_check, count >= dt.health_frequency)
+
+    frequency = datetime.timedelta(hours=dt.health_frequency)
+    now = timezone.now()
+
+    return (health_check, submit_time + frequency < now)
+
+
 def schedule_health_check(device, definition):
     user = User.objects.get(username="lava-health")
     job = _create_pipeline_job(yaml.load(definition), user, [], device_type=device.device_type, orig=definition)
     job.health_check = True
     job.go_state_scheduled(device)
     job.save()
+    SCHEDULED_JOBS.labels("health-check").inc()
 
 
 def schedule_jobs(logger, available_devices):
@@ -147,10 +179,10 @@ def schedule_jobs(logger, available_devices):
         # Check that some devices are available for this device-type
         if not available_devices.get(dt.name):
             continue
-        with transaction.atomic():
+        with TRACER.span("jobs", device_type=dt.name), transaction.atomic():
             schedule_jobs_for_device_type(logger, dt, available_devices[dt.name])
 
-    with transaction.atomic():
+    with TRACER.span("multinode transition"), transaction.atomic():
         # Transition multinode if needed
         transition_multinode_jobs(logger)
 
@@ -164,6 +196,8 @@ def schedule_jobs_for_device_type(logger, dt, available_devices):
     devices = devices.filter(health__in=[Device.HEALTH_GOOD,
                                          Device.HEALTH_UNKNOWN])
     devices = devices.order_by("is_public", "hostname")
+    with TRACER.span("lock devices"):
+        devices = list(devices)
 
     for device in devices:
         # Check that the device had been marked available by
@@ -171,7 +205,8 @@ def schedule_jobs_for_device_type(logger, dt, available_devices):
         # IDLE between the two functions.
         if device.hostname not in available_devices:
             continue
-        schedule_jobs_for_device(logger, device)
+        with TRACER.span("device", device=device.hostname):
+            schedule_jobs_for_device(logger, device)
 
 
 def schedule_jobs_for_device(logger, device):
@@ -180,31 +215,40 @@ def schedule_jobs_for_device(logger, device):
     jobs = jobs.filter(actual_device__isnull=True)
     jobs = jobs.filter(requested_device_type__pk=device.device_type.pk)
     jobs = jobs.order_by("-state", "-priority", "submit_time", "target_group", "id")
+    with TRACER.span("job queryset"):
+        jobs = list(jobs)
 
     for job in jobs:
-        if not device.can_submit(job.submitter):
-            continue
+        with TRACER.span("permissions and tags", job=job.id):
+            if not device.can_submit(job.submitter):
+                continue
 
-        device_tags = set(device.tags.all())
-        job_tags = set(job.tags.all())
-        if not job_tags.issubset(device_tags):
-            continue
+            device_tags = set(device.tags.all())
+            job_tags = set(job.tags.all())
+            if not job_tags.issubset(device_tags):
+                continue
 
-        job_dict = yaml.load(job.definition)
+        with TRACER.span("yaml parsing", job=job.id):
+            job_dict = yaml.load(job.definition)
         if 'protocols' in job_dict and 'lava-vland' in job_dict['protocols']:
-            if not match_vlan_interface(device, job_dict):
+            with TRACER.span("vlan matching", job=job.id):
+                matched = match_vlan_interface(device, job_dict)
+            if not matched:
                 continue
 
         logger.debug(" -> %s (%s, %s)", device.hostname,
                      device.get_state_display(),
                      device.get_health_display())
         logger.debug("  |--> [%d] scheduling", job.id)
-        if job.is_multinode:
-            # TODO: keep track of the multinode jobs
-            job.go_state_scheduling(device)
-        else:
-            job.go_state_scheduled(device)
-        job.save()
+        with TRACER.span("go_state_scheduled", job=job.id):
+            if job.is_multinode:
+                # TODO: keep track of the multinode jobs
+                job.go_state_scheduling(device)
+                SCHEDULED_JOBS.labels("multinode").inc()
+            else:
+                job.go_state_scheduled(device)
+                SCHEDULED_JOBS.labels("job").inc()
+            job.save()
         break
 
 
@@ -6,3 +6,11 @@ INTERNAL_EVENT_SOCKET = "ipc:///tmp/lava.events"
 EVENT_SOCKET = "tcp://*:5500"
 EVENT_ADDITIONAL_SOCKETS = []
 EVENT_TOPIC = "org.linaro.validation"
+# Replay of the last events, see lava-publisher. Disabled when empty.
+EVENT_REPLAY_SOCKET = ""
+EVENT_BUFFER_SIZE = 10000
+EVENT_BUFFER_FILE = ""
+
+# URL of the lava-live event stream, relative to the instance. When empty, the
+# job pages poll the server for status and log updates.
+EVENT_LIVE_URL = ""
@@ -1,7 +1,10 @@
 from __future__ import unicode_literals
 
 import datetime
+import functools
 from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
 from django.db.models.signals import post_init, post_save
 import simplejson
 import threading
@@ -15,6 +18,9 @@ from lava_scheduler_app.models import Device, TestJob, Worker
 # Thread local storage for zmq socket and context
 thread_local = threading.local()
 
+# Attribute holding the submitter when it was loaded along with the job
+SUBMITTER_CACHE = TestJob._meta.get_field("submitter").get_cache_name()
+
 
 def send_event(topic, user, data):
     # Get back the thread local storage
@@ -44,6 +50,100 @@ def send_event(topic, user, data):
         print("Unable to send the zmq event %s" % (settings.EVENT_TOPIC + topic))
 
 
+class EventBatch(object):
+    """
+    Events generated by the objects saved in a transaction. Each event is
+    sent, in order, by its own transaction.on_commit callback: the events of
+    a rolled back transaction or savepoint are dropped along with their
+    callbacks, and every state transition is sent.
+
+    The data that is not loaded when the objects are saved (submitter of the
+    jobs, current job of the devices) is fetched with one query for the
+    whole batch, when the first event is sent: the current job of a device
+    is the one committed, not the one of the intermediate states.
+    """
+
+    def __init__(self, on_commit=False):
+        self.on_commit = on_commit
+        # Events sent by send(), outside of a transaction
+        self.events = []
+        # Events waiting for the submitter name, with the submitter id
+        self.submitters = []
+        # Events of the busy devices waiting for the current job
+        self.devices = []
+
+    def add(self, topic, user, data):
+        event = [topic, user, data]
+        if self.on_commit:
+            transaction.on_commit(functools.partial(self.commit, event))
+        else:
+            self.events.append(event)
+        return event
+
+    def add_job(self, instance, data):
+        submitter = getattr(instance, SUBMITTER_CACHE, None)
+        if submitter is None:
+            self.submitters.append((self.add(".testjob", None, data), instance.submitter_id))
+        else:
+            data["submitter"] = submitter.username
+            self.add(".testjob", submitter.username, data)
+
+    def add_device(self, instance, data):
+        self.add(".device", "lavaserver", data)
+        if instance.state != Device.STATE_IDLE:
+            self.devices.append(data)
+
+    def resolve(self):
+        # Submitters
+        if self.submitters:
+            usernames = dict(User.objects.filter(id__in=set(user_id for (_, user_id) in self.submitters))
+                             .values_list("id", "username"))
+            for (event, user_id) in self.submitters:
+                event[1] = event[2]["submitter"] = usernames.get(user_id, "")
+            self.submitters = []
+
+        # Current jobs of the busy devices, as committed
+        if self.devices:
+            current = {}
+            jobs = TestJob.objects.filter(actual_device_id__in=list(set(data["device"] for data in self.devices))) \
+                                  .exclude(state=TestJob.STATE_FINISHED) \
+                                  .values_list("actual_device_id", "id", "sub_id")
+            for (hostname, job_id, sub_id) in jobs:
+                current[hostname] = sub_id if sub_id else job_id
+            for data in self.devices:
+                if data["device"] in current:
+                    data["job"] = current[data["device"]]
+            self.devices = []
+
+    def commit(self, event):
+        # The transaction is committed: the following events belong to a new
+        # batch
+        if getattr(thread_local, "batch", None) is self:
+            thread_local.batch = None
+        self.resolve()
+        send_event(*event)
+
+    def send(self):
+        self.resolve()
+        for (topic, user, data) in self.events:
+            send_event(topic, user, data)
+
+
+def current_batch():
+    """
+    Return the batch of events of the current transaction. Outside of a
+    transaction, the caller should send the batch itself.
+    """
+    if not transaction.get_connection().in_atomic_block:
+        return None
+    batch = getattr(thread_local, "batch", None)
+    # The batch of a rolled back transaction is never committed: its events
+    # are dropped but the batch is reused
+    if batch is None:
+        batch = thread_local.batch = EventBatch(on_commit=True)
+    return batch
+
+
 def device_init_handler(sender, **kwargs):
     # This function is called for every Device object created
     # Save the old states
@@ -69,14 +169,17 @@ def device_post_handler(sender, **kwargs):
             "health": instance.get_health_display(),
             "state": instance.get_state_display(),
             "device": instance.hostname,
-            "device_type": instance.device_type.name,
+            "device_type": instance.device_type_id,
         }
-        current_job = instance.current_job()
-        if current_job is not None:
-            data["job"] = current_job.display_id
 
-        # Send the event
-        send_event(".device", "lavaserver", data)
+        # Send the event when the transaction is committed
+        batch = current_batch()
+        if batch is None:
+            batch = EventBatch()
+            batch.add_device(instance, data)
+            batch.send()
+        else:
+            batch.add_device(instance, data)
 
 
 def testjob_init_handler(sender, **kwargs):
@@ -107,24 +210,29 @@ def testjob_post_handler(sender, **kwargs):
             "description": instance.description,
             "priority": instance.priority,
             "submit_time": instance.submit_time.isoformat(),
-            "submitter": str(instance.submitter),
             "visibility": instance.get_visibility_display(),
         }
         if instance.is_multinode:
             data['sub_id'] = instance.sub_id
         if instance.health_check:
             data['health_check'] = True
-        if instance.actual_device:
-            data["device"] = instance.actual_device.hostname
-        if instance.requested_device_type:
-            data['device_type'] = instance.requested_device_type.name
+        if instance.actual_device_id:
+            data["device"] = instance.actual_device_id
+        if instance.requested_device_type_id:
+            data['device_type'] = instance.requested_device_type_id
         if instance.start_time:
             data["start_time"] = instance.start_time.isoformat()
         if instance.end_time:
             data["end_time"] = instance.end_time.isoformat()
 
-        # Send the event
-        send_event(".testjob", str(instance.submitter), data)
+        # Send the event when the transaction is committed
+        batch = current_batch()
+        if batch is None:
+            batch = EventBatch()
+            batch.add_job(instance, data)
+            batch.send()
+        else:
+            batch.add_job(instance, data)
 
 
 def worker_init_handler(sender, **kwargs):
@@ -153,8 +261,12 @@ def worker_post_handler(sender, **kwargs):
             "state": instance.get_state_display(),
         }
 
-        # Send the event
-        send_event(".worker", "lavaserver", data)
+        # Send the event when the transaction is committed
+        batch = current_batch()
+        if batch is None:
+            send_event(".worker", "lavaserver", data)
+        else:
+            batch.add(".worker", "lavaserver", data)
 
 
 post_init.connect(device_init_handler, sender=Device, weak=False, dispatch_uid="device_init_handler")
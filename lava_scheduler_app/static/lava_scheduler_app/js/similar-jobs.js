@@ -52,7 +52,25 @@ $(document).ready(function () {
         });
     }
 
-    add_option_row();
+    // The field catalogue and the metadata of the job are only loaded
+    // when the dialog is opened for the first time.
+    var condition_choices = null;
+    $("#similar_jobs_modal").on("show.bs.modal", function() {
+        if (condition_choices !== null) {
+            return;
+        }
+        condition_choices = {};
+        var form = $("#similar_jobs_form");
+        $.when($.getJSON(form.data("choices-url")),
+               $.getJSON(form.data("fields-url"))).done(
+            function(choices, fields) {
+                condition_choices = $.extend({}, choices[0], fields[0]);
+                add_option_row();
+            }).fail(function() {
+                condition_choices = null;
+                $("#similar_jobs_errors").text("Unable to load the query fields.");
+            });
+    });
     $("#submit_similar_jobs").on("click", function() {
         $("#similar_jobs_form").submit();
     });
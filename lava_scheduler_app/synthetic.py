@@ -0,0 +1,363 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2018 Linaro Limited
+#
+# This file is part of LAVA.
+#
+# LAVA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License version 3
+# as published by the Free Software Foundation
+#
+# LAVA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Synthetic lab used to benchmark the server.
+
+Every object of the lab is named after a prefix so that a lab can be created
+next to real data and removed afterwards. The random generator is seeded:
+two labs created with the same parameters are identical, which makes the
+benchmark results comparable between releases.
+"""
+
+from __future__ import unicode_literals
+
+import datetime
+import os
+import random
+
+import yaml
+
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from lava_results_app.models import LavaResult, TestCase, TestSuite
+from lava_scheduler_app.models import (
+    Device,
+    DeviceType,
+    Tag,
+    TestJob,
+    Worker,
+)
+from lava_scheduler_app.retention import RetentionEngine, RetentionPolicy
+
+
+# Device type templates shipped with lava-server. The synthetic device types
+# extend them round-robin.
+TEMPLATES = ["qemu", "beaglebone-black", "juno", "x15", "hi6220-hikey",
+             "dragonboard-410c", "bcm2837-rpi-3-b", "cubietruck", "mustang"]
+
+TEST_SUITES = ["smoke", "kselftest", "ltp-syscalls", "boot-time", "network"]
+
+BATCH_SIZE = 5000
+
+
+class SyntheticLab(object):
+    """
+    Create or remove a synthetic lab.
+
+    test_cases is the total number of test cases, spread over the suites of
+    the finished jobs.
+    """
+
+    def __init__(self, prefix="synthetic", device_types=10, devices=100,
+                 workers=10, tags=20, queued_jobs=1000, finished_jobs=10000,
+                 test_cases=100000, seed=42, config_path=None, output=None):
+        self.prefix = prefix
+        self.counts = {"device_types": device_types, "devices": devices,
+                       "workers": workers, "tags": tags,
+                       "queued_jobs": queued_jobs,
+                       "finished_jobs": finished_jobs,
+                       "test_cases": test_cases}
+        self.rand = random.Random(seed)
+        self.config_path = config_path or Device.CONFIG_PATH
+        self.output = output if output is not None else (lambda msg: None)
+
+    def name(self, kind, index):
+        return "%s-%s-%d" % (self.prefix, kind, index)
+
+    # Queries on an existing lab
+    def device_types(self):
+        return DeviceType.objects.filter(name__startswith="%s-dt-" % self.prefix)
+
+    def devices(self):
+        return Device.objects.filter(hostname__startswith="%s-device-" % self.prefix)
+
+    def jobs(self):
+        return TestJob.objects.filter(requested_device_type__in=self.device_types())
+
+    def exists(self):
+        return self.device_types().exists()
+
+    def summary(self):
+        jobs = self.jobs()
+        return {
+            "prefix": self.prefix,
+            "device_types": self.device_types().count(),
+            "devices": self.devices().count(),
+            "workers": Worker.objects.filter(hostname__startswith="%s-worker-" % self.prefix).count(),
+            "queued_jobs": jobs.filter(state=TestJob.STATE_SUBMITTED).count(),
+            "finished_jobs": jobs.filter(state=TestJob.STATE_FINISHED).count(),
+            "test_cases": TestCase.objects.filter(suite__job__in=jobs).count(),
+        }
+
+    # Creation
+    def create(self):
+        with transaction.atomic():
+            users = self.create_users()
+            workers = self.create_workers()
+            tags = self.create_tags()
+            device_types = self.create_device_types()
+            devices = self.create_devices(device_types, workers, tags)
+            self.create_queued_jobs(users, device_types, tags)
+            jobs = self.create_finished_jobs(users, devices)
+            self.create_test_cases(jobs)
+        with connection.cursor() as cursor:
+            for table in ["lava_scheduler_app_testjob", "lava_results_app_testsuite",
+                          "lava_results_app_testcase"]:
+                cursor.execute("ANALYZE %s" % table)
+
+    def create_users(self):
+        return [User.objects.get_or_create(username=self.name("user", index))[0]
+                for index in range(10)]
+
+    def create_workers(self):
+        self.output("Creating %d workers" % self.counts["workers"])
+        workers = [Worker(hostname=self.name("worker", index), state=Worker.STATE_ONLINE,
+                          health=Worker.HEALTH_ACTIVE)
+                   for index in range(self.counts["workers"])]
+        Worker.objects.bulk_create(workers)
+        return workers
+
+    def create_tags(self):
+        tags = [Tag(name=self.name("tag", index)) for index in range(self.counts["tags"])]
+        Tag.objects.bulk_create(tags)
+        return list(Tag.objects.filter(name__startswith="%s-tag-" % self.prefix).order_by("name"))
+
+    def create_device_types(self):
+        self.output("Creating %d device types" % self.counts["device_types"])
+        device_types = [DeviceType(name=self.name("dt", index))
+                        for index in range(self.counts["device_types"])]
+        DeviceType.objects.bulk_create(device_types)
+        return device_types
+
+    def template(self, device_type):  # pylint: disable=no-self-use
+        index = int(device_type.name.rsplit("-", 1)[1])
+        return TEMPLATES[index % len(TEMPLATES)]
+
+    def device_dictionary(self, template, index):  # pylint: disable=no-self-use
+        lines = ["{%% extends '%s.jinja2' %%}" % template,
+                 "{%% set connection_command = 'telnet localhost %d' %%}" % (7000 + index)]
+        for command in ["hard_reset", "power_off", "power_on"]:
+            action = "reboot" if command == "hard_reset" else command[6:]
+            lines.append("{%% set %s_command = 'pduclient --daemon pdu-%02d --port %02d "
+                         "--command %s' %%}" % (command, index // 24, index % 24, action))
+        if template == "qemu":
+            lines.append("{%% set mac_addr = '52:54:00:12:%02x:%02x' %%}" % (index // 256, index % 256))
+            lines.append("{% set memory = 1024 %}")
+        return "\n".join(lines) + "\n"
+
+    def create_devices(self, device_types, workers, tags):
+        self.output("Creating %d devices" % self.counts["devices"])
+        devices = []
+        relations = []
+        for index in range(self.counts["devices"]):
+            device_type = device_types[index % len(device_types)]
+            device = Device(hostname=self.name("device", index), device_type=device_type,
+                            worker_host=workers[index % len(workers)],
+                            state=Device.STATE_IDLE, health=Device.HEALTH_GOOD,
+                            is_public=True)
+            devices.append(device)
+            for tag in self.rand.sample(tags, min(len(tags), self.rand.randint(0, 3))):
+                relations.append(Device.tags.through(device_id=device.hostname, tag_id=tag.id))
+            with open(os.path.join(self.config_path, "%s.jinja2" % device.hostname), "w") as f_out:
+                f_out.write(self.device_dictionary(self.template(device_type), index))
+        Device.objects.bulk_create(devices)
+        Device.tags.through.objects.bulk_create(relations)
+        return devices
+
+    def definition(self, device_type, name, priority):
+        template = self.template(device_type)
+        if template == "qemu":
+            deploy = {"to": "tmpfs", "images": {"rootfs": {
+                "url": "https://images.validation.linaro.org/kvm/standard/stretch-2.img.gz",
+                "image_arg": "-drive format=raw,file={rootfs}", "compression": "gz"}}}
+            boot = {"method": "qemu", "media": "tmpfs", "prompts": ["root@debian:"]}
+            context = {"arch": "amd64"}
+        else:
+            deploy = {"to": "tftp",
+                      "kernel": {"url": "https://example.com/zImage", "type": "zimage"},
+                      "ramdisk": {"url": "https://example.com/rootfs.cpio.gz", "compression": "gz"},
+                      "dtb": {"url": "https://example.com/board.dtb"}}
+            boot = {"method": "u-boot", "commands": "ramdisk", "prompts": ["/ #"]}
+            context = {}
+        suites = self.rand.sample(TEST_SUITES, 2)
+        data = {
+            "device_type": device_type.name,
+            "job_name": name,
+            "visibility": "public",
+            "priority": priority,
+            "timeouts": {"job": {"minutes": 30}, "action": {"minutes": 5}},
+            "metadata": {"build": str(self.rand.randint(1, 500)),
+                         "branch": self.rand.choice(["master", "stable", "next"])},
+            "actions": [
+                {"deploy": dict(deploy, timeout={"minutes": 5})},
+                {"boot": dict(boot, timeout={"minutes": 5})},
+                {"test": {"timeout": {"minutes": 10}, "definitions": [
+                    {"repository": "https://git.linaro.org/qa/test-definitions.git",
+                     "from": "git", "path": "automated/linux/%s/%s.yaml" % (suite, suite),
+                     "name": suite} for suite in suites]}}]}
+        if context:
+            data["context"] = context
+        return (yaml.dump(data), suites)
+
+    def new_job(self, users, device_type, **kwargs):
+        name = "%s %s" % (self.rand.choice(TEST_SUITES), self.rand.choice(["smoke", "full", "nightly"]))
+        (definition, suites) = self.definition(device_type, name, kwargs.get("priority", TestJob.MEDIUM))
+        job = TestJob(submitter=self.rand.choice(users), requested_device_type=device_type,
+                      description=name, definition=definition, original_definition=definition,
+                      is_public=True, **kwargs)
+        job.search_document = job.build_search_document()
+        return (job, suites)
+
+    def create_queued_jobs(self, users, device_types, tags):
+        self.output("Creating %d queued jobs" % self.counts["queued_jobs"])
+        jobs = []
+        for _ in range(self.counts["queued_jobs"]):
+            priority = self.rand.choice([TestJob.LOW, TestJob.MEDIUM, TestJob.MEDIUM, TestJob.HIGH])
+            jobs.append(self.new_job(users, self.rand.choice(device_types),
+                                     priority=priority)[0])
+        for start in range(0, len(jobs), BATCH_SIZE):
+            TestJob.objects.bulk_create(jobs[start:start + BATCH_SIZE])
+
+        # Tag one job out of ten
+        jobs = list(self.jobs().filter(state=TestJob.STATE_SUBMITTED).values_list("id", flat=True))
+        relations = [TestJob.tags.through(testjob_id=job_id, tag_id=self.rand.choice(tags).id)
+                     for job_id in jobs[::10]] if tags else []
+        TestJob.tags.through.objects.bulk_create(relations)
+
+    def create_finished_jobs(self, users, devices):
+        """
+        Return the list of (job id, suites) of the finished jobs
+        """
+        self.output("Creating %d finished jobs" % self.counts["finished_jobs"])
+        now = timezone.now()
+        created = []
+        batch = []
+        for index in range(self.counts["finished_jobs"]):
+            device = self.rand.choice(devices)
+            start_time = now - datetime.timedelta(minutes=10 * (self.counts["finished_jobs"] - index))
+            health = TestJob.HEALTH_COMPLETE if self.rand.random() < 0.9 else TestJob.HEALTH_INCOMPLETE
+            (job, suites) = self.new_job(users, device.device_type,
+                                         actual_device=device,
+                                         state=TestJob.STATE_FINISHED, health=health,
+                                         start_time=start_time,
+                                         end_time=start_time + datetime.timedelta(minutes=self.rand.randint(2, 30)))
+            batch.append((job, suites))
+            if len(batch) == BATCH_SIZE:
+                created.extend(self._save_jobs(batch))
+                batch = []
+        created.extend(self._save_jobs(batch))
+        # submit_time is set by bulk_create: move it before the start time
+        self.jobs().filter(state=TestJob.STATE_FINISHED).update(
+            submit_time=F("start_time") - datetime.timedelta(minutes=5))
+        return created
+
+    def _save_jobs(self, batch):  # pylint: disable=no-self-use
+        if not batch:
+            return []
+        # bulk_create sets the primary keys with PostgreSQL
+        jobs = TestJob.objects.bulk_create([job for (job, _) in batch])
+        return [(job.id, suites) for (job, (_, suites)) in zip(jobs, batch)]
+
+    def create_test_cases(self, jobs):
+        total = self.counts["test_cases"]
+        self.output("Creating %d test cases" % total)
+        if not jobs:
+            return
+        suites = [TestSuite(job_id=job_id, name=name)
+                  for (job_id, names) in jobs
+                  for name in ["lava"] + ["%d_%s" % (i, n) for (i, n) in enumerate(names)]]
+        for start in range(0, len(suites), BATCH_SIZE):
+            TestSuite.objects.bulk_create(suites[start:start + BATCH_SIZE])
+        suite_ids = list(TestSuite.objects.filter(job_id__in=[job_id for (job_id, _) in jobs])
+                         .order_by("id").values_list("id", "name"))
+
+        (per_suite, remaining) = divmod(total, len(suite_ids))
+        batch = []
+        for (position, (suite_id, name)) in enumerate(suite_ids):
+            for index in range(per_suite + (1 if position < remaining else 0)):
+                batch.append(self.new_test_case(suite_id, name, index))
+                if len(batch) == BATCH_SIZE:
+                    TestCase.objects.bulk_create(batch)
+                    batch = []
+        TestCase.objects.bulk_create(batch)
+        TestSuite.objects.filter(id__in=[suite_id for (suite_id, _) in suite_ids]).refresh_counters()
+        LavaResult.refresh([job_id for (job_id, _) in jobs])
+
+    def new_test_case(self, suite_id, suite_name, index):
+        result = TestCase.RESULT_PASS if self.rand.random() < 0.85 else \
+            self.rand.choice([TestCase.RESULT_FAIL, TestCase.RESULT_SKIP])
+        measurement = None
+        units = ""
+        if suite_name.endswith("boot-time") or index % 10 == 0:
+            measurement = round(self.rand.uniform(1, 100), 3)
+            units = "seconds"
+        metadata = {"case": "case-%d" % index, "definition": suite_name,
+                    "result": TestCase.RESULT_REVERSE[result]}
+        if suite_name == "lava":
+            metadata.update({"level": "1.%d" % index, "duration": "%.2f" % self.rand.uniform(0, 60)})
+        return TestCase(suite_id=suite_id, name="case-%d" % index, result=result,
+                        measurement=measurement, units=units,
+                        metadata_json=metadata)
+
+    # Removal
+    def delete(self):
+        device_types = list(self.device_types().values_list("name", flat=True))
+        if device_types:
+            engine = RetentionEngine([RetentionPolicy(device_type=device_types)],
+                                     batch_size=BATCH_SIZE, output=self.output)
+            engine.run()
+        for hostname in self.devices().values_list("hostname", flat=True):
+            try:
+                os.unlink(os.path.join(self.config_path, "%s.jinja2" % hostname))
+            except OSError:
+                pass
+        with transaction.atomic():
+            devices = self.devices()
+            Device.tags.through.objects.filter(device__in=devices).delete()
+            devices.delete()
+            self.device_types().delete()
+            Worker.objects.filter(hostname__startswith="%s-worker-" % self.prefix).delete()
+            Tag.objects.filter(name__startswith="%s-tag-" % self.prefix).delete()
+            User.objects.filter(username__startswith="%s-user-" % self.prefix).delete()
+
+
+def synthetic_description(job):
+    """
+    Build a pipeline description, as written by lava-master in
+    description.yaml, for a job of the synthetic lab.
+    """
+    definition = yaml.load(job.definition)
+    pipeline = []
+    for (level, action) in enumerate(definition["actions"], start=1):
+        (section, data) = list(action.items())[0]
+        children = [{"name": "%s-step-%d" % (section, index), "level": "%d.%d" % (level, index),
+                     "section": section, "summary": "%s step %d" % (section, index),
+                     "description": "synthetic %s step" % section, "max_retries": 1,
+                     "timeout": {"seconds": 60}} for index in range(1, 6)]
+        pipeline.append({"name": "%s-%s" % (section, data.get("to", data.get("method", "action"))),
+                         "level": str(level), "section": section,
+                         "summary": "%s action" % section, "description": "synthetic %s" % section,
+                         "max_retries": 1, "timeout": {"seconds": 300}, "pipeline": children})
+    return yaml.dump({"compatibility": 3,
+                      "device": {"device_type": definition["device_type"],
+                                 "hostname": job.actual_device_id},
+                      "job": {"actions": definition["actions"]},
+                      "pipeline": pipeline})
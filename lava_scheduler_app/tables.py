@@ -23,7 +23,7 @@ from lava_scheduler_app.models import (
 )
 from lava_results_app.models import TestCase
 from lava.utils.lavatable import LavaTable
-from django.db.models import Q
+from django.db.models import Count, Q
 from django.utils import timezone
 
 
@@ -48,11 +48,95 @@ class IDLinkColumn(tables.Column):
         return pklink(record)
 
 
+class VisibleJobs(object):
+    """
+    Visibility of the jobs listed in a table for the request user.
+    The jobs of the current page are checked in one query, with the rules of
+    TestJob.can_view(), the first time one of them is needed.
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self.user = table.context.get('request').user
+        self.checked = set()
+        self.visible = set()
+
+    def page_job_ids(self):
+        page = getattr(self.table, "page", None)
+        if page is None:
+            return set()
+        return set(job_id(row.record) for row in page.object_list) - set([None])
+
+    def __contains__(self, job_pk):
+        if job_pk not in self.checked:
+            job_ids = (self.page_job_ids() | set([job_pk])) - self.checked
+            self.visible.update(TestJob.can_view_ids(self.user, job_ids))
+            self.checked.update(job_ids)
+        return job_pk in self.visible
+
+
+def job_id(record):
+    """
+    Id of the job of a row: either a job or a result linked to a job
+    """
+    if isinstance(record, TestJob):
+        return record.pk
+    return getattr(record, "job_id", None)
+
+
+def visible_jobs(table):
+    """
+    Return the VisibleJobs of the table, created for the current request
+    """
+    visible = getattr(table, "_visible_jobs", None)
+    if visible is None:
+        visible = table._visible_jobs = VisibleJobs(table)
+    return visible
+
+
+class CurrentJobs(object):
+    """
+    Current jobs of the devices listed in a table. The jobs of the devices
+    of the current page are loaded in one query, the first time one of them
+    is needed.
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self.checked = set()
+        self.jobs = {}
+
+    def page_hostnames(self):
+        page = getattr(self.table, "page", None)
+        if page is None:
+            return set()
+        return set(row.record.hostname for row in page.object_list)
+
+    def get(self, device):
+        if device.hostname not in self.checked:
+            hostnames = (self.page_hostnames() | set([device.hostname])) - self.checked
+            jobs = TestJob.objects.filter(actual_device_id__in=list(hostnames)) \
+                                  .exclude(state=TestJob.STATE_FINISHED) \
+                                  .select_related("submitter")
+            self.jobs.update((job.actual_device_id, job) for job in jobs)
+            self.checked.update(hostnames)
+        return self.jobs.get(device.hostname)
+
+
+def current_jobs(table):
+    """
+    Return the CurrentJobs of the table, created for the current request
+    """
+    jobs = getattr(table, "_current_jobs", None)
+    if jobs is None:
+        jobs = table._current_jobs = CurrentJobs(table)
+    return jobs
+
+
 class RestrictedIDLinkColumn(IDLinkColumn):
 
     def render(self, record, table=None):
-        user = table.context.get('request').user
-        if record.can_view(user):
+        if record.pk in visible_jobs(table):
             return pklink(record)
         else:
             return record.pk
@@ -75,7 +159,7 @@ class ExpandedStatusColumn(tables.Column):
         kw['verbose_name'] = verbose_name
         super(ExpandedStatusColumn, self).__init__(**kw)
 
-    def render(self, record):
+    def render(self, record, table=None):
         """
         Expands the device status to include details of the job if the
         device is Reserved or Running. Logs error if reserved or running
@@ -83,13 +167,13 @@ class ExpandedStatusColumn(tables.Column):
         """
         logger = logging.getLogger('lava_scheduler_app')
         if record.state == Device.STATE_RUNNING:
-            current_job = record.current_job()
+            current_job = current_jobs(table).get(record)
             return mark_safe("Running job #%s - %s submitted by %s" % (
                 pklink(current_job),
                 current_job.description,
                 current_job.submitter))
         elif record.state == Device.STATE_RESERVED:
-            current_job = record.current_job()
+            current_job = current_jobs(table).get(record)
             return mark_safe("Reserved for job #%s (%s) \"%s\" submitted by %s" % (
                 pklink(current_job),
                 current_job.get_state_display(),
@@ -167,10 +251,10 @@ class JobErrorsTable(LavaTable):
                     escape(record.suite.job.actual_device.hostname)))
 
     def render_error_type(self, record):
-        return record.action_metadata["error_type"]
+        return record.lava_result.error_type
 
     def render_error_msg(self, record):
-        return record.action_metadata["error_msg"]
+        return record.lava_result.error_msg
 
     def render_job(self, record):
         return mark_safe('<a href="%s">%s</a>' % (record.suite.job.get_absolute_url(), record.suite.job.pk))
@@ -293,6 +377,8 @@ class JobTable(LavaTable):
             'sub_id': 'contains',
             'description': 'contains'
         }
+        # the search box matches the indexed search document of the job
+        search_document = 'search_document'
         # dedicated time-based search fields
         times = {
             'submit_time': 'hours',
@@ -529,6 +615,7 @@ class DeviceTypeTable(LavaTable):
     def __init__(self, *args, **kwargs):
         super(DeviceTypeTable, self).__init__(*args, **kwargs)
         self.length = 50
+        self.queues = None
 
     def render_idle(self, record):  # pylint: disable=no-self-use
         return record['idle'] if record['idle'] > 0 else ""
@@ -543,12 +630,16 @@ class DeviceTypeTable(LavaTable):
         return record['restricted'] if record['restricted'] > 0 else ""
 
     def render_name(self, record):  # pylint: disable=no-self-use
-        return pklink(DeviceType.objects.get(name=record['device_type']))
-
-    def render_queue(self, record):  # pylint: disable=no-self-use
-        count = TestJob.objects.filter(
-            Q(state=TestJob.STATE_SUBMITTED),
-            Q(requested_device_type=record['device_type'])).count()
+        # The link only needs the name
+        return pklink(DeviceType(name=record['device_type']))
+
+    def render_queue(self, record):
+        # The queues of every device type are counted in one query
+        if self.queues is None:
+            self.queues = dict(TestJob.objects.filter(state=TestJob.STATE_SUBMITTED)
+                               .values_list('requested_device_type')
+                               .annotate(count=Count('id')).order_by())
+        count = self.queues.get(record['device_type'], 0)
         return count if count > 0 else ""
 
     name = tables.Column(accessor='idle', verbose_name='Name')
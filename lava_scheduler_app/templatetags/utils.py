@@ -8,6 +8,7 @@ from collections import OrderedDict
 from django.utils.safestring import mark_safe
 from lava_scheduler_app.models import TestJob
 from lava_scheduler_app.dbutils import load_devicetype_template
+from lava_scheduler_app.tables import visible_jobs
 
 
 register = template.Library()
@@ -226,8 +227,13 @@ def markup_metadata(key, value):
 
 
 @register.assignment_tag
-def can_view(record, user):
+def can_view(record, user, table=None):
+    """
+    In a table, the jobs of the current page are checked in one query
+    """
     try:
+        if table and isinstance(record, TestJob):
+            return record.pk in visible_jobs(table)
         return record.can_view(user)
     except:
         return False
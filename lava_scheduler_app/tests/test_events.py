@@ -0,0 +1,65 @@
+import os
+import shutil
+import tempfile
+import simplejson
+import unittest
+
+from lava_scheduler_app.events import EventBuffer, MappedEventBuffer, with_sequence
+
+
+def event(index):
+    return [b"org.linaro.validation.testjob", b"uuid", b"2018-01-01T00:00:00",
+            b"lavaserver", ('{"job": %d}' % index).encode("utf-8")]
+
+
+class TestEventBuffer(unittest.TestCase):
+
+    def setUp(self):
+        super(TestEventBuffer, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        super(TestEventBuffer, self).tearDown()
+        shutil.rmtree(self.tmpdir)
+
+    def check_buffer(self, buf):
+        self.assertEqual(buf.since(0, 10), [])
+        for index in range(1, 8):
+            self.assertEqual(buf.append(event(index)), index)
+        # Only the last 5 events are kept
+        self.assertEqual(buf.oldest, 3)
+        self.assertEqual([seq for (seq, _) in buf.since(0, 10)], [3, 4, 5, 6, 7])
+        self.assertEqual(buf.since(4, 2), [(5, event(5)), (6, event(6))])
+        self.assertEqual(buf.since(7, 10), [])
+
+    def test_memory(self):
+        self.check_buffer(EventBuffer(5))
+
+    def test_mapped(self):
+        filename = os.path.join(self.tmpdir, "events")
+        buf = MappedEventBuffer(filename, 5, slot_size=256)
+        self.check_buffer(buf)
+        # Events bigger than a slot are skipped
+        self.assertEqual(buf.append([b"x" * 512]), 8)
+        self.assertEqual([seq for (seq, _) in buf.since(6, 10)], [7])
+        buf.close()
+
+        # The events and the sequence are kept across restarts
+        buf = MappedEventBuffer(filename, 5, slot_size=256)
+        self.assertEqual(buf.sequence, 8)
+        self.assertEqual(buf.since(5, 1), [(6, event(6))])
+        buf.close()
+
+        # A new geometry resets the buffer
+        buf = MappedEventBuffer(filename, 10, slot_size=256)
+        self.assertEqual(buf.sequence, 0)
+        buf.close()
+
+    def test_with_sequence(self):
+        frames = with_sequence(event(1), 42)
+        self.assertEqual(len(frames), 5)
+        self.assertEqual(frames[:4], event(1)[:4])
+        self.assertEqual(simplejson.loads(frames[4].decode("utf-8")), {"job": 1, "sequence": 42})
+        # Events without json data are kept as is
+        self.assertEqual(with_sequence(event(1)[:4] + [b"not json"], 42), event(1)[:4] + [b"not json"])
+        self.assertEqual(with_sequence([b"topic"], 42), [b"topic"])
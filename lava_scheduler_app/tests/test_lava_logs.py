@@ -0,0 +1,59 @@
+from importlib import import_module
+import unittest
+import zmq
+
+
+class TestShards(unittest.TestCase):
+
+    def setUp(self):
+        super(TestShards, self).setUp()
+        self.context = zmq.Context()
+        self.sockets = []
+
+    def tearDown(self):
+        super(TestShards, self).tearDown()
+        for sock in self.sockets:
+            sock.close(linger=0)
+        self.context.term()
+
+    def socket(self, socket_type, endpoint, bind=False):
+        sock = self.context.socket(socket_type)
+        if bind:
+            sock.bind(endpoint)
+        else:
+            sock.connect(endpoint)
+        self.sockets.append(sock)
+        return sock
+
+    def receive(self, sock):
+        msgs = []
+        while sock.poll(100):
+            msgs.append(sock.recv_multipart())
+        return msgs
+
+    def test_forward(self):
+        command = import_module("lava_server.management.commands.lava-logs").Command()
+        command.log_socket = self.socket(zmq.PULL, "inproc://logs", bind=True)
+        dispatcher = self.socket(zmq.PUSH, "inproc://logs")
+        shards = [self.socket(zmq.PULL, "inproc://shard-%d" % index, bind=True)
+                  for index in range(3)]
+        outputs = [self.socket(zmq.PUSH, "inproc://shard-%d" % index)
+                   for index in range(3)]
+
+        job_ids = list(range(1, 21))
+        for job_id in job_ids:
+            dispatcher.send_multipart([str(job_id).encode("utf-8"), b"info", b"2018", b'"line"'])
+        dispatcher.send_multipart([b"invalid", b"info", b"2018", b'"line"'])
+        dispatcher.send_multipart([b"STOP"])
+        while command.log_socket.poll(100):
+            command.forward(outputs)
+
+        # Each job is sent to exactly one shard, always the same
+        received = []
+        for (index, shard) in enumerate(shards):
+            msgs = self.receive(shard)
+            ids = [int(msg[0]) for msg in msgs]
+            self.assertEqual(ids, [job_id for job_id in job_ids if job_id % 3 == index])
+            self.assertEqual(msgs[0][1:], [b"info", b"2018", b'"line"'])
+            received.extend(ids)
+        self.assertEqual(sorted(received), job_ids)
@@ -0,0 +1,150 @@
+from importlib import import_module
+import logging
+import os
+import shutil
+import simplejson
+import sys
+import tempfile
+import unittest
+
+
+class Writer(object):
+
+    def __init__(self):
+        self.data = b""
+
+    def write(self, data):
+        self.data += data
+
+    def events(self):
+        events = []
+        for chunk in self.data.decode("utf-8").split("\n\n"):
+            fields = dict(line.split(": ", 1) for line in chunk.splitlines())
+            if "event" in fields:
+                events.append((fields["event"], fields.get("id"), simplejson.loads(fields["data"])))
+        return events
+
+
+@unittest.skipIf(sys.version_info < (3, 5), "lava-live requires python >= 3.5")
+class TestLiveStream(unittest.TestCase):
+
+    def setUp(self):
+        super(TestLiveStream, self).setUp()
+        self.live = import_module("lava_server.management.commands.lava-live")
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, "output.yaml")
+
+    def tearDown(self):
+        super(TestLiveStream, self).tearDown()
+        shutil.rmtree(self.tmpdir)
+
+    def write_lines(self, *msgs):
+        with open(self.filename, "a") as f_out:
+            for msg in msgs:
+                f_out.write('- {"dt": "2018-01-01T00:00:00", "lvl": "info", "msg": "%s"}\n' % msg)
+
+    def test_read_lines(self):
+        command = self.live.Command()
+        self.assertEqual(command.read_lines(1, self.filename, 0, None, None), ([], None, None))
+
+        self.write_lines("a", "b")
+        with open(self.filename, "a") as f_out:
+            f_out.write('- {"dt": "2018-01-01T00:00:00", "lvl": "info", ')
+        (lines, start, end) = command.read_lines(1, self.filename, 0, None, None)
+        self.assertEqual([line["msg"] for line in lines], ["a", "b"])
+        self.assertEqual(start, 0)
+
+        # Start at the second line, with or without the offset
+        (lines, start, second) = command.read_lines(1, self.filename, 1, None, None)
+        self.assertEqual([line["msg"] for line in lines], ["b"])
+        self.assertEqual(second, end)
+        self.assertEqual(command.read_lines(1, self.filename, 1, start, None)[0], lines)
+        (lines, start, _) = command.read_lines(1, self.filename, 0, None, start)
+        self.assertEqual([line["msg"] for line in lines], ["a"])
+
+    def test_client_catch_up(self):
+        command = self.live.Command()
+        self.write_lines("a", "b", "c")
+        first = command.read_lines(1, self.filename, 0, None, None)
+        self.write_lines("d")
+        second = command.read_lines(1, self.filename, 3, first[2], None)
+
+        # The client connects while the stream is reading the first lines:
+        # the lines are read back from the file and broadcast.
+        writer = Writer()
+        client = self.live.Client(writer, 0, 10)
+        (lines, start, end) = command.read_lines(1, self.filename, 0, None, first[2])
+        client.write(("log", 0, start, end, lines))
+        client.write(("log", 0, first[1], first[2], first[0]))
+        client.write(("log", 3, second[1], second[2], second[0]))
+        self.assertEqual([(name, event_id, [line["msg"] for line in data])
+                          for (name, event_id, data) in writer.events()],
+                         [("log", "3", ["a", "b", "c"]), ("log", "4", ["d"])])
+
+    def test_client_reconnect(self):
+        command = self.live.Command()
+        self.write_lines("a", "b", "c")
+        (lines, start, end) = command.read_lines(1, self.filename, 0, None, None)
+
+        # The browser already received the first two lines
+        writer = Writer()
+        client = self.live.Client(writer, 2, 10)
+        client.write(("log", 0, start, end, lines))
+        client.write(("log", 0, start, end, lines))
+        self.assertEqual([(event_id, [line["msg"] for line in data])
+                          for (_, event_id, data) in writer.events()],
+                         [("3", ["c"])])
+
+    def test_invalid_lines(self):
+        command = self.live.Command()
+        self.write_lines("a")
+        with open(self.filename, "a") as f_out:
+            f_out.write("- hello\n")
+            f_out.write("just a string\n")
+            f_out.write('- {"dt": "2018-01-01T00:00:00", "lvl": "results", "msg": "boot"}\n')
+            f_out.write('- {"dt": "2018-01-01T00:00:00", "lvl": "info"}\n')
+        self.write_lines("b")
+        (lines, _, _) = command.read_lines(1, self.filename, 0, None, None)
+        # Every line is still one item
+        self.assertEqual([line["lvl"] for line in lines],
+                         ["info", "debug", "debug", "results", "debug", "info"])
+        self.assertEqual(lines[-1]["msg"], "b")
+
+    def test_client_late_catch_up(self):
+        command = self.live.Command()
+        self.write_lines("a", "b", "c", "d")
+
+        # The stream was created from line 2 and has not read the file yet:
+        # the first lines are read up to the end of the file.
+        writer = Writer()
+        client = self.live.Client(writer, 0, 10)
+        (lines, start, end) = command.read_lines(1, self.filename, 0, None, None)
+        client.write(("log", 0, start, end, lines))
+        self.write_lines("e")
+        (lines, start, end) = command.read_lines(1, self.filename, 2, None, None)
+        client.write(("log", 2, start, end, lines))
+        self.assertEqual([(event_id, [line["msg"] for line in data])
+                          for (_, event_id, data) in writer.events()],
+                         [("4", ["a", "b", "c", "d"]), ("5", ["e"])])
+
+    def test_tail_failure(self):
+        import asyncio
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        command = self.live.Command()
+        command.logger = logging.getLogger("lava-live")
+        command.loop = loop
+        command.options = {"poll_interval": 0.01}
+        command.read_lines = lambda *args: {}["lvl"]
+
+        writer = Writer()
+        client = self.live.Client(writer, 0, 10)
+        stream = self.live.JobStream(1, self.filename, set([1]))
+        stream.clients.add(client)
+        command.streams[1] = stream
+        command.related[1] = set([1])
+        loop.run_until_complete(command.tail(stream))
+        # The stream is closed and the browser is told to poll
+        self.assertEqual(command.streams, {})
+        self.assertEqual(command.related, {})
+        self.assertEqual(client.queue.get_nowait(), ("failed",))
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+import unittest
+import yaml
+
+from lava_scheduler_app.logutils import LogMessageError, parse_log_message
+
+
+class TestLogMessages(unittest.TestCase):
+
+    def test_yaml(self):
+        (job_id, lvl, results, line) = parse_log_message(
+            [b"12", b'{"dt": "2018-01-01T00:00:00.000", "lvl": "info", "msg": "hello"}'])
+        self.assertEqual((job_id, lvl, results), ("12", "info", None))
+        self.assertEqual(yaml.safe_load(line), [{"dt": "2018-01-01T00:00:00.000", "lvl": "info", "msg": "hello"}])
+
+        (_, lvl, results, _) = parse_log_message(
+            [b"12", b'{"dt": "2018-01-01T00:00:00.000", "lvl": "results", "msg": {"case": "boot", "result": "pass"}}'])
+        self.assertEqual(results, {"case": "boot", "result": "pass"})
+
+        self.assertRaises(LogMessageError, parse_log_message, [b"12", b"{"])
+        self.assertRaises(LogMessageError, parse_log_message, [b"12", b"hello"])
+        self.assertRaises(LogMessageError, parse_log_message, [b"12", b'{"lvl": "info"}'])
+
+    def test_frames(self):
+        (job_id, lvl, results, line) = parse_log_message(
+            [b"12", b"target", b"2018-01-01T00:00:00.000", b'"login: \\u00e9"'])
+        self.assertEqual((job_id, lvl, results), ("12", "target", None))
+        self.assertEqual(yaml.safe_load(line), [{"dt": "2018-01-01T00:00:00.000", "lvl": "target",
+                                                 "msg": "login: é"}])
+
+        (_, lvl, results, line) = parse_log_message(
+            [b"12", b"results", b"2018-01-01T00:00:00.000", b'{"case": "boot", "result": "pass"}'])
+        self.assertEqual(results, {"case": "boot", "result": "pass"})
+        self.assertEqual(yaml.safe_load(line)[0]["msg"], results)
+
+        self.assertRaises(LogMessageError, parse_log_message, [b"12", b"in fo", b"2018", b'"a"'])
+        self.assertRaises(LogMessageError, parse_log_message, [b"12", b"info", b"2018", b'"a"\n- {}'])
+        self.assertRaises(LogMessageError, parse_log_message, [b"12", b"results", b"2018", b'"a"'])
+        # The message is encoded again as valid YAML, on one line
+        (_, _, _, line) = parse_log_message(
+            [b"12", b"target", b"2018-01-01T00:00:00.000", b'"\\ud83d\\ude00 \\/ \\u007f"'])
+        self.assertEqual(yaml.load(line, Loader=yaml.CLoader)[0]["msg"], "\U0001f600 / \x7f")
+        (_, _, results, line) = parse_log_message(
+            [b"12", b"results", b"2018-01-01T00:00:00.000", b'{"case": "boot",\n "result": "pass"}'])
+        self.assertEqual(len(line.splitlines()), 1)
+        self.assertEqual(yaml.load(line, Loader=yaml.CLoader)[0]["msg"], results)
+        self.assertRaises(LogMessageError, parse_log_message, [b"12", b"info", b"2018", b'"\\ud83d"'])
+
+        # Invalid messages are dropped
+        self.assertRaises(LogMessageError, parse_log_message, [b"12", b"info", b"2018", b"hello"])
+        self.assertRaises(LogMessageError, parse_log_message, [b"12", b"info", b"2018", b'"a", "lvl": "results"'])
+        self.assertRaises(LogMessageError, parse_log_message, [b"12", b"info", b"2018", b'"a"}, {"b": "c"'])
+        self.assertRaises(LogMessageError, parse_log_message, [b"12", b"info", b"2018"])
@@ -0,0 +1,64 @@
+from importlib import import_module
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class TestConfigCache(unittest.TestCase):
+
+    def setUp(self):
+        super(TestConfigCache, self).setUp()
+        self.master = import_module("lava_server.management.commands.lava-master")
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, "env.yaml")
+        self.cache = self.master.ConfigCache()
+
+    def tearDown(self):
+        super(TestConfigCache, self).tearDown()
+        for fd in self.cache.directories.values():
+            if fd is not None:
+                os.close(fd)
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, data):
+        with open(self.filename, "w") as f_out:
+            f_out.write(data)
+
+    def test_cached(self):
+        self.write("overrides: {}\n")
+        fd = self.cache.watch(self.tmpdir)
+        self.assertIsNotNone(fd)
+        self.assertEqual(self.cache.watch(self.tmpdir + "/"), fd)
+
+        self.assertEqual(self.cache.load(self.filename), "overrides: {}\n")
+        # Changes are only seen once the directory events are processed
+        self.write("overrides: {http_proxy: proxy}\n")
+        self.assertEqual(self.cache.load(self.filename), "overrides: {}\n")
+        self.cache.invalidate(fd)
+        self.assertEqual(self.cache.load(self.filename), "overrides: {http_proxy: proxy}\n")
+
+    def test_missing(self):
+        fd = self.cache.watch(self.tmpdir)
+        self.assertEqual(self.cache.load(self.filename), "")
+        self.write("overrides: {}\n")
+        self.cache.invalidate(fd)
+        self.assertEqual(self.cache.load(self.filename), "overrides: {}\n")
+
+        # Invalid files are not cached
+        self.write("{")
+        self.cache.invalidate(fd)
+        self.assertRaises(IOError, self.cache.load, self.filename)
+        self.write("overrides: {}\n")
+        self.assertEqual(self.cache.load(self.filename), "overrides: {}\n")
+
+    def test_not_watched(self):
+        self.write("overrides: {}\n")
+        self.assertEqual(self.cache.load(self.filename), "overrides: {}\n")
+        self.write("overrides: {http_proxy: proxy}\n")
+        self.assertEqual(self.cache.load(self.filename), "overrides: {http_proxy: proxy}\n")
+
+        # Directories that cannot be watched are read each time
+        missing = os.path.join(self.tmpdir, "missing")
+        self.assertIsNone(self.cache.watch(missing))
+        self.assertEqual(self.cache.load(os.path.join(missing, "env.yaml")), "")
@@ -0,0 +1,40 @@
+import unittest
+
+from lava_server.metrics import Counter, Gauge, Histogram, Registry
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_render(self):
+        registry = Registry()
+        jobs = registry.register(Counter("jobs_total", "Jobs", ["kind"]))
+        files = registry.register(Gauge("open_files", "Open files"))
+        duration = registry.register(Histogram("pass_seconds", "Pass", buckets=(0.1, 1)))
+        self.assertIs(registry.register(Counter("jobs_total", "Jobs", ["kind"])), jobs)
+        self.assertRaises(ValueError, registry.register, Gauge("jobs_total", "Jobs"))
+
+        jobs.labels("health-check").inc()
+        jobs.labels("job").inc(2)
+        self.assertIs(jobs.labels("job"), jobs.labels("job"))
+        self.assertRaises(ValueError, jobs.labels)
+        files.set_function(lambda: 4)
+        duration.observe(0.05)
+        duration.observe(0.5)
+        duration.observe(5)
+
+        self.assertEqual(registry.render().split("\n"), [
+            "# HELP jobs_total Jobs",
+            "# TYPE jobs_total counter",
+            'jobs_total{kind="health-check"} 1',
+            'jobs_total{kind="job"} 2',
+            "# HELP open_files Open files",
+            "# TYPE open_files gauge",
+            "open_files 4",
+            "# HELP pass_seconds Pass",
+            "# TYPE pass_seconds histogram",
+            'pass_seconds_bucket{le="0.1"} 1',
+            'pass_seconds_bucket{le="1.0"} 2',
+            'pass_seconds_bucket{le="+Inf"} 3',
+            "pass_seconds_sum 5.55",
+            "pass_seconds_count 3",
+            ""])
@@ -0,0 +1,140 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
+from django.test import Client, TestCase, override_settings
+
+from lava_scheduler_app.models import Device, TestJob
+from lava_scheduler_app.tests.test_submission import TestCaseWithFactory
+from lava_server import querystats
+from linaro_django_xmlrpc.models import Dispatcher, ExposedAPI, Mapper
+
+if sys.version_info[0] == 2:
+    import xmlrpclib
+else:
+    import xmlrpc.client as xmlrpclib
+
+# More rows than the budgets: a query by row would go over the budget
+ROWS = 40
+
+
+class UsersAPI(ExposedAPI):
+
+    def count(self):
+        return sum(User.objects.filter(pk=user.pk).count() for user in User.objects.all())
+
+
+class TestQueryShape(unittest.TestCase):
+
+    def test_query_shape(self):
+        self.assertEqual(
+            querystats.query_shape('SELECT "a"."id" FROM "lava_scheduler_app_device" "a" '
+                                   'WHERE ("a"."hostname" = \'qemu-01\' AND "a"."health" IN (1, 2, 3))\n'
+                                   'LIMIT 21'),
+            'SELECT "a"."id" FROM "lava_scheduler_app_device" "a" '
+            'WHERE ("a"."hostname" = ? AND "a"."health" IN (?, ...)) LIMIT ?')
+
+    def test_repeated_shapes(self):
+        stats = querystats.EndpointStats()
+        stats.add([{"sql": "SELECT 1 FROM t WHERE id = %d" % i, "time": "0.001"} for i in range(5)] +
+                  [{"sql": "SELECT 2", "time": "0.002"}])
+        data = stats.as_dict()
+        self.assertEqual(data["calls"], 1)
+        self.assertEqual(data["queries"], 6)
+        self.assertEqual(data["sql_time"], 0.007)
+        self.assertEqual(data["repeated"], [("SELECT ? FROM t WHERE id = ?", 4)])
+
+
+@override_settings(QUERY_STATS=True, QUERY_STATS_DIRECTORY=None)
+class TestQueryStats(TestCase):
+
+    def setUp(self):
+        super(TestQueryStats, self).setUp()
+        querystats.STATS.reset()
+        for index in range(3):
+            User.objects.create(username="user-%d" % index)
+
+    def test_views(self):
+        with override_settings(QUERY_BUDGETS={"lava.home": 100}, QUERY_BUDGETS_STRICT=True):
+            self.assertEqual(Client().get("/").status_code, 200)
+            stats = querystats.STATS.as_dict()
+            self.assertEqual(stats["lava.home"]["calls"], 1)
+
+        with override_settings(QUERY_BUDGETS={"lava.home": 0}, QUERY_BUDGETS_STRICT=True):
+            self.assertRaises(querystats.QueryBudgetExceeded, Client().get, "/")
+
+    def test_xmlrpc(self):
+        mapper = Mapper()
+        mapper.register(UsersAPI, "users")
+        dispatcher = Dispatcher(mapper)
+        context = None
+        with override_settings(QUERY_BUDGETS={"users.count": 4}, QUERY_BUDGETS_STRICT=True):
+            self.assertEqual(Client().get("/").status_code, 200)
+            self.assertIn(querystats.xmlrpc_hook, Dispatcher.hooks)
+            with self.assertNumQueries(4):
+                self.assertEqual(dispatcher.dispatch("users.count", (), context), 3)
+            stats = querystats.STATS.as_dict()["users.count"]
+            self.assertEqual(stats["queries"], 4)
+            self.assertEqual(stats["repeated"][0][1], 2)
+
+            User.objects.create(username="user-3")
+            querystats.STATS.reset()
+            self.assertRaises(querystats.QueryBudgetExceeded, querystats.xmlrpc_hook,
+                              lambda: dispatcher.mapper.lookup("users.count", context)(),
+                              "users.count", context)
+
+    def test_dump(self):
+        directory = tempfile.mkdtemp()
+        try:
+            self.assertEqual(Client().get("/").status_code, 200)
+            querystats.dump(directory)
+            self.assertTrue(os.path.exists(os.path.join(directory, "lava-server-%d.prom" % os.getpid())))
+            stats = querystats.load(directory)
+            self.assertEqual(stats["lava.home"].calls, 1)
+        finally:
+            shutil.rmtree(directory)
+
+
+@override_settings(QUERY_STATS=True, QUERY_STATS_DIRECTORY=None, QUERY_BUDGETS_STRICT=True)
+class TestQueryBudgets(TestCaseWithFactory):  # pylint: disable=too-many-ancestors
+
+    def setUp(self):
+        super(TestQueryBudgets, self).setUp()
+        querystats.STATS.reset()
+        self.user = self.factory.ensure_user("budget", "budget@example.com", "budget")
+        for index in range(ROWS):
+            device_type = self.factory.make_device_type("type-%d" % index)
+            device = self.factory.make_device(device_type, "device-%d" % index,
+                                              state=Device.STATE_RUNNING)
+            TestJob.objects.create(requested_device_type=device_type, actual_device=device,
+                                   submitter=self.user, state=TestJob.STATE_RUNNING,
+                                   definition="{}", description="running %d" % index)
+            TestJob.objects.create(requested_device_type=device_type, submitter=self.user,
+                                   definition="{}", description="queued %d" % index)
+        self.client = Client()
+        self.client.login(username="budget", password="budget")
+
+    def test_views(self):
+        for name in ["lava.scheduler", "lava.scheduler.queue",
+                     "lava.scheduler.alldevices", "lava.scheduler.job.list"]:
+            self.assertIn(name, settings.QUERY_BUDGETS)
+            self.assertLess(settings.QUERY_BUDGETS[name], ROWS)
+            self.assertEqual(self.client.get(reverse(name)).status_code, 200)
+            self.assertEqual(querystats.STATS.as_dict()[name]["calls"], 1)
+
+    def test_devices_list(self):
+        self.assertLess(settings.QUERY_BUDGETS["scheduler.devices.list"], ROWS)
+        response = self.client.post(reverse("lava.api_handler"),
+                                    xmlrpclib.dumps((), methodname="scheduler.devices.list"),
+                                    content_type="text/xml")
+        ((devices,), _) = xmlrpclib.loads(response.content)
+        self.assertEqual(len(devices), ROWS)
+        running = [device for device in devices if device["hostname"] == "device-0"][0]
+        self.assertEqual(running["current_job"],
+                         TestJob.objects.get(actual_device__hostname="device-0").id)
+        self.assertEqual(querystats.STATS.as_dict()["scheduler.devices.list"]["calls"], 1)
@@ -0,0 +1,115 @@
+# pylint: disable=invalid-name
+import datetime
+import json
+import os
+import shutil
+import tempfile
+
+from django.contrib.auth.models import User
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from lava_results_app.models import LavaResult, MeasurementPoint, TestCase, TestSuite
+from lava_scheduler_app.models import TestJob
+from lava_scheduler_app.retention import (
+    RetentionEngine,
+    RetentionError,
+    RetentionPolicy,
+    parse_age,
+)
+from lava_scheduler_app.tests.test_pipeline import YamlFactory
+from lava_scheduler_app.tests.test_submission import TestCaseWithFactory
+
+
+class TestRetention(TestCaseWithFactory):  # pylint: disable=too-many-ancestors
+
+    def setUp(self):
+        super(TestRetention, self).setUp()
+        self.factory = YamlFactory()
+        self.factory.make_device(self.factory.make_device_type(), 'fakeqemu1')
+        self.user = User.objects.create_user('test', 'test@example.com', 'test')
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        super(TestRetention, self).tearDown()
+        shutil.rmtree(self.tmpdir)
+
+    def make_finished_job(self, days):
+        job = TestJob.from_yaml_and_user(self.factory.make_job_yaml(), self.user)
+        job.state = TestJob.STATE_FINISHED
+        job.health = TestJob.HEALTH_COMPLETE
+        job.end_time = timezone.now() - datetime.timedelta(days=days)
+        job.save()
+        suite = TestSuite.objects.create(name='lava', job=job)
+        TestCase.objects.create(name='job', suite=suite, result=TestCase.RESULT_PASS)
+        os.makedirs(job.output_dir)
+        with open(os.path.join(job.output_dir, 'output.yaml'), 'w') as f_out:
+            f_out.write("- {}\n")
+        return job
+
+    def test_parse_age(self):
+        self.assertEqual(parse_age("2d"), datetime.timedelta(days=2))
+        self.assertEqual(parse_age("12h"), datetime.timedelta(hours=12))
+        self.assertRaises(RetentionError, parse_age, "2w")
+        self.assertRaises(RetentionError, RetentionPolicy)
+        self.assertRaises(RetentionError, RetentionPolicy, state="DONE")
+
+    def test_purge(self):
+        with override_settings(MEDIA_ROOT=self.tmpdir):
+            old = [self.make_finished_job(days=10) for _ in range(3)]
+            recent = self.make_finished_job(days=1)
+            policy = RetentionPolicy(older_than="5d", state="FINISHED")
+
+            engine = RetentionEngine([policy], batch_size=2, dry_run=True)
+            self.assertEqual(engine.run(), 3)
+            self.assertEqual(TestJob.objects.count(), 4)
+
+            checkpoint = os.path.join(self.tmpdir, 'checkpoint')
+            engine = RetentionEngine([policy], batch_size=2, checkpoint=checkpoint)
+            self.assertEqual(engine.run(), 3)
+            self.assertEqual(list(TestJob.objects.values_list('id', flat=True)), [recent.id])
+            self.assertEqual(TestSuite.objects.count(), 1)
+            self.assertEqual(TestCase.objects.count(), 1)
+            for job in old:
+                self.assertFalse(os.path.exists(job.output_dir))
+            self.assertTrue(os.path.exists(recent.output_dir))
+            self.assertFalse(os.path.exists(checkpoint))
+
+    def test_purge_indexed_results(self):
+        with override_settings(MEDIA_ROOT=self.tmpdir):
+            job = self.make_finished_job(days=10)
+            suite = job.testsuite_set.get()
+            TestCase.objects.create(name='validate', suite=suite, result=TestCase.RESULT_FAIL,
+                                    metadata_json={"level": "1.1", "error_type": "Job",
+                                                   "error_msg": "invalid job"})
+            TestCase.objects.create(name='boot-time', suite=suite, result=TestCase.RESULT_PASS,
+                                    measurement=12.5, units='seconds')
+            LavaResult.refresh([job.id])
+            MeasurementPoint.append([job.id])
+            self.assertEqual(LavaResult.objects.filter(job=job).count(), 1)
+            self.assertEqual(MeasurementPoint.objects.filter(job=job).count(), 1)
+
+            engine = RetentionEngine([RetentionPolicy(older_than="5d")])
+            self.assertEqual(engine.run(), 1)
+            self.assertEqual(TestJob.objects.count(), 0)
+            self.assertEqual(LavaResult.objects.count(), 0)
+            self.assertEqual(MeasurementPoint.objects.count(), 0)
+
+    def test_resume(self):
+        with override_settings(MEDIA_ROOT=self.tmpdir):
+            first = self.make_finished_job(days=10)
+            second = self.make_finished_job(days=10)
+            # Simulate a run killed after the first job rows were removed
+            first_id, directory = first.id, first.output_dir
+            TestCase.objects.filter(suite__job=first).delete()
+            TestSuite.objects.filter(job=first).delete()
+            first.delete()
+            checkpoint = os.path.join(self.tmpdir, 'checkpoint')
+            with open(checkpoint, 'w') as f_out:
+                json.dump({"last_id": first_id, "directories": [directory]}, f_out)
+
+            engine = RetentionEngine([RetentionPolicy(older_than="5d")], checkpoint=checkpoint)
+            self.assertEqual(engine.run(), 1)
+            self.assertFalse(os.path.exists(directory))
+            self.assertFalse(os.path.exists(second.output_dir))
+            self.assertEqual(TestJob.objects.count(), 0)
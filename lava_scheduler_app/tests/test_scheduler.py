@@ -39,6 +39,7 @@ from lava_scheduler_app.scheduler import (
     schedule,
     schedule_health_checks
 )
+from lava_server.tracing import Tracer
 
 
 def _minimal_valid_job(self):
@@ -439,3 +440,44 @@ class TestPriorities(TestCase):
         self._check_job(jobs[2], TestJob.STATE_SCHEDULED, self.device01)
         self._check_job(jobs[3], TestJob.STATE_SUBMITTED)
         self._check_job(jobs[4], TestJob.STATE_SUBMITTED)
+
+
+class TestTracing(TestCase):
+
+    def setUp(self):
+        self.device_type01 = DeviceType.objects.create(name="dt-01")
+        self.user = User.objects.create(username="user-01")
+
+    def test_trace(self):
+        job = TestJob.objects.create(requested_device_type=self.device_type01,
+                                     user=self.user, submitter=self.user, is_public=True,
+                                     definition=_minimal_valid_job(None))
+        tracer = Tracer()
+        with tracer.trace("disabled"):
+            pass
+        self.assertEqual(len(tracer.passes), 0)
+
+        tracer.enable(passes=2)
+        with tracer.trace("schedule") as root:
+            with tracer.span("jobs", device_type="dt-01"):
+                with tracer.span("job queryset"):
+                    self.assertEqual(list(TestJob.objects.all()), [job])
+        self.assertEqual(len(tracer.passes), 1)
+        (queryset, jobs, schedule_pass) = tracer.passes[0]
+        self.assertIs(schedule_pass, root)
+        self.assertEqual(queryset["name"], "job queryset")
+        self.assertEqual(queryset["args"]["queries"], 1)
+        self.assertEqual(jobs["args"]["queries"], 1)
+        self.assertEqual(root["args"]["queries"], 1)
+        self.assertEqual(list(root["args"]["device_types"].keys()), ["dt-01"])
+        self.assertEqual(root["args"]["device_types"]["dt-01"]["queries"], 1)
+        self.assertTrue(root["ts"] <= jobs["ts"] <= queryset["ts"])
+
+        # Only the last passes are kept
+        for _ in range(3):
+            with tracer.trace("schedule"):
+                pass
+        self.assertEqual(len(tracer.passes), 2)
+        data = tracer.dump()
+        self.assertEqual(data["traceEvents"][0]["ph"], "M")
+        self.assertEqual([e["name"] for e in data["traceEvents"][1:]], ["schedule", "schedule"])
@@ -0,0 +1,145 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models.signals import post_init, post_save
+
+from lava_scheduler_app import signals
+from lava_scheduler_app.models import Device, TestJob, Worker
+from lava_scheduler_app.tests.test_pipeline import YamlFactory
+from lava_scheduler_app.tests.test_submission import TestCaseWithFactory
+
+
+HANDLERS = [
+    (post_init, signals.device_init_handler, Device, "device_init_handler"),
+    (post_save, signals.device_post_handler, Device, "device_post_handler"),
+    (post_init, signals.testjob_init_handler, TestJob, "testjob_init_handler"),
+    (post_save, signals.testjob_post_handler, TestJob, "testjob_post_handler"),
+    (post_init, signals.worker_init_handler, Worker, "worker_init_handler"),
+    (post_save, signals.worker_post_handler, Worker, "worker_post_handler"),
+]
+
+
+def connect_handlers():
+    for (signal, handler, sender, uid) in HANDLERS:
+        signal.connect(handler, sender=sender, weak=False, dispatch_uid=uid)
+
+
+def disconnect_handlers():
+    for (signal, _, sender, uid) in HANDLERS:
+        signal.disconnect(sender=sender, dispatch_uid=uid)
+
+
+# Importing the module connects the handlers: only keep them connected
+# while the tests of this module are running.
+if not settings.EVENT_NOTIFICATION:
+    disconnect_handlers()
+
+
+class TestEventBatch(TestCaseWithFactory):  # pylint: disable=too-many-ancestors
+
+    def setUp(self):
+        super(TestEventBatch, self).setUp()
+        self.factory = YamlFactory()
+        self.factory.make_device(self.factory.make_device_type(), 'fakeqemu1')
+        self.user = User.objects.create_user('test', 'test@example.com', 'test')
+        self.sent = []
+        self.send_event = signals.send_event
+        signals.send_event = lambda topic, user, data: self.sent.append((topic, user, data))
+        signals.thread_local.batch = None
+        connect_handlers()
+
+    def tearDown(self):
+        if not settings.EVENT_NOTIFICATION:
+            disconnect_handlers()
+        signals.send_event = self.send_event
+        signals.thread_local.batch = None
+        super(TestEventBatch, self).tearDown()
+
+    def commit(self):
+        # The test case is never committed: run the callbacks by hand
+        callbacks = connection.run_on_commit
+        connection.run_on_commit = []
+        for (_, func) in callbacks:
+            func()
+
+    def job_events(self):
+        return [(user, data) for (topic, user, data) in self.sent if topic == ".testjob"]
+
+    def test_add(self):
+        batch = signals.EventBatch()
+        batch.add(".worker", "lavaserver", {"state": "Online"})
+        batch.add(".worker", "lavaserver", {"state": "Offline"})
+        self.assertEqual(self.sent, [])
+        batch.send()
+        self.assertEqual(self.sent, [
+            (".worker", "lavaserver", {"state": "Online"}),
+            (".worker", "lavaserver", {"state": "Offline"}),
+        ])
+
+    def test_sent_on_commit(self):
+        with transaction.atomic():
+            job = TestJob.from_yaml_and_user(self.factory.make_job_yaml(), self.user)
+        self.assertEqual(self.sent, [])
+
+        self.commit()
+        events = self.job_events()
+        self.assertEqual(len(events), 1)
+        (user, data) = events[0]
+        self.assertEqual(user, "test")
+        self.assertEqual(data["submitter"], "test")
+        self.assertEqual(data["job"], job.id)
+        self.assertEqual(data["state"], "Submitted")
+
+    def test_rollback(self):
+        job = TestJob.from_yaml_and_user(self.factory.make_job_yaml(), self.user)
+        self.commit()
+        self.sent = []
+
+        try:
+            with transaction.atomic():
+                job.state = TestJob.STATE_CANCELING
+                job.save()
+                raise RuntimeError("rollback")
+        except RuntimeError:
+            pass
+        self.commit()
+        self.assertEqual(self.sent, [])
+
+        # A new batch is created after the rollback
+        job = TestJob.objects.get(id=job.id)
+        job.state = TestJob.STATE_FINISHED
+        job.save()
+        self.commit()
+        self.assertEqual([data["state"] for (_, data) in self.job_events()], ["Finished"])
+
+    def test_savepoint_rollback(self):
+        job = TestJob.from_yaml_and_user(self.factory.make_job_yaml(), self.user)
+        job.state = TestJob.STATE_SCHEDULING
+        job.save()
+        try:
+            with transaction.atomic():
+                job.state = TestJob.STATE_CANCELING
+                job.save()
+                raise RuntimeError("rollback")
+        except RuntimeError:
+            pass
+
+        # Only the events of the rolled back savepoint are dropped
+        self.commit()
+        self.assertEqual([data["state"] for (_, data) in self.job_events()],
+                         ["Submitted", "Scheduling"])
+
+    def test_transitions(self):
+        job = TestJob.from_yaml_and_user(self.factory.make_job_yaml(), self.user)
+        for state in [TestJob.STATE_SCHEDULING, TestJob.STATE_SCHEDULED, TestJob.STATE_RUNNING]:
+            job.state = state
+            job.save()
+        self.assertEqual(self.sent, [])
+
+        # Every transition is sent, in order
+        self.commit()
+        events = self.job_events()
+        self.assertEqual([data["state"] for (_, data) in events],
+                         ["Submitted", "Scheduling", "Scheduled", "Running"])
+        self.assertEqual(set(data["job"] for (_, data) in events), set([job.id]))
+        self.assertEqual(set(user for (user, _) in events), set(["test"]))
@@ -0,0 +1,63 @@
+import shutil
+import tempfile
+
+import yaml
+
+from django.test import TestCase
+
+from lava_results_app.models import TestCase as ResultCase
+from lava_scheduler_app.models import Device, TestJob
+from lava_scheduler_app.synthetic import SyntheticLab, synthetic_description
+
+
+class TestSyntheticLab(TestCase):
+
+    def setUp(self):
+        self.config_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.config_path)
+
+    def new_lab(self, seed=42):
+        return SyntheticLab(prefix="bench", device_types=3, devices=6, workers=2,
+                            tags=4, queued_jobs=20, finished_jobs=10,
+                            test_cases=95, seed=seed, config_path=self.config_path)
+
+    def test_create_and_delete(self):
+        lab = self.new_lab()
+        self.assertFalse(lab.exists())
+        lab.create()
+        self.assertEqual(lab.summary(), {"prefix": "bench", "device_types": 3,
+                                         "devices": 6, "workers": 2,
+                                         "queued_jobs": 20, "finished_jobs": 10,
+                                         "test_cases": 95})
+
+        device = Device.objects.get(hostname="bench-device-1")
+        with open("%s/bench-device-1.jinja2" % self.config_path) as f_in:
+            self.assertTrue(f_in.read().startswith("{% extends 'beaglebone-black.jinja2' %}"))
+        self.assertEqual(device.device_type.name, "bench-dt-1")
+
+        job = lab.jobs().filter(state=TestJob.STATE_FINISHED).first()
+        definition = yaml.load(job.definition)
+        self.assertEqual(definition["device_type"], job.requested_device_type.name)
+        self.assertTrue(job.submit_time < job.start_time < job.end_time)
+        self.assertEqual(job.testsuite_set.filter(name="lava").count(), 1)
+
+        description = yaml.load(synthetic_description(job))
+        self.assertEqual(description["device"]["device_type"], job.requested_device_type.name)
+        self.assertEqual([action["section"] for action in description["pipeline"]],
+                         ["deploy", "boot", "test"])
+
+        lab.delete()
+        self.assertFalse(lab.exists())
+        self.assertEqual(lab.jobs().count(), 0)
+        self.assertEqual(ResultCase.objects.filter(name__startswith="case-").count(), 0)
+
+    def test_deterministic(self):
+        lab = self.new_lab()
+        lab.create()
+        first = list(lab.jobs().order_by("id").values_list("definition", flat=True))
+        lab.delete()
+        lab = self.new_lab()
+        lab.create()
+        self.assertEqual(list(lab.jobs().order_by("id").values_list("definition", flat=True)), first)
@@ -1,19 +1,27 @@
 import logging
 import sys
-from django.contrib.auth.models import User, AnonymousUser
+from django.contrib.auth.models import AnonymousUser, Group, Permission, User
+from django.test.client import RequestFactory
 from django_testscenarios.ubertest import TestCase
 from lava_scheduler_app.models import (
     Device,
     DeviceType,
     TestJob,
 )
-from lava_scheduler_app.views import filter_device_types
+from lava_scheduler_app.views import JobTableView, filter_device_types
 from lava.utils.lavatable import LavaTable, LavaView
 from lava_scheduler_app.tables import (
     JobTable,
     DeviceTable,
     all_jobs_with_custom_sort,
+    visible_jobs,
 )
+from lava_scheduler_app.managers import viewing_group_ids
+from lava_scheduler_app.tests.test_pipeline import YamlFactory
+from lava_scheduler_app.tests.test_submission import TestCaseWithFactory
+from lava.utils.paginator import KeysetPaginator
+from lava.utils.search import build_tsquery
+from django_tables2 import RequestConfig
 
 LOGGER = logging.getLogger()
 LOGGER.level = logging.INFO  # change to DEBUG to see *all* output
@@ -75,7 +83,7 @@ class TestDeviceView(LavaView):
             .order_by("hostname").filter(device_type__in=visible)
 
 
-class TestJobView(LavaView):
+class TestJobView(JobTableView):
 
     def get_queryset(self):
         return all_jobs_with_custom_sort()
@@ -221,3 +229,150 @@ class TestHiddenDevicesInDeviceTable(TestCase):
         device.save()  # pylint: disable=no-member
         view = TestDeviceView(None)
         self.assertEqual(len(view.get_queryset()), 0)
+
+
+class TestCaseWithJobs(TestCaseWithFactory):
+
+    def setUp(self):
+        super(TestCaseWithJobs, self).setUp()
+        self.factory = YamlFactory()
+        self.factory.make_device(self.factory.make_device_type(), 'fakeqemu1')
+
+
+class TestSearchDocument(TestCaseWithJobs):
+
+    def test_build_tsquery(self):
+        self.assertEqual(build_tsquery("qemu-Stag"), "qemu-stag:*")
+        self.assertEqual(build_tsquery("lava_health 01"), "lava_health:* & 01:*")
+        self.assertEqual(build_tsquery("1234.0 linux 4.14"), "1234.0:* & linux:* & 4.14:*")
+        self.assertIsNone(build_tsquery("&!:*"))
+
+    def search_view(self, term):  # pylint: disable=no-self-use
+        request = RequestFactory().get("/", {"search": term})
+        request.user = AnonymousUser()
+        return TestJobView(request, model=TestJob, table_class=TestJobTable)
+
+    def test_search(self):
+        user = self.factory.make_user()
+        job = TestJob.from_yaml_and_user(
+            self.factory.make_job_yaml(job_name="smoke tests linux 4.14"), user)
+        TestJob.from_yaml_and_user(
+            self.factory.make_job_yaml(job_name="boot"), self.factory.make_user())
+        self.assertIn(user.username, job.search_document.split())
+
+        for term in [user.username, "smoke", "Tests smo", "4.14"]:
+            view = self.search_view(term)
+            self.assertEqual(list(view.get_table_data().values_list("id", flat=True)), [job.id])
+        # The id can also be found in the usernames
+        self.assertIn(job.id, self.search_view(str(job.id)).get_table_data().values_list("id", flat=True))
+
+        # Only the beginning of the words is matched
+        for term in ["unknown", "moke"]:
+            view = self.search_view(term)
+            self.assertEqual(view.get_table_data().count(), 0)
+
+        # The state is the first word of the document
+        self.assertEqual(job.search_document.split()[0], "Submitted")
+        self.assertEqual(self.search_view("Submitted").get_table_data().count(), 2)
+        job.state = TestJob.STATE_RUNNING
+        job.save()
+        self.assertEqual(job.search_document.split()[0], "Running")
+        self.assertIn(user.username, job.search_document.split())
+        self.assertEqual(list(self.search_view("runn").get_table_data().values_list("id", flat=True)), [job.id])
+        self.assertEqual(self.search_view("Submitted").get_table_data().count(), 1)
+
+
+class TestKeysetPaginator(TestCaseWithJobs):
+
+    def test_pages(self):
+        user = self.factory.make_user()
+        for _ in range(25):
+            TestJob.from_yaml_and_user(self.factory.make_job_yaml(), user)
+        expected = list(all_jobs_with_custom_sort().order_by("-submit_time", "-id")
+                        .values_list("id", flat=True))
+
+        for sort in ["", "id", "-id"]:
+            if sort:
+                ordered = sorted(expected, reverse=sort.startswith("-"))
+            else:
+                ordered = expected
+            for page in [1, 2, 3]:
+                params = {"page": page}
+                if sort:
+                    params["sort"] = sort
+                request = RequestFactory().get("/", params)
+                table = TestJobTable(all_jobs_with_custom_sort())
+                RequestConfig(request, paginate={"per_page": 10,
+                                                 "paginator_class": KeysetPaginator}).configure(table)
+                self.assertEqual(table.paginator.count, 25)
+                self.assertEqual([row.record.id for row in table.page.object_list],
+                                 ordered[(page - 1) * 10:page * 10])
+
+
+class TestVisibleJobs(TestCaseWithJobs):
+
+    def test_page(self):
+        owner = self.factory.make_user()
+        public = [TestJob.from_yaml_and_user(self.factory.make_job_yaml(), owner)
+                  for _ in range(3)]
+        private = TestJob.from_yaml_and_user(
+            self.factory.make_job_yaml(visibility="personal"), owner)
+        other = self.factory.make_user()
+
+        for (user, expected) in [(owner, public + [private]), (other, public), (AnonymousUser(), public)]:
+            request = RequestFactory().get("/")
+            request.user = user
+            table = TestJobTable(TestJob.objects.all().order_by("id"))
+            RequestConfig(request, paginate={"per_page": 10}).configure(table)
+            table.context = {"request": request}
+            jobs = [row.record for row in table.page.object_list]
+            # Load the permissions and the groups of the user, cached for
+            # the request
+            if user.is_authenticated():
+                user.has_perm('lava_scheduler_app.change_device')
+                viewing_group_ids(user)
+            # The whole page is checked in one query
+            with self.assertNumQueries(1):
+                visible = [job for job in jobs if job.pk in visible_jobs(table)]
+            self.assertEqual(visible, expected)
+
+    def test_can_view(self):
+        owner = self.factory.make_user()
+        member = self.factory.make_user()
+        members = self.factory.make_user()
+        admin = self.factory.make_user()
+        admin.user_permissions.add(Permission.objects.get(codename='change_device'))
+        resubmit = self.factory.make_user()
+        resubmit.user_permissions.add(Permission.objects.get(codename='cancel_resubmit_testjob'))
+        groups = [Group.objects.create(name="group-%d" % index) for index in range(2)]
+        member.groups.add(groups[0])
+        members.groups.add(*groups)
+
+        jobs = [TestJob.from_yaml_and_user(self.factory.make_job_yaml(), owner)]
+        # Viewing groups: every group is needed
+        job = TestJob.from_yaml_and_user(self.factory.make_job_yaml(visibility="personal"), owner)
+        job.visibility = TestJob.VISIBLE_GROUP
+        job.save()
+        job.viewing_groups.add(*groups)
+        jobs.append(job)
+        # Public job on a device type restricted to the device owners
+        restricted = DeviceType.objects.create(name="restricted", owners_only=True)
+        device = self.factory.make_device(restricted, "restricted1")
+        device.user = member
+        device.save()
+        job = TestJob.from_yaml_and_user(self.factory.make_job_yaml(), owner)
+        job.requested_device_type = restricted
+        job.save()
+        jobs.append(job)
+        # Personal job running on a device
+        job = TestJob.from_yaml_and_user(self.factory.make_job_yaml(visibility="personal"), owner)
+        job.actual_device = Device.objects.get(hostname="fakeqemu1")
+        job.save()
+        jobs.append(job)
+
+        job_ids = [job.id for job in jobs]
+        for user in [owner, member, members, admin, resubmit, AnonymousUser()]:
+            expected = set(job.id for job in TestJob.objects.filter(id__in=job_ids) if job.can_view(user))
+            self.assertEqual(TestJob.can_view_ids(user, job_ids), expected)
+        self.assertEqual(TestJob.can_view_ids(members, job_ids), set(job_ids[:2]))
+        self.assertEqual(TestJob.can_view_ids(member, job_ids), set([job_ids[0], job_ids[2]]))
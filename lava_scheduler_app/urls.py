@@ -22,7 +22,7 @@ from lava_scheduler_app.views import (
     passing_health_checks, queue, reports,
     running, username_list_json,
     worker_detail, worker_health, workers,
-    download_device_type_template, similar_jobs,)
+    download_device_type_template, similar_jobs, similar_jobs_fields,)
 
 
 urlpatterns = [
@@ -143,4 +143,6 @@ urlpatterns = [
         name='lava_scheduler_download_device_type_yaml'),
     url(r'^job/(?P<pk>[0-9]+|[0-9]+.[0-9]+)/similarjobs$', similar_jobs,
         name='lava.scheduler.job.similar_jobs'),
+    url(r'^job/(?P<pk>[0-9]+|[0-9]+.[0-9]+)/similarjobs/fields$', similar_jobs_fields,
+        name='lava.scheduler.job.similar_jobs_fields'),
 ]
@@ -17,6 +17,7 @@ import re
 import yaml
 
 from django import forms
+from django.conf import settings
 from django.contrib.humanize.templatetags.humanize import naturaltime
 
 from django.contrib.admin.models import LogEntry
@@ -74,12 +75,14 @@ from lava_scheduler_app.dbutils import (
 from lava_scheduler_app.templatetags.utils import udecode
 
 from lava.utils.lavatable import LavaView
+from lava.utils.paginator import KeysetPaginator
 from lava_results_app.utils import (
     check_request_auth,
     description_data,
     description_filename
 )
 from lava_results_app.models import (
+    LavaResult,
     NamedTestAttribute,
     Query,
     QueryCondition,
@@ -325,9 +328,9 @@ class DeviceTableView(JobTableView):
 class JobErrorsView(LavaView):
 
     def get_queryset(self):
-        q = TestCase.objects.filter(suite__name="lava", result=TestCase.RESULT_FAIL)
-        q = q.filter(metadata__regex="error_type: (Configuration|Infrastructure|Bug)")
-        q = q.select_related("suite", "suite__job__actual_device")
+        q = TestCase.objects.filter(suite__name="lava", result=TestCase.RESULT_FAIL,
+                                    lava_result__error_type__in=["Configuration", "Infrastructure", "Bug"])
+        q = q.select_related("lava_result", "suite", "suite__job__actual_device")
         return q.order_by('-suite__job__id')
 
 
@@ -468,7 +471,8 @@ def failure_report(request):
 
     data = FailureTableView(request)
     ptable = FailedJobTable(data.get_table_data())
-    RequestConfig(request, paginate={"per_page": ptable.length}).configure(ptable)
+    RequestConfig(request, paginate={"per_page": ptable.length,
+                                     "paginator_class": KeysetPaginator}).configure(ptable)
 
     return render(
         request,
@@ -639,8 +643,14 @@ def filter_device_types(user):
     at least one device this user can see.
     """
     visible = []
+    # Only the device types restricted to the owners are checked one by one
+    with_devices = set(Device.objects.filter(device_type__display=True)
+                       .values_list('device_type_id', flat=True).order_by().distinct())
     for device_type in DeviceType.objects.filter(display=True).only('name', 'owners_only'):
-        if device_type.some_devices_visible_to(user):
+        if device_type.owners_only:
+            if device_type.some_devices_visible_to(user):
+                visible.append(device_type.name)
+        elif device_type.name in with_devices:
             visible.append(device_type.name)
     return visible
 
@@ -778,7 +788,8 @@ def device_type_detail(request, pk):
         .filter(actual_device__in=devices),
         prefix=prefix,
     )
-    config = RequestConfig(request, paginate={"per_page": dt_jobs_ptable.length})
+    config = RequestConfig(request, paginate={"per_page": dt_jobs_ptable.length,
+                                              "paginator_class": KeysetPaginator})
     config.configure(dt_jobs_ptable)
 
     prefix = 'health_'
@@ -939,7 +950,8 @@ def health_job_list(request, pk):
     health_data = AllJobsView(request)
     health_table = JobTable(health_data.get_table_data().filter(
         actual_device=device, health_check=True))
-    config = RequestConfig(request, paginate={"per_page": health_table.length})
+    config = RequestConfig(request, paginate={"per_page": health_table.length,
+                                              "paginator_class": KeysetPaginator})
     config.configure(health_table)
 
     template = loader.get_template("lava_scheduler_app/health_jobs.html")
@@ -994,7 +1006,8 @@ def job_list(request):
 
     data = AllJobsView(request, model=TestJob, table_class=JobTable)
     ptable = JobTable(data.get_table_data())
-    RequestConfig(request, paginate={"per_page": ptable.length}).configure(ptable)
+    RequestConfig(request, paginate={"per_page": ptable.length,
+                                     "paginator_class": KeysetPaginator}).configure(ptable)
     template = loader.get_template("lava_scheduler_app/alljobs.html")
     return HttpResponse(template.render(
         {
@@ -1032,7 +1045,8 @@ def job_errors(request):
 def active_jobs(request):
     data = IndexTableView(request, model=TestJob, table_class=IndexJobTable)
     ptable = IndexJobTable(data.get_table_data())
-    RequestConfig(request, paginate={"per_page": ptable.length}).configure(ptable)
+    RequestConfig(request, paginate={"per_page": ptable.length,
+                                     "paginator_class": KeysetPaginator}).configure(ptable)
 
     return render(
         request,
@@ -1146,9 +1160,6 @@ def job_detail(request, pk):
         'change_priority': job.can_change_priority(request.user),
         'context_help': BreadCrumbTrail.leading_to(job_detail, pk='detail'),
         'is_favorite': is_favorite,
-        'condition_choices': simplejson.dumps(
-            QueryCondition.get_condition_choices(job)
-        ),
         'available_content_types': simplejson.dumps(
             QueryCondition.get_similar_job_content_types()
         ),
@@ -1211,21 +1222,15 @@ def job_detail(request, pk):
             log_data = None
 
         # Get lava.job result if available
-        lava_job_result = None
-        try:
-            lava_job_obj = TestCase.objects.get(suite__job=job,
-                                                suite__name="lava",
-                                                name="job")
-            # Only print it if it's a failure
-            if lava_job_obj.result == TestCase.RESULT_FAIL:
-                lava_job_result = lava_job_obj.action_metadata
-        except TestCase.DoesNotExist:
-            pass
+        # Only print it if it's a failure
+        lava_job_result = LavaResult.objects.filter(job=job, testcase__name="job",
+                                                    testcase__result=TestCase.RESULT_FAIL).first()
 
         data.update({
             'log_data': log_data if log_data else [],
             'invalid_log_data': log_data is None,
-            'lava_job_result': lava_job_result
+            'lava_job_result': lava_job_result,
+            'live_url': settings.EVENT_LIVE_URL if settings.EVENT_NOTIFICATION else "",
         })
 
         return render(request, "lava_scheduler_app/job_pipeline.html", data)
@@ -1299,7 +1304,8 @@ def myjobs(request):
     get_object_or_404(User, pk=request.user.id)
     data = MyJobsView(request, model=TestJob, table_class=JobTable)
     ptable = JobTable(data.get_table_data())
-    RequestConfig(request, paginate={"per_page": ptable.length}).configure(ptable)
+    RequestConfig(request, paginate={"per_page": ptable.length,
+                                     "paginator_class": KeysetPaginator}).configure(ptable)
     template = loader.get_template("lava_scheduler_app/myjobs.html")
     return HttpResponse(template.render(
         {
@@ -1343,7 +1349,8 @@ def favorite_jobs(request, username=None):
     data = FavoriteJobsView(request, model=TestJob,
                             table_class=JobTable, user=user)
     ptable = JobTable(data.get_table_data())
-    RequestConfig(request, paginate={"per_page": ptable.length}).configure(ptable)
+    RequestConfig(request, paginate={"per_page": ptable.length,
+                                     "paginator_class": KeysetPaginator}).configure(ptable)
     template = loader.get_template("lava_scheduler_app/favorite_jobs.html")
     return HttpResponse(template.render(
         {
@@ -1418,8 +1425,11 @@ def job_section_log(request, pk, log_name):
     return response
 
 
-def job_status(request, pk):
-    job = get_restricted_job(request.user, pk, request=request)
+def job_status_data(job):
+    """
+    Status of the job as displayed on the job page. Used by the job_status
+    view and sent by lava-live to the browsers watching the job.
+    """
     response_dict = {'actual_device': "<i>...</i>",
                      'duration': "<i>...</i>",
                      'job_state': job.get_state_display(),
@@ -1454,7 +1464,12 @@ def job_status(request, pk):
     if job.state == TestJob.STATE_FINISHED:
         response_dict['X-JobState'] = '1'
 
-    response = HttpResponse(simplejson.dumps(response_dict),
+    return response_dict
+
+
+def job_status(request, pk):
+    job = get_restricted_job(request.user, pk, request=request)
+    response = HttpResponse(simplejson.dumps(job_status_data(job)),
                             content_type='text/json')
     return response
 
@@ -1859,7 +1874,8 @@ def device_detail(request, pk):
         recent_data.get_table_data(prefix),
         prefix=prefix,
     )
-    RequestConfig(request, paginate={"per_page": recent_ptable.length}).configure(recent_ptable)
+    RequestConfig(request, paginate={"per_page": recent_ptable.length,
+                                     "paginator_class": KeysetPaginator}).configure(recent_ptable)
 
     search_data = recent_ptable.prepare_search_data(recent_data)
     discrete_data = recent_ptable.prepare_discrete_data(recent_data)
@@ -2146,7 +2162,8 @@ def healthcheck(request):
                                             table_class=JobTable)
     health_check_ptable = JobTable(health_check_data.get_table_data(),)
     config = RequestConfig(request,
-                           paginate={"per_page": health_check_ptable.length})
+                           paginate={"per_page": health_check_ptable.length,
+                                     "paginator_class": KeysetPaginator})
     config.configure(health_check_ptable)
     template = loader.get_template("lava_scheduler_app/health_check_jobs.html")
     return HttpResponse(template.render(
@@ -2173,7 +2190,8 @@ def queue(request):
     queue_ptable = QueueJobsTable(
         queue_data.get_table_data(),
     )
-    config = RequestConfig(request, paginate={"per_page": queue_ptable.length})
+    config = RequestConfig(request, paginate={"per_page": queue_ptable.length,
+                                              "paginator_class": KeysetPaginator})
     config.configure(queue_ptable)
     template = loader.get_template("lava_scheduler_app/queue.html")
     return HttpResponse(template.render(
@@ -2304,3 +2322,15 @@ def similar_jobs(request, pk):
         "%s?entity=%s&conditions=%s" % (
             reverse('lava.results.query_custom'),
             entity, conditions))
+
+
+def similar_jobs_fields(request, pk):
+    """
+    Metadata field names of the job, loaded by the similar jobs dialog
+    when it is opened.
+    """
+    job = get_restricted_job(request.user, pk, request=request)
+    content_type = ContentType.objects.get_for_model(NamedTestAttribute)
+    fields = {name: {} for name in QueryCondition.get_job_attribute_names(job)}
+    return HttpResponse(simplejson.dumps({content_type.id: {"fields": fields}}),
+                        content_type='application/json')
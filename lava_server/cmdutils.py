@@ -30,6 +30,11 @@ import signal
 
 from django.core.management.base import BaseCommand
 
+from lava_server import metrics
+
+# Seconds between two writes of the metrics file
+METRICS_INTERVAL = 15
+
 
 class LAVADaemonCommand(BaseCommand):
 
@@ -55,6 +60,16 @@ class LAVADaemonCommand(BaseCommand):
                           help="Run the process under this group. It should "
                                "be the same group as the gunicorn process.")
 
+        exporters = parser.add_argument_group("metrics")
+        exporters.add_argument('--metrics-port', default=None, type=int,
+                               help="Export the metrics over http on this port")
+        exporters.add_argument('--metrics-address', default="127.0.0.1",
+                               help="Address of the metrics http server. "
+                                    "Default: 127.0.0.1")
+        exporters.add_argument('--metrics-file', default=None,
+                               help="Export the metrics in this file, for the "
+                                    "node exporter textfile collector")
+
     def drop_privileges(self, user, group):
         try:
             user_id = pwd.getpwnam(user)[2]
@@ -100,6 +115,28 @@ class LAVADaemonCommand(BaseCommand):
         else:
             self.logger.setLevel(logging.DEBUG)
 
+    def setup_metrics(self, options, shard=None):
+        """
+        Start the metrics exporters requested on the command line.
+        Shard <n> of a daemon exports on port + n + 1 and in file.<n>.
+        """
+        port = options["metrics_port"]
+        filename = options["metrics_file"]
+        if shard is not None:
+            port = None if port is None else port + shard + 1
+            filename = None if filename is None else "%s.%d" % (filename, shard)
+
+        if port is not None:
+            self.logger.info("Exporting the metrics on http://%s:%d/metrics",
+                             options["metrics_address"], port)
+            try:
+                metrics.start_http_exporter(options["metrics_address"], port)
+            except (IOError, OSError) as exc:
+                self.logger.error("Unable to export the metrics: %s", exc)
+        if filename is not None:
+            self.logger.info("Exporting the metrics in %s", filename)
+            metrics.start_textfile_exporter(filename, METRICS_INTERVAL)
+
     def setup_zmq_signal_handler(self):
         # Mask signals and create a pipe that will receive a bit for each
         # signal received. Poll the pipe along with the zmq socket so that we
@@ -0,0 +1,383 @@
+# Copyright (C) 2018 Linaro Limited
+#
+# This file is part of LAVA Server.
+#
+# LAVA Server is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# LAVA Server is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along
+# with this program; if not, see <http://www.gnu.org/licenses>.
+
+import contextlib
+import datetime
+import logging
+import random
+import shutil
+import simplejson
+import tempfile
+import time
+import zmq
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import load_command_class
+from django.core.management.base import BaseCommand, CommandError
+from django.core.urlresolvers import reverse
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import override_settings
+from django.utils.http import urlencode
+
+from lava_results_app.dbutils import export_testcases, map_metadata
+from lava_results_app.models import TestCase, TestSuite
+from lava_results_app.utils import debian_package_version
+from lava_scheduler_app.models import Device, TestJob
+from lava_scheduler_app.scheduler import schedule
+from lava_scheduler_app.synthetic import SyntheticLab, synthetic_description
+
+
+BENCHMARKS = ["schedule", "start_jobs", "logs", "map_metadata", "exports",
+              "queries", "visibility", "views"]
+
+
+class Rollback(Exception):
+    pass
+
+
+@contextlib.contextmanager
+def rollback():
+    """
+    Run the block in a transaction that is always rolled back, so that every
+    run starts from the same database content.
+    """
+    try:
+        with transaction.atomic():
+            yield
+            raise Rollback()
+    except Rollback:
+        pass
+
+
+class Command(BaseCommand):
+    help = "Time the server hot paths on a synthetic lab"
+
+    def __init__(self, *args, **options):
+        super(Command, self).__init__(*args, **options)
+        self.lab = None
+        self.logger = None
+        self.options = None
+
+    def add_arguments(self, parser):
+        parser.add_argument("--prefix", default="synthetic",
+                            help="Prefix of the synthetic lab (see synthetic-lab). "
+                                 "Default: synthetic")
+        parser.add_argument("--config-path", default=None,
+                            help="Device dictionaries of the synthetic lab")
+        parser.add_argument("--repeat", default=5, type=int,
+                            help="Number of runs of each benchmark. Default: 5")
+        parser.add_argument("--jobs", default=100, type=int,
+                            help="Number of jobs used by the start_jobs, "
+                                 "map_metadata and exports benchmarks. Default: 100")
+        parser.add_argument("--log-messages", default=20000, type=int,
+                            help="Number of log messages sent to lava-logs. "
+                                 "Default: 20000")
+        parser.add_argument("--only", default=None, action="append",
+                            choices=BENCHMARKS,
+                            help="Only run these benchmarks (can be repeated)")
+        parser.add_argument("--label", default=None,
+                            help="Label of the results, like the release name. "
+                                 "Default: the installed lava-server version")
+        parser.add_argument("--output", default=None,
+                            help="Save the results in this JSON file")
+        parser.add_argument("--compare", default=None,
+                            help="Compare with the results saved in this JSON file")
+        parser.add_argument("--threshold", default=0.1, type=float,
+                            help="Report the benchmarks slower than the "
+                                 "compared results by this ratio. Default: 0.1")
+
+    def handle(self, *_, **options):
+        self.lab = SyntheticLab(prefix=options["prefix"], config_path=options["config_path"])
+        if not self.lab.exists():
+            raise CommandError("Unable to find a synthetic lab named '%s', "
+                               "create it with 'lava-server manage synthetic-lab create'"
+                               % options["prefix"])
+        if options["config_path"]:
+            Device.CONFIG_PATH = options["config_path"]
+        if options["repeat"] < 1:
+            raise CommandError("--repeat should be a positive integer")
+
+        baseline = None
+        if options["compare"]:
+            try:
+                with open(options["compare"], "r") as f_in:
+                    baseline = simplejson.load(f_in)
+            except (IOError, ValueError) as exc:
+                raise CommandError("Unable to load '%s': %s" % (options["compare"], exc))
+
+        self.logger = logging.getLogger("lava-benchmark")
+        self.logger.addHandler(logging.NullHandler())
+        self.logger.propagate = False
+        self.options = options
+
+        media_root = tempfile.mkdtemp(prefix="lava-benchmark-")
+        results = {}
+        try:
+            with override_settings(MEDIA_ROOT=media_root,
+                                   ALLOWED_HOSTS=list(settings.ALLOWED_HOSTS) + ["testserver"]):
+                for name in options["only"] or BENCHMARKS:
+                    self.stdout.write("Running %s" % name)
+                    for (key, timings) in getattr(self, "bench_%s" % name)().items():
+                        results[key] = {"median": sorted(timings)[len(timings) // 2],
+                                        "min": min(timings), "max": max(timings),
+                                        "runs": timings}
+        finally:
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        report = {"label": options["label"] or debian_package_version() or "unknown",
+                  "date": datetime.datetime.utcnow().isoformat(),
+                  "repeat": options["repeat"],
+                  "lab": self.lab.summary(),
+                  "results": results}
+        self.print_report(report, baseline, options["threshold"])
+        if options["output"]:
+            with open(options["output"], "w") as f_out:
+                simplejson.dump(report, f_out, indent=2, sort_keys=True)
+            self.stdout.write("Results saved in %s" % options["output"])
+
+    def print_report(self, report, baseline, threshold):
+        previous = baseline["results"] if baseline else {}
+        if baseline:
+            self.stdout.write("Comparing with '%s' (%s)" % (baseline.get("label"), baseline.get("date")))
+        for (name, result) in sorted(report["results"].items()):
+            line = "%-28s %10.2fms" % (name, result["median"] * 1000)
+            if name in previous:
+                ratio = result["median"] / previous[name]["median"] if previous[name]["median"] else 1
+                line += "  %+7.1f%%" % ((ratio - 1) * 100)
+                if ratio > 1 + threshold:
+                    line += "  REGRESSION"
+            self.stdout.write(line)
+
+    def measure(self, function, setup=None):
+        """
+        Return the duration of each run of function, in seconds. Each run
+        is rolled back, setup is called before each run but not timed.
+        """
+        timings = []
+        for _ in range(self.options["repeat"]):
+            with rollback():
+                if setup is not None:
+                    setup()
+                start = time.time()
+                function()
+                timings.append(time.time() - start)
+        return timings
+
+    def sample_jobs(self):
+        jobs = self.lab.jobs().filter(state=TestJob.STATE_FINISHED).order_by("id")
+        jobs = list(jobs[:self.options["jobs"]])
+        if not jobs:
+            raise CommandError("The synthetic lab does not have any finished job")
+        return jobs
+
+    # Benchmarks
+    def bench_schedule(self):
+        return {"schedule": self.measure(lambda: schedule(self.logger))}
+
+    def bench_start_jobs(self):
+        master = load_command_class("lava_server", "lava-master")
+        master.logger = self.logger
+        context = zmq.Context.instance()
+        master.controler = context.socket(zmq.ROUTER)
+        master.controler.bind("inproc://benchmark-master")
+        options = {"env": "/nonexistent/env.yaml", "env_dut": "/nonexistent/env.dut.yaml",
+                   "dispatchers_config": "/nonexistent/dispatcher.d"}
+
+        def setup():
+            # Schedule one queued job on each idle device
+            devices = list(self.lab.devices().filter(state=Device.STATE_IDLE)[:self.options["jobs"]])
+            for device in devices:
+                job = self.lab.jobs().filter(state=TestJob.STATE_SUBMITTED,
+                                             requested_device_type_id=device.device_type_id).first()
+                if job is None:
+                    continue
+                job.go_state_scheduled(device)
+                job.save()
+
+        try:
+            return {"start_jobs": self.measure(lambda: master.start_jobs(options), setup)}
+        finally:
+            master.controler.close(linger=0)
+
+    def bench_logs(self):
+        logs = load_command_class("lava_server", "lava-logs")
+        logs.logger = self.logger
+        context = zmq.Context.instance()
+        logs.log_socket = context.socket(zmq.PULL)
+        logs.log_socket.setsockopt(zmq.RCVHWM, 0)
+        logs.log_socket.bind("inproc://benchmark-logs")
+        push = context.socket(zmq.PUSH)
+        push.setsockopt(zmq.SNDHWM, 0)
+        push.connect("inproc://benchmark-logs")
+
+        rand = random.Random(42)
+        job_ids = [str(job.id).encode("utf-8") for job in self.sample_jobs()]
+        messages = []
+        for index in range(self.options["log_messages"]):
+            dt = datetime.datetime.utcnow().isoformat().encode("utf-8")
+            if index % 100 == 99:
+                msg = {"definition": "0_smoke", "case": "case-%d" % index,
+                       "result": rand.choice(["pass", "fail"])}
+                messages.append([rand.choice(job_ids), b"results", dt,
+                                 simplejson.dumps(msg).encode("utf-8")])
+            else:
+                line = "line %d: %s" % (index, "x" * rand.randint(10, 120))
+                messages.append([rand.choice(job_ids), b"target", dt,
+                                 simplejson.dumps(line).encode("utf-8")])
+
+        def setup():
+            for msg in messages:
+                push.send_multipart(msg)
+
+        def ingest():
+            for _ in range(len(messages)):
+                logs.logging_socket()
+            logs.flush_test_cases()
+            for handler in logs.jobs.values():
+                handler.close()
+            logs.jobs = {}
+
+        try:
+            return {"logs": self.measure(ingest, setup)}
+        finally:
+            push.close(linger=0)
+            logs.log_socket.close(linger=0)
+
+    def bench_map_metadata(self):
+        jobs = [(job, synthetic_description(job)) for job in self.sample_jobs()]
+
+        def run():
+            for (job, description) in jobs:
+                map_metadata(description, job)
+
+        return {"map_metadata": self.measure(run)}
+
+    def bench_exports(self):
+        job_ids = [job.id for job in self.sample_jobs()]
+        suite = TestSuite.objects.filter(job_id__in=job_ids).exclude(name="lava") \
+                                 .order_by("id").first()
+        return {
+            "exports.testcases": self.measure(lambda: list(export_testcases(
+                TestCase.objects.filter(suite__job_id__in=job_ids)))),
+            "exports.suite": self.measure(lambda: list(export_testcases(suite.testcase_set.all()))),
+        }
+
+    def client(self):  # pylint: disable=no-self-use
+        user, _ = User.objects.get_or_create(username="%s-admin" % self.lab.prefix)
+        user.is_superuser = True
+        user.save()
+        client = Client()
+        client.force_login(user)
+        return client
+
+    def get(self, client, url):
+        response = client.get(url)
+        if response.status_code != 200:
+            raise CommandError("%s returned %d" % (url, response.status_code))
+        # Consume streaming responses
+        if response.streaming:
+            for _ in response.streaming_content:
+                pass
+        return response
+
+    def bench_queries(self):
+        device_type = self.lab.device_types().order_by("name").first().name
+        urls = {
+            "queries.testjob": reverse("lava.results.query_custom") + "?" + urlencode({
+                "entity": "testjob",
+                "conditions": "testjob__requested_device_type__exact__%s,testjob__health__exact__Complete" % device_type}),
+            "queries.testcase": reverse("lava.results.query_custom") + "?" + urlencode({
+                "entity": "testcase",
+                "conditions": "testsuite__name__contains__smoke,testcase__result__exact__Test failed"}),
+            "charts.testjob": reverse("lava.results.chart_custom") + "?" + urlencode({
+                "entity": "testjob", "type": "pass/fail",
+                "conditions": "testjob__requested_device_type__exact__%s" % device_type}),
+            "charts.testcase": reverse("lava.results.chart_custom") + "?" + urlencode({
+                "entity": "testcase", "type": "measurement",
+                "conditions": "testsuite__name__contains__boot-time"}),
+        }
+        return self.measure_urls(urls)
+
+    def bench_visibility(self):
+        """
+        Execution time, as reported by EXPLAIN ANALYZE, of the results
+        visible by a lab user: the nested job subqueries used before
+        against the join on the job visibility columns.
+        """
+        user = User.objects.filter(username__startswith="%s-user-" % self.lab.prefix) \
+                           .order_by("username").first()
+        if user is None:
+            raise CommandError("The synthetic lab does not have any user")
+
+        def legacy(queryset, lookup, relation):
+            jobs = TestJob.objects.filter(**{relation: queryset}).visible_by_user(user)
+            return queryset.filter(**{lookup: jobs})
+
+        cases = TestCase.objects.filter(suite__name__contains="smoke")
+        suites = TestSuite.objects.exclude(name="lava")
+        querysets = {
+            "visibility.testcase.legacy": legacy(cases, "suite__job__in", "testsuite__testcase__in"),
+            "visibility.testcase": cases.visible_by_user(user),
+            "visibility.testsuite.legacy": legacy(suites, "job__in", "testsuite__in"),
+            "visibility.testsuite": suites.visible_by_user(user),
+        }
+        return {name: [self.explain(queryset) for _ in range(self.options["repeat"])]
+                for (name, queryset) in querysets.items()}
+
+    def explain(self, queryset):  # pylint: disable=no-self-use
+        """
+        Execute the queryset with EXPLAIN ANALYZE and return the execution
+        time measured by the database, in seconds.
+        """
+        (sql, params) = queryset.values("pk").query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + sql, params)
+            plan = cursor.fetchone()[0]
+        if not isinstance(plan, list):
+            plan = simplejson.loads(plan)
+        return plan[0]["Execution Time"] / 1000.0
+
+    def bench_views(self):
+        job = self.sample_jobs()[-1]
+        device = self.lab.devices().order_by("hostname").first()
+        suite = TestSuite.objects.filter(job=job).exclude(name="lava").first()
+        urls = {
+            "views.job_list": reverse("lava.scheduler.job.list"),
+            "views.job_detail": reverse("lava.scheduler.job.detail", args=[job.id]),
+            "views.device_list": reverse("lava.scheduler.alldevices"),
+            "views.device_detail": reverse("lava.scheduler.device.detail", args=[device.hostname]),
+            "views.device_type_detail": reverse("lava.scheduler.device_type.detail",
+                                                args=[device.device_type_id]),
+            "views.results": reverse("lava_results"),
+            "views.results_job": reverse("lava.results.testjob", args=[job.id]),
+            "views.results_suite": reverse("lava.results.suite", args=[job.id, suite.name]),
+            "views.results_csv": reverse("lava.results.testjob_csv", args=[job.id]),
+        }
+        return self.measure_urls(urls)
+
+    def measure_urls(self, urls):
+        results = {}
+        with rollback():
+            client = self.client()
+            for (name, url) in urls.items():
+                # Warm the caches before measuring
+                self.get(client, url)
+                results[name] = self.measure(lambda url=url: self.get(client, url))
+        return results
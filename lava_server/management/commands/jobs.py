@@ -18,33 +18,25 @@
 # along
 # with this program; if not, see <http://www.gnu.org/licenses>.
 
-import datetime
-import re
-from shutil import rmtree
-import time
-
-from django.contrib.auth.models import User
 from django.core.management.base import BaseCommand, CommandError, CommandParser
 from django.db import transaction
-from django.utils import timezone
 
 from lava_scheduler_app.models import (
     TestJob
 )
+from lava_scheduler_app.retention import (
+    JOB_HEALTHS,
+    JOB_STATES,
+    RetentionEngine,
+    RetentionError,
+    RetentionPolicy,
+    load_policies,
+)
 
 
 class Command(BaseCommand):
     help = "Manage jobs"
 
-    job_state = {
-        "SUBMITTED": TestJob.STATE_SUBMITTED,
-        "SCHEDULING": TestJob.STATE_SCHEDULING,
-        "SCHEDULED": TestJob.STATE_SCHEDULED,
-        "RUNNING": TestJob.STATE_RUNNING,
-        "CANCELING": TestJob.STATE_CANCELING,
-        "FINISHED": TestJob.STATE_FINISHED
-    }
-
     def add_arguments(self, parser):
         cmd = self
 
@@ -74,21 +66,39 @@ class Command(BaseCommand):
                              "form: 1h (one hour) or 2d (two days). "
                              "By default, all jobs will be removed.")
         rm.add_argument("--state", default=None,
-                        choices=["SUBMITTED", "SCHEDULING", "SCHEDULED", "RUNNING", "CANCELING",
-                                 "FINISHED"],
+                        choices=sorted(JOB_STATES.keys()),
                         help="Filter by job state")
+        rm.add_argument("--health", default=None,
+                        choices=sorted(JOB_HEALTHS.keys()),
+                        help="Filter by job health")
         rm.add_argument("--submitter", default=None, type=str,
                         help="Filter jobs by submitter")
+        rm.add_argument("--device-type", default=None, type=str,
+                        help="Filter jobs by requested device type")
+        rm.add_argument("--policy", default=None, type=str,
+                        help="Remove the jobs matching any of the retention "
+                             "policies defined in this yaml file instead of "
+                             "the filtering options.")
         rm.add_argument("--dry-run", default=False, action="store_true",
                         help="Do not remove any data, simulate the output")
+        rm.add_argument("--batch-size", default=1000, type=int,
+                        help="Number of jobs removed in each transaction")
+        rm.add_argument("--workers", default=4, type=int,
+                        help="Number of threads removing the job directories")
+        rm.add_argument("--checkpoint", default=None, type=str,
+                        help="Record the progress in this file and resume "
+                             "from it if it already exists")
+        rm.add_argument("--duty-cycle", default=1.0, type=float,
+                        help="Fraction of the time spent removing jobs: "
+                             "after each batch, sleep in proportion to the "
+                             "time taken by the batch.")
         rm.add_argument("--slow", default=False, action="store_true",
-                        help="Be nice with the system by sleeping regularly")
+                        help="Be nice with the system, same as --duty-cycle 0.5")
 
     def handle(self, *_, **options):
         """ forward to the right sub-handler """
         if options["sub_command"] == "rm":
-            self.handle_rm(options["older_than"], options["submitter"],
-                           options["state"], options["dry_run"], options["slow"])
+            self.handle_rm(options)
         elif options["sub_command"] == "fail":
             self.handle_fail(options["job_id"])
 
@@ -101,55 +111,27 @@ class Command(BaseCommand):
         except TestJob.DoesNotExist:
             raise CommandError("TestJob '%d' does not exists" % job_id)
 
-    def handle_rm(self, older_than, submitter, state, simulate, slow):
-        if not older_than and not submitter and not state and not v1_only:
-            raise CommandError("You should specify at least one filtering option")
-
-        if simulate:
-            transaction.set_autocommit(False)
-
-        jobs = TestJob.objects.all().order_by('id')
-        if older_than is not None:
-            pattern = re.compile("^(?P<time>\d+)(?P<unit>(h|d))$")
-            match = pattern.match(older_than)
-            if match is None:
-                raise CommandError("Invalid older-than format")
-
-            if match.groupdict()["unit"] == "d":
-                delta = datetime.timedelta(days=int(match.groupdict()["time"]))
+    def handle_rm(self, options):
+        try:
+            if options["policy"] is not None:
+                policies = load_policies(options["policy"])
             else:
-                delta = datetime.timedelta(hours=int(match.groupdict()["time"]))
-            jobs = jobs.filter(end_time__lt=(timezone.now() - delta))
-
-        if submitter is not None:
-            try:
-                user = User.objects.get(username=submitter)
-            except User.DoesNotExist:
-                raise CommandError("Unable to find submitter '%s'" % submitter)
-            jobs = jobs.filter(submitter=user)
-
-        if state is not None:
-            jobs = jobs.filter(state=self.job_state[state])
-
-        self.stdout.write("Removing %d jobs:" % jobs.count())
-
-        while True:
-            count = 0
-            for job in jobs[0:100]:
-                count += 1
-                self.stdout.write("* %d (%s): %s" % (job.id, job.end_time, job.output_dir))
-                try:
-                    if not simulate:
-                        rmtree(job.output_dir)
-                except OSError as exc:
-                    self.stderr.write("  -> Unable to remove the directory: %s" % str(exc))
-                job.delete()
-
-            if count == 0:
-                break
-            if slow:
-                self.stdout.write("sleeping 2s...")
-                time.sleep(2)
-
-        if simulate:
-            transaction.rollback()
+                policies = [RetentionPolicy(older_than=options["older_than"],
+                                            state=options["state"],
+                                            health=options["health"],
+                                            submitter=options["submitter"],
+                                            device_type=options["device_type"])]
+
+            duty_cycle = options["duty_cycle"]
+            if options["slow"]:
+                duty_cycle = min(duty_cycle, 0.5)
+            engine = RetentionEngine(policies,
+                                     batch_size=options["batch_size"],
+                                     workers=options["workers"],
+                                     duty_cycle=duty_cycle,
+                                     checkpoint=options["checkpoint"],
+                                     dry_run=options["dry_run"],
+                                     output=self.stdout.write)
+            engine.run()
+        except RetentionError as exc:
+            raise CommandError(str(exc))
@@ -0,0 +1,522 @@
+# Copyright (C) 2018 Linaro Limited
+#
+# This file is part of LAVA Server.
+#
+# LAVA Server is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# LAVA Server is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along
+# with this program; if not, see <http://www.gnu.org/licenses>.
+
+import asyncio
+import concurrent.futures
+from importlib import import_module
+import os
+import re
+import signal
+import simplejson
+from urllib.parse import urlsplit
+import yaml
+import zmq
+import zmq.asyncio
+
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.core.exceptions import PermissionDenied
+from django.db import close_old_connections
+from django.http import Http404, HttpRequest, QueryDict
+from django.http.cookie import parse_cookie
+
+from lava_results_app.models import TestCase
+from lava_scheduler_app.models import TestJob
+from lava_scheduler_app.templatetags.utils import udecode
+from lava_scheduler_app.views import get_restricted_job, job_status_data
+from lava_server import metrics
+from lava_server.cmdutils import LAVADaemonCommand
+
+
+FORMAT = "%(asctime)-15s %(levelname)7s %(message)s"
+
+# Path of the event stream, relative to the lava-live url
+STREAM_RE = re.compile(r"^/job/(?P<pk>[0-9]+|[0-9]+\.[0-9]+)/?$")
+
+# Maximum size of the request headers
+MAX_REQUEST_SIZE = 16 * 1024
+
+# Delay before the browser reconnects after a connection loss (ms)
+RETRY_DELAY = 5000
+
+# Metrics
+STREAMS = metrics.gauge("lava_live_streams", "Jobs currently watched")
+CLIENTS = metrics.gauge("lava_live_clients", "Connected browsers")
+OVERFLOWS = metrics.counter("lava_live_overflows_total",
+                            "Connections closed because the browser was too slow")
+
+
+def sse_event(name, data, event_id=None):
+    """
+    Serialize a server-sent event
+    """
+    msg = ""
+    if event_id is not None:
+        msg += "id: %d\n" % event_id
+    msg += "event: %s\ndata: %s\n\n" % (name, simplejson.dumps(data))
+    return msg.encode("utf-8")
+
+
+def http_response(status, message):
+    return ("HTTP/1.1 %s\r\nContent-Type: text/plain\r\nConnection: close\r\n\r\n%s\n" % (status, message)).encode("utf-8")
+
+
+class Client(object):
+    """
+    A browser connected to the event stream of a job.
+
+    The events are queued until the connection is ready to send them. The
+    queue is bounded: when the browser does not read fast enough, the
+    pending events are dropped and the connection is closed. The browser
+    reconnects with the id of the last event it received, and the missing
+    lines are read back from the log file.
+
+    The offset of the next line is unknown until the first lines are sent.
+    """
+
+    def __init__(self, writer, line, queue_size):
+        self.writer = writer
+        self.line = line
+        self.offset = None
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.overflow = False
+
+    def push(self, event):
+        if self.overflow:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflow = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+    def write(self, event):
+        if event[0] == "log":
+            (_, first, start, end, lines) = event
+            # Skip the lines already sent to this browser: the lines read
+            # back from the log file can also be read by the stream.
+            if self.offset is not None and end <= self.offset:
+                return
+            skip = 0 if self.offset is not None and start >= self.offset else self.line - first
+            if skip >= len(lines):
+                return
+            self.line = first + len(lines)
+            self.offset = end
+            self.writer.write(sse_event("log", lines[max(skip, 0):], self.line))
+        elif event[0] == "status":
+            self.writer.write(sse_event("status", event[1]))
+        else:
+            # "end" or "failed"
+            self.writer.write(sse_event(event[0], {}))
+
+
+class JobStream(object):
+    """
+    Log file and status of a job watched by at least one browser.
+    Every browser shares the same reader.
+    """
+
+    def __init__(self, job_id, filename, related):
+        self.job_id = job_id
+        self.filename = filename
+        self.related = related
+        self.clients = set()
+        # Position of the next line to read. The offset is unknown until the
+        # first read.
+        self.line = 0
+        self.offset = None
+        self.finished = False
+        self.refreshing = False
+        self.outdated = False
+        self.task = None
+
+    def broadcast(self, event):
+        for client in self.clients:
+            client.push(event)
+
+
+class Command(LAVADaemonCommand):
+    help = "LAVA live job status and logs"
+    default_logfile = "/var/log/lava-server/lava-live.log"
+
+    def __init__(self, *args, **kwargs):
+        super(Command, self).__init__(*args, **kwargs)
+        self.loop = None
+        self.executor = None
+        self.options = None
+        # job id => JobStream
+        self.streams = {}
+        # job id => ids of the streams to refresh when this job changes
+        self.related = {}
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+
+        net = parser.add_argument_group("network")
+        net.add_argument('--host', default="127.0.0.1",
+                         help="Address to listen on. Default: 127.0.0.1")
+        net.add_argument('--port', default=8001, type=int,
+                         help="Port to listen on. Default: 8001")
+        net.add_argument('--event-url', default="tcp://localhost:5500",
+                         help="URL of the publisher")
+
+        stream = parser.add_argument_group("streams")
+        stream.add_argument('--poll-interval', default=1.0, type=float,
+                            help="Seconds between two reads of the job logs. Default: 1")
+        stream.add_argument('--queue-size', default=100, type=int,
+                            help="Maximum number of pending events for each "
+                                 "connection. Default: 100")
+        stream.add_argument('--keepalive', default=15, type=int,
+                            help="Seconds between two keepalive messages. Default: 15")
+        stream.add_argument('--db-threads', default=4, type=int,
+                            help="Number of threads running the database "
+                                 "queries and the file reads. Default: 4")
+
+    def handle(self, *args, **options):
+        self.setup_logging("lava-live", options["level"],
+                           options["log_file"], FORMAT)
+
+        self.logger.info("Dropping privileges")
+        if not self.drop_privileges(options['user'], options['group']):
+            self.logger.error("Unable to drop privileges")
+            return
+
+        self.setup_metrics(options)
+        STREAMS.set_function(lambda: len(self.streams))
+        CLIENTS.set_function(lambda: sum(len(stream.clients) for stream in list(self.streams.values())))
+
+        if not settings.EVENT_NOTIFICATION:
+            self.logger.error("'EVENT_NOTIFICATION' is set to False, "
+                              "the job status won't be updated")
+
+        self.options = options
+        self.loop = asyncio.get_event_loop()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=options["db_threads"])
+
+        self.logger.info("Connecting to the publisher at %s", options["event_url"])
+        context = zmq.asyncio.Context()
+        sub = context.socket(zmq.SUB)
+        sub.setsockopt(zmq.SUBSCRIBE, (settings.EVENT_TOPIC + ".testjob").encode("utf-8"))
+        sub.connect(options["event_url"])
+
+        self.logger.info("Listening on %s:%d", options["host"], options["port"])
+        server = self.loop.run_until_complete(
+            asyncio.start_server(self.serve, options["host"], options["port"],
+                                 limit=MAX_REQUEST_SIZE))
+        listener = asyncio.ensure_future(self.listen(sub))
+
+        for signum in [signal.SIGINT, signal.SIGTERM, signal.SIGQUIT]:
+            self.loop.add_signal_handler(signum, self.loop.stop)
+
+        self.logger.info("Starting the event loop")
+        try:
+            self.loop.run_forever()
+        finally:
+            self.logger.info("Received a signal, leaving")
+            server.close()
+            listener.cancel()
+            for stream in self.streams.values():
+                stream.task.cancel()
+            self.loop.run_until_complete(server.wait_closed())
+            sub.close(linger=0)
+            context.term()
+            self.executor.shutdown(wait=False)
+
+    def run(self, func, *args):
+        return self.loop.run_in_executor(self.executor, func, *args)
+
+    ##############
+    # Publisher #
+    ##############
+    async def listen(self, sub):
+        while True:
+            msg = await sub.recv_multipart()
+            try:
+                data = simplejson.loads(msg[4].decode("utf-8"))
+                job_id = int(data["job"])
+            except (IndexError, KeyError, TypeError, ValueError):
+                self.logger.error("Invalid event: %s", msg)
+                continue
+            for watched in self.related.get(job_id, ()):
+                self.refresh_status(self.streams[watched])
+
+    def refresh_status(self, stream):
+        # The events received while loading the status are coalesced into
+        # one more load.
+        if stream.refreshing:
+            stream.outdated = True
+        else:
+            stream.refreshing = True
+            asyncio.ensure_future(self.send_status(stream))
+
+    async def send_status(self, stream):
+        try:
+            while True:
+                stream.outdated = False
+                status = await self.run(self.load_status, stream.job_id)
+                if status is None:
+                    break
+                if status.get("X-JobState"):
+                    stream.finished = True
+                stream.broadcast(("status", status))
+                if not stream.outdated:
+                    break
+        finally:
+            stream.refreshing = False
+
+    def load_status(self, job_id):  # pylint: disable=no-self-use
+        close_old_connections()
+        try:
+            return job_status_data(TestJob.objects.get(pk=job_id))
+        except TestJob.DoesNotExist:
+            return None
+
+    #########
+    # Logs #
+    #########
+    def read_lines(self, job_id, filename, line, offset, end):  # pylint: disable=no-self-use,too-many-arguments
+        """
+        Read the complete lines of output.yaml starting at 'line', found at
+        byte 'offset' if known, up to byte 'end' if given.
+        Return the lines, the offset of the first one and the offset after
+        the last one. The offsets are None if the file is not available yet.
+        """
+        try:
+            with open(filename, "rb") as f_in:
+                if offset is None:
+                    for _ in range(line):
+                        if not f_in.readline().endswith(b"\n"):
+                            return ([], None, None)
+                    offset = f_in.tell()
+                else:
+                    f_in.seek(offset)
+                data = f_in.read() if end is None else f_in.read(end - offset)
+        except IOError:
+            return ([], None, None)
+
+        # Each line of output.yaml is an item of the list. Ignore the last
+        # line if lava-logs is still writing it.
+        data = data[:data.rfind(b"\n") + 1]
+        if not data:
+            return ([], offset, offset)
+        try:
+            lines = yaml.load(data, Loader=yaml.CLoader)
+        except yaml.YAMLError:
+            lines = None
+        if not isinstance(lines, list) or len(lines) != data.count(b"\n"):
+            # Parse each line on its own: every line should be one item
+            lines = []
+            for raw in data.splitlines():
+                try:
+                    item = yaml.load(raw, Loader=yaml.CLoader)
+                except yaml.YAMLError:
+                    item = None
+                lines.append(item[0] if isinstance(item, list) and len(item) == 1 else
+                             {"lvl": "debug", "msg": raw.decode("utf-8", errors="replace")})
+
+        close_old_connections()
+        for (index, item) in enumerate(lines):
+            if not isinstance(item, dict) or "lvl" not in item or "msg" not in item:
+                lines[index] = item = {"lvl": "debug", "msg": str(item)}
+            item["msg"] = udecode(item["msg"])
+            if item["lvl"] == "results" and isinstance(item["msg"], dict) and \
+                    "definition" in item["msg"] and "case" in item["msg"]:
+                case_id = TestCase.objects.filter(
+                    suite__job_id=job_id,
+                    suite__name=item["msg"]["definition"],
+                    name=item["msg"]["case"]).values_list(
+                        "id", flat=True)
+                if case_id:
+                    item["msg"]["case_id"] = case_id[0]
+        return (lines, offset, offset + len(data))
+
+    async def tail(self, stream):
+        (finished, failed) = (False, False)
+        try:
+            while stream.clients:
+                # Read the state before the file: lava-logs writes the last
+                # lines before the job is finished.
+                finished = stream.finished
+                (lines, start, end) = await self.run(self.read_lines, stream.job_id, stream.filename,
+                                                     stream.line, stream.offset, None)
+                if end is not None:
+                    if lines:
+                        stream.broadcast(("log", stream.line, start, end, lines))
+                    stream.line += len(lines)
+                    stream.offset = end
+                if finished:
+                    break
+                await asyncio.sleep(self.options["poll_interval"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            self.logger.error("Unable to stream job %d: %s", stream.job_id, exc)
+            self.logger.exception(exc)
+            failed = True
+        finally:
+            # Close the connections. After a failure, the browsers fall back
+            # to polling.
+            if failed:
+                stream.broadcast(("failed",))
+            elif finished:
+                stream.broadcast(("end",))
+            # Nobody is watching this job anymore
+            if self.streams.get(stream.job_id) is stream:
+                del self.streams[stream.job_id]
+                for job_id in stream.related:
+                    self.related[job_id].discard(stream.job_id)
+                    if not self.related[job_id]:
+                        del self.related[job_id]
+
+    ################
+    # Connections #
+    ################
+    def authorize(self, pk, query, cookies):  # pylint: disable=no-self-use
+        """
+        Check that the user of the session can view the job.
+        Return the job id, the log file, the ids of the jobs of the multinode
+        group and the current status of the job.
+        """
+        close_old_connections()
+        request = HttpRequest()
+        request.GET = QueryDict(query)
+        request.COOKIES = cookies
+        engine = import_module(settings.SESSION_ENGINE)
+        request.session = engine.SessionStore(cookies.get(settings.SESSION_COOKIE_NAME))
+        request.user = get_user(request)
+
+        job = get_restricted_job(request.user, pk, request=request)
+        related = set([job.id])
+        if job.is_multinode:
+            related.update(subjob.id for subjob in job.sub_jobs_list)
+        return (job.id, os.path.join(job.output_dir, "output.yaml"),
+                related, job_status_data(job))
+
+    def subscribe(self, job_id, filename, related, client):
+        stream = self.streams.get(job_id)
+        if stream is None:
+            stream = JobStream(job_id, filename, related)
+            # Start reading at the first line needed by the browser
+            stream.line = client.line
+            self.streams[job_id] = stream
+            for related_id in related:
+                self.related.setdefault(related_id, set()).add(job_id)
+            stream.task = asyncio.ensure_future(self.tail(stream))
+        stream.clients.add(client)
+        return stream
+
+    async def read_request(self, reader):  # pylint: disable=no-self-use
+        data = await reader.readuntil(b"\r\n\r\n")
+        lines = data.decode("iso-8859-1").split("\r\n")
+        (method, target, _) = lines[0].split(" ", 2)
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                (key, value) = line.split(":", 1)
+                headers[key.strip().lower()] = value.strip()
+        return (method, target, headers)
+
+    async def serve(self, reader, writer):
+        stream = client = None
+        try:
+            try:
+                (method, target, headers) = await asyncio.wait_for(self.read_request(reader), 10)
+            except (asyncio.TimeoutError, asyncio.IncompleteReadError,
+                    asyncio.LimitOverrunError, ValueError):
+                writer.write(http_response("400 Bad Request", "Invalid request"))
+                return
+
+            url = urlsplit(target)
+            match = STREAM_RE.match(url.path)
+            if method != "GET":
+                writer.write(http_response("405 Method Not Allowed", "Only GET is allowed"))
+                return
+            if match is None:
+                writer.write(http_response("404 Not Found", "Not found"))
+                return
+
+            try:
+                (job_id, filename, related, status) = await self.run(
+                    self.authorize, match.group("pk"), url.query,
+                    parse_cookie(headers.get("cookie", "")))
+            except PermissionDenied:
+                writer.write(http_response("403 Forbidden", "Permission denied"))
+                return
+            except Http404:
+                writer.write(http_response("404 Not Found", "Unknown job"))
+                return
+
+            # Start after the last line received by the browser
+            try:
+                line = int(headers.get("last-event-id", QueryDict(url.query).get("line", 0)))
+            except ValueError:
+                line = 0
+            self.logger.debug("Streaming job %d from line %d", job_id, line)
+
+            writer.write(b"HTTP/1.1 200 OK\r\n"
+                         b"Content-Type: text/event-stream\r\n"
+                         b"Cache-Control: no-cache\r\n"
+                         b"Connection: close\r\n"
+                         b"X-Accel-Buffering: no\r\n\r\n")
+            writer.write(b"retry: %d\n\n" % RETRY_DELAY)
+            # Position of the stream when subscribing: the lines before are
+            # read back from the log file, the next ones are broadcast.
+            (end_line, end_offset) = (line, None)
+            if job_id in self.streams:
+                (end_line, end_offset) = (self.streams[job_id].line, self.streams[job_id].offset)
+            client = Client(writer, line, self.options["queue_size"])
+            stream = self.subscribe(job_id, filename, related, client)
+            if status.get("X-JobState"):
+                stream.finished = True
+            client.write(("status", status))
+
+            # Send the lines that the stream has already read or is reading.
+            # When the stream does not know the offset yet, read up to the
+            # end of the file: the lines also read by the stream are skipped.
+            if client.line < end_line:
+                (lines, start, end) = await self.run(self.read_lines, job_id, filename,
+                                                     client.line, None, end_offset)
+                if end is not None:
+                    client.write(("log", client.line, start, end, lines))
+
+            await self.forward(client)
+        except ConnectionError:
+            pass
+        finally:
+            if stream is not None:
+                stream.clients.discard(client)
+            writer.close()
+
+    async def forward(self, client):
+        while True:
+            await client.writer.drain()
+            try:
+                event = await asyncio.wait_for(client.queue.get(), self.options["keepalive"])
+            except asyncio.TimeoutError:
+                client.writer.write(b": keepalive\n\n")
+                continue
+            if event is None:
+                self.logger.warning("Connection too slow, closing")
+                OVERFLOWS.inc()
+                return
+            client.write(event)
+            if event[0] in ["end", "failed"]:
+                await client.writer.drain()
+                return
@@ -22,8 +22,9 @@
 
 import logging
 import os
+import shutil
+import tempfile
 import time
-import yaml
 import zmq
 import zmq.auth
 from zmq.utils.strtypes import u
@@ -32,8 +33,10 @@ from zmq.auth.thread import ThreadAuthenticator
 from django.db import connection, transaction
 from django.db.utils import OperationalError, InterfaceError
 
-from lava_results_app.models import TestCase
+from lava_results_app.models import LavaResult, MeasurementPoint, TestCase, TestSuite
+from lava_server import metrics
 from lava_server.cmdutils import LAVADaemonCommand, watch_directory
+from lava_scheduler_app.logutils import LogMessageError, parse_log_message
 from lava_scheduler_app.models import TestJob
 from lava_scheduler_app.utils import mkdir
 from lava_results_app.dbutils import map_scanned_results, create_metadata_store
@@ -41,24 +44,42 @@ from lava_results_app.dbutils import map_scanned_results, create_metadata_store
 
 # Constants
 FORMAT = "%(asctime)-15s %(levelname)7s %(message)s"
+SHARD_FORMAT = "%%(asctime)-15s %%(levelname)7s [shard %d] %%(message)s"
 TIMEOUT = 10
 BULK_CREATE_TIMEOUT = 10
 FD_TIMEOUT = 60
 
+# Metrics
+MESSAGES = metrics.counter("lava_logs_messages_total", "Log messages received", ["level"])
+INVALID_MESSAGES = metrics.counter("lava_logs_invalid_messages_total", "Log messages dropped")
+FORWARDED = metrics.counter("lava_logs_forwarded_total",
+                            "Log messages forwarded by the router", ["shard"])
+BULK_CREATE = metrics.histogram("lava_logs_bulk_create_seconds",
+                                "Time spent saving the buffered test cases")
+TEST_CASES = metrics.gauge("lava_logs_test_cases_buffered", "Test cases waiting to be saved")
+OPEN_FILES = metrics.gauge("lava_logs_open_files", "Log files currently open")
+JOB_RATE = metrics.histogram("lava_logs_job_messages_per_second",
+                             "Log messages per second of each job, measured when its log file is closed",
+                             buckets=(1, 5, 10, 50, 100, 500, 1000, 5000))
+
 
 class JobHandler(object):  # pylint: disable=too-few-public-methods
     def __init__(self, job):
         self.output_dir = job.output_dir
         self.output = open(os.path.join(self.output_dir, 'output.yaml'), 'a+')
-        self.last_usage = time.time()
+        self.opened = self.last_usage = time.time()
+        self.messages = 0
 
     def write(self, message):
         self.output.write(message)
         self.output.write('\n')
         self.output.flush()
+        self.messages += 1
 
     def close(self):
         self.output.close()
+        if self.last_usage > self.opened:
+            JOB_RATE.observe(self.messages / (self.last_usage - self.opened))
 
 
 class Command(LAVADaemonCommand):
@@ -76,6 +97,11 @@ class Command(LAVADaemonCommand):
         self.pipe_r = None
         self.poller = None
         self.cert_dir_path = None
+        # Sharding: index of this shard and pid of the router
+        self.shards = 1
+        self.shard = None
+        self.router_pid = None
+        self.stopped = False
         # List of logs
         self.jobs = {}
         # Keep test cases in memory
@@ -105,6 +131,12 @@ class Command(LAVADaemonCommand):
                          default='/etc/lava-dispatcher/certificates.d',
                          help="Directory for slaves certificates")
 
+        shards = parser.add_argument_group("shards")
+        shards.add_argument('--shards', default=1, type=int,
+                            help="Number of processes recording the logs. "
+                                 "The logs of a job are handled by the shard "
+                                 "'job id modulo shards'. Default: 1")
+
     def handle(self, *args, **options):
         # Initialize logging.
         self.setup_logging("lava-logs", options["level"],
@@ -115,11 +147,50 @@ class Command(LAVADaemonCommand):
             self.logger.error("[INIT] Unable to drop privileges")
             return
 
+        if options["shards"] < 1:
+            self.logger.error("[INIT] The number of shards should be a positive integer")
+            return
+        self.shards = options["shards"]
+        if self.shards > 1:
+            self.handle_router(options)
+        else:
+            self.handle_logs(options, options["socket"], b"lava-logs")
+
+    def start_authenticator(self, context, options):
+        """
+        Start the authenticator thread and return the master keys
+        """
+        self.logger.info("[INIT] Starting encryption")
+        try:
+            self.auth = ThreadAuthenticator(context)
+            self.auth.start()
+            self.logger.debug("[INIT] Opening master certificate: %s", options['master_cert'])
+            master_public, master_secret = zmq.auth.load_certificate(options['master_cert'])
+            self.logger.debug("[INIT] Using slaves certificates from: %s", options['slaves_certs'])
+            self.auth.configure_curve(domain='*', location=options['slaves_certs'])
+        except IOError as err:
+            self.logger.error("[INIT] %s", err)
+            self.auth.stop()
+            return None
+        return (master_public, master_secret)
+
+    def watch_certificates(self, options):
+        self.logger.debug("[INIT] Watching %s", options["slaves_certs"])
+        self.cert_dir_path = options["slaves_certs"]
+        self.inotify_fd = watch_directory(options["slaves_certs"])
+        if self.inotify_fd is None:
+            self.logger.error("[INIT] Unable to start inotify")
+
+    def handle_logs(self, options, socket, identity):
+        self.setup_metrics(options, self.shard)
+        OPEN_FILES.set_function(lambda: len(self.jobs))
+        TEST_CASES.set_function(lambda: len(self.test_cases))
+
         # Create the sockets
         context = zmq.Context()
         self.log_socket = context.socket(zmq.PULL)
         self.controler = context.socket(zmq.ROUTER)
-        self.controler.setsockopt(zmq.IDENTITY, b"lava-logs")
+        self.controler.setsockopt(zmq.IDENTITY, identity)
         # Limit the number of messages in the queue
         self.controler.setsockopt(zmq.SNDHWM, 2)
         # From http://api.zeromq.org/4-2:zmq-setsockopt#toc5
@@ -132,32 +203,26 @@ class Command(LAVADaemonCommand):
             self.controler.setsockopt(zmq.IPV6, 1)
 
         if options['encrypt']:
-            self.logger.info("[INIT] Starting encryption")
-            try:
-                self.auth = ThreadAuthenticator(context)
-                self.auth.start()
-                self.logger.debug("[INIT] Opening master certificate: %s", options['master_cert'])
-                master_public, master_secret = zmq.auth.load_certificate(options['master_cert'])
-                self.logger.debug("[INIT] Using slaves certificates from: %s", options['slaves_certs'])
-                self.auth.configure_curve(domain='*', location=options['slaves_certs'])
-            except IOError as err:
-                self.logger.error("[INIT] %s", err)
-                self.auth.stop()
-                return
-            self.log_socket.curve_publickey = master_public
-            self.log_socket.curve_secretkey = master_secret
-            self.log_socket.curve_server = True
+            if self.shard is None:
+                keys = self.start_authenticator(context, options)
+                if keys is None:
+                    return
+                (master_public, master_secret) = keys
+                self.log_socket.curve_publickey = master_public
+                self.log_socket.curve_secretkey = master_secret
+                self.log_socket.curve_server = True
+            else:
+                # Shards receive the logs from the router on a local socket:
+                # only the connection to the master is encrypted.
+                (master_public, master_secret) = zmq.auth.load_certificate(options['master_cert'])
             self.controler.curve_publickey = master_public
             self.controler.curve_secretkey = master_secret
             self.controler.curve_serverkey = master_public
 
-        self.logger.debug("[INIT] Watching %s", options["slaves_certs"])
-        self.cert_dir_path = options["slaves_certs"]
-        self.inotify_fd = watch_directory(options["slaves_certs"])
-        if self.inotify_fd is None:
-            self.logger.error("[INIT] Unable to start inotify")
+        if self.shard is None:
+            self.watch_certificates(options)
 
-        self.log_socket.bind(options['socket'])
+        self.log_socket.bind(socket)
         self.controler.connect(options['master_socket'])
 
         # Poll on the sockets. This allow to have a
@@ -166,7 +231,7 @@ class Command(LAVADaemonCommand):
         self.poller.register(self.log_socket, zmq.POLLIN)
         self.poller.register(self.controler, zmq.POLLIN)
         if self.inotify_fd is not None:
-            self.poller.register(os.fdopen(self.inotify_fd), zmq.POLLIN)
+            self.poller.register(self.inotify_fd, zmq.POLLIN)
 
         # Translate signals into zmq messages
         (self.pipe_r, _) = self.setup_zmq_signal_handler()
@@ -175,7 +240,7 @@ class Command(LAVADaemonCommand):
         self.logger.info("[INIT] listening for logs")
         # PING right now: the master is waiting for this message to start
         # scheduling.
-        self.controler.send_multipart([b"master", b"PING"])
+        self.ping()
 
         try:
             self.main_loop()
@@ -188,14 +253,16 @@ class Command(LAVADaemonCommand):
         self.poller.unregister(self.controler)
 
         # Carefully close the logging socket as we don't want to lose messages
-        self.logger.info("[EXIT] Disconnect logging socket and process messages")
-        endpoint = u(self.log_socket.getsockopt(zmq.LAST_ENDPOINT))
-        self.logger.debug("[EXIT] unbinding from '%s'", endpoint)
-        self.log_socket.unbind(endpoint)
+        # Shards do not have to: the router sends STOP after the last message.
+        if self.shard is None:
+            self.logger.info("[EXIT] Disconnect logging socket and process messages")
+            endpoint = u(self.log_socket.getsockopt(zmq.LAST_ENDPOINT))
+            self.logger.debug("[EXIT] unbinding from '%s'", endpoint)
+            self.log_socket.unbind(endpoint)
 
         # Empty the queue
         try:
-            while self.wait_for_messages(True):
+            while self.shard is None and self.wait_for_messages(True):
                 # Flush test cases cache for every iteration because we might
                 # get killed soon.
                 self.flush_test_cases()
@@ -207,14 +274,174 @@ class Command(LAVADaemonCommand):
             self.flush_test_cases()
             self.logger.info("[EXIT] Closing the logging socket: the queue is empty")
             self.log_socket.close()
-            if options['encrypt']:
+            if self.auth is not None:
                 self.auth.stop()
             context.term()
 
+    def handle_router(self, options):
+        """
+        Fork the shards and forward every log message to the shard owning
+        the job.
+        """
+        ipc_dir = tempfile.mkdtemp(prefix="lava-logs-")
+        endpoints = ["ipc://%s" % os.path.join(ipc_dir, "shard-%d" % index)
+                     for index in range(self.shards)]
+
+        # Fork before creating any zmq context or database connection as they
+        # cannot be shared among processes.
+        connection.close()
+        pids = []
+        for index in range(self.shards):
+            pid = os.fork()
+            if pid == 0:
+                self.shard = index
+                self.router_pid = os.getppid()
+                for handler in self.logger.handlers:
+                    handler.setFormatter(logging.Formatter(SHARD_FORMAT % index))
+                status = 0
+                try:
+                    self.handle_logs(options, endpoints[index],
+                                     ("lava-logs.%d" % index).encode("utf-8"))
+                except BaseException as exc:
+                    self.logger.exception(exc)
+                    status = 1
+                finally:
+                    os._exit(status)  # pylint: disable=protected-access
+            pids.append(pid)
+        self.logger.info("[INIT] Started %d shards", self.shards)
+        self.setup_metrics(options)
+
+        try:
+            self.route(options, endpoints, pids)
+        finally:
+            shutil.rmtree(ipc_dir, ignore_errors=True)
+
+    def route(self, options, endpoints, pids):
+        context = zmq.Context()
+        self.log_socket = context.socket(zmq.PULL)
+        outputs = []
+        for endpoint in endpoints:
+            sock = context.socket(zmq.PUSH)
+            sock.setsockopt(zmq.LINGER, TIMEOUT * 1000)
+            sock.connect(endpoint)
+            outputs.append(sock)
+
+        if options['ipv6']:
+            self.logger.info("[INIT] Enabling IPv6")
+            self.log_socket.setsockopt(zmq.IPV6, 1)
+
+        if options['encrypt']:
+            keys = self.start_authenticator(context, options)
+            if keys is None:
+                return
+            (self.log_socket.curve_publickey, self.log_socket.curve_secretkey) = keys
+            self.log_socket.curve_server = True
+        self.watch_certificates(options)
+
+        self.log_socket.bind(options['socket'])
+
+        self.poller = zmq.Poller()
+        self.poller.register(self.log_socket, zmq.POLLIN)
+        if self.inotify_fd is not None:
+            self.poller.register(self.inotify_fd, zmq.POLLIN)
+        (self.pipe_r, _) = self.setup_zmq_signal_handler()
+        self.poller.register(self.pipe_r, zmq.POLLIN)
+
+        self.logger.info("[INIT] routing logs to %d shards", len(outputs))
+        try:
+            while True:
+                try:
+                    sockets = dict(self.poller.poll(TIMEOUT * 1000))
+                except zmq.error.ZMQError as exc:
+                    self.logger.error("[POLL] zmq error: %s", str(exc))
+                    continue
+
+                if sockets.get(self.log_socket) == zmq.POLLIN:
+                    self.forward(outputs)
+
+                if sockets.get(self.pipe_r) == zmq.POLLIN:
+                    os.read(self.pipe_r, 1)
+                    self.logger.info("[POLL] received a signal, leaving")
+                    break
+
+                if sockets.get(self.inotify_fd) == zmq.POLLIN:
+                    os.read(self.inotify_fd, 4096)
+                    if self.auth is not None:
+                        self.logger.debug("[AUTH] Reloading certificates from %s",
+                                          self.cert_dir_path)
+                        self.auth.configure_curve(domain='*',
+                                                  location=self.cert_dir_path)
+
+                (pid, _) = os.waitpid(-1, os.WNOHANG)
+                if pid:
+                    self.logger.error("[POLL] shard %d died, leaving", pids.index(pid))
+                    pids.remove(pid)
+                    break
+        except BaseException as exc:
+            self.logger.error("[EXIT] Unknown exception raised, leaving!")
+            self.logger.exception(exc)
+
+        # Forward the remaining messages before stopping the shards
+        self.logger.info("[EXIT] Disconnect logging socket and forward messages")
+        endpoint = u(self.log_socket.getsockopt(zmq.LAST_ENDPOINT))
+        self.log_socket.unbind(endpoint)
+        try:
+            while self.log_socket.poll(TIMEOUT * 1000):
+                self.forward(outputs)
+        except BaseException as exc:
+            self.logger.error("[EXIT] Unknown exception raised, leaving!")
+            self.logger.exception(exc)
+        finally:
+            self.logger.info("[EXIT] Stopping the shards")
+            for sock in outputs:
+                sock.send_multipart([b"STOP"])
+                sock.close()
+            self.log_socket.close()
+            for pid in pids:
+                os.waitpid(pid, 0)
+            if self.auth is not None:
+                self.auth.stop()
+            context.term()
+
+    def forward(self, outputs):
+        """
+        Forward the pending messages without decoding them
+        """
+        forwarded = [FORWARDED.labels(index) for index in range(len(outputs))]
+        while True:
+            try:
+                msg = self.log_socket.recv_multipart(zmq.NOBLOCK, copy=False)
+            except zmq.error.Again:
+                return
+            try:
+                index = int(msg[0].bytes) % len(outputs)
+            except (IndexError, ValueError):
+                self.logger.error("[POLL] invalid job id, skipping: %s", [m.bytes for m in msg])
+                INVALID_MESSAGES.inc()
+                continue
+            outputs[index].send_multipart(msg, copy=False)
+            forwarded[index].inc()
+
+    def ping(self):
+        if self.shard is None:
+            self.controler.send_multipart([b"master", b"PING"])
+        else:
+            # Let the master know how many shards should be alive
+            self.controler.send_multipart([b"master", b"PING", str(self.shards).encode("utf-8")])
+
     def flush_test_cases(self):
         if self.test_cases:
             self.logger.info("Saving %d test cases", len(self.test_cases))
-            TestCase.objects.bulk_create(self.test_cases)
+            with BULK_CREATE.time():
+                with transaction.atomic():
+                    TestCase.objects.bulk_create(self.test_cases)
+                    TestSuite.update_counters(self.test_cases)
+                    LavaResult.index(self.test_cases)
+                    # The job may already be finished (by lava-master)
+                    job_ids = set(test_case.suite.job_id for test_case in self.test_cases
+                                  if test_case.measurement is not None)
+                    if job_ids:
+                        MeasurementPoint.append(job_ids)
             self.test_cases = []
 
     def main_loop(self):
@@ -245,7 +472,12 @@ class Command(LAVADaemonCommand):
             if now - self.last_ping > self.ping_interval:
                 self.logger.debug("PING => master")
                 self.last_ping = now
-                self.controler.send_multipart([b"master", b"PING"])
+                self.ping()
+
+            # Leave if the router died
+            if self.router_pid is not None and os.getppid() != self.router_pid:
+                self.logger.error("[POLL] the router died, leaving")
+                break
 
     def wait_for_messages(self, leaving):
         try:
@@ -258,14 +490,18 @@ class Command(LAVADaemonCommand):
             # Messages
             if sockets.get(self.log_socket) == zmq.POLLIN:
                 self.logging_socket()
-                return True
+                return not self.stopped
 
             # Signals
             elif sockets.get(self.pipe_r) == zmq.POLLIN:
                 # remove the message from the queue
                 os.read(self.pipe_r, 1)
 
-                if not leaving:
+                if self.shard is not None:
+                    # Wait for the router to forward the remaining messages
+                    self.logger.info("[POLL] received a signal, waiting for the router")
+                    return True
+                elif not leaving:
                     self.logger.info("[POLL] received a signal, leaving")
                     return False
                 else:
@@ -296,31 +532,23 @@ class Command(LAVADaemonCommand):
 
     def logging_socket(self):
         msg = self.log_socket.recv_multipart()
-        try:
-            (job_id, message) = (u(m) for m in msg)  # pylint: disable=unbalanced-tuple-unpacking
-        except ValueError:
-            # do not let a bad message stop the master.
-            self.logger.error("[POLL] failed to parse log message, skipping: %s", msg)
-            return
-
-        try:
-            scanned = yaml.load(message, Loader=yaml.CLoader)
-        except yaml.YAMLError:
-            self.logger.error("[%s] data are not valid YAML, dropping", job_id)
+        if self.shard is not None and msg == [b"STOP"]:
+            self.logger.info("[POLL] the router is leaving")
+            self.stopped = True
             return
 
-        # Look for "results" level
         try:
-            message_lvl = scanned["lvl"]
-            message_msg = scanned["msg"]
-        except TypeError:
-            self.logger.error("[%s] not a dictionary, dropping", job_id)
+            (job_id, message_lvl, message_msg, line) = parse_log_message(msg)
+        except LogMessageError as exc:
+            # do not let a bad message stop the master.
+            self.logger.warning("[POLL] failed to parse log message (%s), skipping: %s", exc, msg)
+            INVALID_MESSAGES.inc()
             return
-        except KeyError:
-            self.logger.error(
-                "[%s] invalid log line, missing \"lvl\" or \"msg\" keys: %s",
-                job_id, message)
+        except ValueError:
+            self.logger.error("[POLL] failed to parse log message, skipping: %s", msg)
+            INVALID_MESSAGES.inc()
             return
+        MESSAGES.labels(message_lvl).inc()
 
         # Find the handler (if available)
         if job_id not in self.jobs:
@@ -348,7 +576,7 @@ class Command(LAVADaemonCommand):
             if new_test_case is None:
                 self.logger.warning(
                     "[%s] unable to map scanned results: %s",
-                    job_id, message)
+                    job_id, line)
             else:
                 self.test_cases.append(new_test_case)
 
@@ -383,11 +611,8 @@ class Command(LAVADaemonCommand):
         self.jobs[job_id].last_usage = time.time()
 
         # n.b. logging here would produce a log entry for every message in every job.
-        # The format is a list of dictionaries
-        message = "- %s" % message
-
-        # Write data
-        self.jobs[job_id].write(message)
+        # Write data: the format is a list of dictionaries
+        self.jobs[job_id].write(line)
 
     def controler_socket(self):
         msg = self.controler.recv_multipart()
@@ -28,7 +28,7 @@ import jinja2
 import simplejson
 import lzma
 import os
-import shutil
+import signal
 import sys
 import time
 import yaml
@@ -42,12 +42,15 @@ from django.db import connection, transaction
 from django.db.utils import OperationalError, InterfaceError
 from django.utils import timezone
 
-from lava_results_app.models import TestCase, TestSuite
+from lava_results_app.models import LavaResult, TestCase, TestSuite
+from lava_results_app.utils import convert_description
 from lava_scheduler_app.dbutils import parse_job_description
 from lava_scheduler_app.models import TestJob, Worker
 from lava_scheduler_app.scheduler import schedule
 from lava_scheduler_app.utils import mkdir
+from lava_server import metrics
 from lava_server.cmdutils import LAVADaemonCommand, watch_directory
+from lava_server.tracing import TRACER
 
 if sys.version_info[0] == 2:
     from lzma import error as LZMAError
@@ -71,6 +74,16 @@ SCHEDULE_INTERVAL = 20
 # Log format
 FORMAT = '%(asctime)-15s %(levelname)7s %(message)s'
 
+# Metrics
+MESSAGES = metrics.counter("lava_master_messages_total",
+                           "Messages received from the dispatchers", ["action"])
+EVENTS = metrics.counter("lava_master_events_total", "Events received from lava-publisher")
+LOOP_DURATION = metrics.histogram("lava_master_loop_seconds",
+                                  "Time spent handling one poll loop iteration")
+START_DURATION = metrics.histogram("lava_master_start_jobs_seconds",
+                                   "Time spent starting the scheduled jobs")
+DISPATCHERS_ONLINE = metrics.gauge("lava_master_dispatchers_online", "Online dispatchers")
+
 
 @contextmanager
 def suppress(kls):
@@ -129,6 +142,23 @@ class SlaveDispatcher(object):  # pylint: disable=too-few-public-methods
                 worker.save()
 
 
+class LogsShard(SlaveDispatcher):  # pylint: disable=too-few-public-methods
+    """
+    A lava-logs shard. Shards are not workers, only track their liveness.
+    """
+
+    def alive(self):
+        self.last_msg = time.time()
+        self.online = True
+
+    def go_offline(self):
+        self.online = False
+
+
+def is_lava_logs(hostname):
+    return hostname == "lava-logs" or hostname.startswith("lava-logs.")
+
+
 def load_optional_yaml_file(filename):
     """
     Returns the string after checking for YAML errors which would cause issues later.
@@ -150,6 +180,47 @@ def load_optional_yaml_file(filename):
         raise IOError("", "Not a valid YAML file", filename)
 
 
+class ConfigCache(object):
+    """
+    Keep the content of the optional yaml files in memory.
+
+    The directories holding the files are watched with inotify and every
+    cached file of a directory is dropped when this directory changes. Files
+    from directories that cannot be watched are read each time.
+    """
+
+    def __init__(self):
+        self.files = {}
+        self.directories = {}
+
+    def watch(self, directory):
+        """
+        Watch the given directory and return the inotify file descriptor,
+        or None if the directory cannot be watched.
+        """
+        directory = os.path.abspath(directory)
+        if directory not in self.directories:
+            self.directories[directory] = watch_directory(directory)
+        return self.directories[directory]
+
+    def load(self, filename):
+        filename = os.path.abspath(filename)
+        if self.directories.get(os.path.dirname(filename)) is None:
+            return load_optional_yaml_file(filename)
+        if filename not in self.files:
+            self.files[filename] = load_optional_yaml_file(filename)
+        return self.files[filename]
+
+    def invalidate(self, inotify_fd):
+        os.read(inotify_fd, 4096)
+        for directory, fd in self.directories.items():
+            if fd != inotify_fd:
+                continue
+            for filename in list(self.files.keys()):
+                if os.path.dirname(filename) == directory:
+                    del self.files[filename]
+
+
 class Command(LAVADaemonCommand):
     """
     worker_host is the hostname of the worker this field is set by the admin
@@ -167,10 +238,13 @@ class Command(LAVADaemonCommand):
         self.poller = None
         self.pipe_r = None
         self.inotify_fd = None
+        self.config = ConfigCache()
         # List of logs
         # List of known dispatchers. At startup do not load this from the
         # database. This will help to know if the slave as restarted or not.
         self.dispatchers = {"lava-logs": SlaveDispatcher("lava-logs", online=False)}
+        # Number of lava-logs shards (0 when lava-logs is not sharded)
+        self.logs_shards = 0
         self.events = {"canceling": set()}
 
     def add_arguments(self, parser):
@@ -207,6 +281,15 @@ class Command(LAVADaemonCommand):
                          default='/etc/lava-dispatcher/certificates.d',
                          help="Directory for slaves certificates")
 
+        trace = parser.add_argument_group("tracing")
+        trace.add_argument('--trace-passes', default=0, type=int,
+                           help="Trace the scheduling passes and keep the last "
+                                "ones in memory. Default: 0 (disabled)")
+        trace.add_argument('--trace-file',
+                           default="/var/log/lava-server/lava-master-trace.json",
+                           help="Dump the traces in this file on SIGUSR1. "
+                                "Default: /var/log/lava-server/lava-master-trace.json")
+
     def send_status(self, hostname):
         """
         The master crashed, send a STATUS message to get the current state of jobs
@@ -245,11 +328,13 @@ class Command(LAVADaemonCommand):
         action = u(msg[1])
 
         # Check that lava-logs only send PINGs
-        if hostname == "lava-logs" and action != "PING":
+        if is_lava_logs(hostname) and action != "PING":
             self.logger.error("%s => %s Invalid action from log daemon",
                               hostname, action)
             return True
 
+        MESSAGES.labels(action if action in ["HELLO", "HELLO_RETRY", "PING", "END", "START_OK"] else "unknown").inc()
+
         # Handle the actions
         if action == 'HELLO' or action == 'HELLO_RETRY':
             self._handle_hello(hostname, action, msg)
@@ -270,6 +355,7 @@ class Command(LAVADaemonCommand):
         except zmq.error.Again:
             return False
 
+        EVENTS.inc()
         try:
             (topic, _, dt, username, data) = (u(m) for m in msg)
         except ValueError:
@@ -335,6 +421,8 @@ class Command(LAVADaemonCommand):
                     f_description.write(description.decode("utf-8"))
                 if description:
                     parse_job_description(job)
+                    # Faster to load in the job views
+                    convert_description(job)
             except (IOError, LZMAError) as exc:
                 self.logger.error("[%d] Unable to dump 'description.yaml'",
                                   job_id)
@@ -381,6 +469,18 @@ class Command(LAVADaemonCommand):
 
     def _handle_ping(self, hostname, action, msg):  # pylint: disable=unused-argument
         self.logger.debug("%s => PING(%d)", hostname, PING_INTERVAL)
+        if hostname == "lava-logs":
+            self.logs_shards = 0
+        elif is_lava_logs(hostname):
+            # lava-logs shards send the number of shards
+            try:
+                self.logs_shards = int(msg[2])
+            except (IndexError, ValueError):
+                self.logger.error("%s => PING Invalid number of shards", hostname)
+                return
+            if hostname not in self.dispatchers:
+                self.logger.info("New lava-logs shard <%s>", hostname)
+                self.dispatchers[hostname] = LogsShard(hostname)
         # Send back a signal
         send_multipart_u(self.controler, [hostname, 'PONG', str(PING_INTERVAL)])
         self.dispatcher_alive(hostname)
@@ -411,46 +511,50 @@ class Command(LAVADaemonCommand):
         # no need for the dispatcher to retain comments
         return yaml.dump(job_def)
 
-    def save_job_config(self, job, worker, device_cfg, options):
+    def save_job_config(self, job, device_cfg, dispatcher_cfg, env_str, env_dut_str):
         output_dir = job.output_dir
         mkdir(output_dir)
         with open(os.path.join(output_dir, "job.yaml"), "w") as f_out:
             f_out.write(self.export_definition(job))
-        with suppress(IOError):
-            shutil.copy(options["env"], os.path.join(output_dir, "env.yaml"))
-        with suppress(IOError):
-            shutil.copy(options["env_dut"], os.path.join(output_dir, "env.dut.yaml"))
-        with suppress(IOError):
-            shutil.copy(os.path.join(options["dispatchers_config"], "%s.yaml" % worker.hostname),
-                        os.path.join(output_dir, "dispatcher.yaml"))
+        # Missing configuration files are loaded as empty strings
+        for (filename, content) in [("env.yaml", env_str),
+                                    ("env.dut.yaml", env_dut_str),
+                                    ("dispatcher.yaml", dispatcher_cfg)]:
+            if content:
+                with suppress(IOError), open(os.path.join(output_dir, filename), "w") as f_out:
+                    f_out.write(content)
         with open(os.path.join(output_dir, "device.yaml"), "w") as f_out:
             yaml.dump(device_cfg, f_out)
 
     def start_job(self, job, options):
         # Load job definition to get the variables for template
         # rendering
-        job_def = yaml.load(job.definition)
+        with TRACER.span("yaml parsing"):
+            job_def = yaml.load(job.definition)
         job_ctx = job_def.get('context', {})
 
         device = job.actual_device
         worker = device.worker_host
 
         # Load configurations
-        env_str = load_optional_yaml_file(options['env'])
-        env_dut_str = load_optional_yaml_file(options['env_dut'])
-        device_cfg = device.load_configuration(job_ctx)
-        dispatcher_cfg_file = os.path.join(options['dispatchers_config'],
-                                           "%s.yaml" % worker.hostname)
-        dispatcher_cfg = load_optional_yaml_file(dispatcher_cfg_file)
-
-        self.save_job_config(job, worker, device_cfg, options)
+        with TRACER.span("configuration"):
+            env_str = self.config.load(options['env'])
+            env_dut_str = self.config.load(options['env_dut'])
+            device_cfg = device.load_configuration(job_ctx)
+            dispatcher_cfg_file = os.path.join(options['dispatchers_config'],
+                                               "%s.yaml" % worker.hostname)
+            dispatcher_cfg = self.config.load(dispatcher_cfg_file)
+
+        with TRACER.span("save configuration"):
+            self.save_job_config(job, device_cfg, dispatcher_cfg, env_str, env_dut_str)
         self.logger.info("[%d] START => %s (%s)", job.id,
                          worker.hostname, device.hostname)
-        send_multipart_u(self.controler,
-                         [worker.hostname, 'START', str(job.id),
-                          self.export_definition(job),
-                          yaml.dump(device_cfg),
-                          dispatcher_cfg, env_str, env_dut_str])
+        with TRACER.span("send"):
+            send_multipart_u(self.controler,
+                             [worker.hostname, 'START', str(job.id),
+                              self.export_definition(job),
+                              yaml.dump(device_cfg),
+                              dispatcher_cfg, env_str, env_dut_str])
 
         # For multinode jobs, start the dynamic connections
         parent = job
@@ -462,7 +566,8 @@ class Command(LAVADaemonCommand):
             self.logger.info("[%d] Trimming dynamic connection device configuration.", sub_job.id)
             min_device_cfg = parent.actual_device.minimise_configuration(device_cfg)
 
-            self.save_job_config(sub_job, worker, min_device_cfg, options)
+            self.save_job_config(sub_job, min_device_cfg, dispatcher_cfg,
+                                 env_str, env_dut_str)
             self.logger.info("[%d] START => %s (connection)",
                              sub_job.id, worker.hostname)
             send_multipart_u(self.controler,
@@ -472,6 +577,18 @@ class Command(LAVADaemonCommand):
                               yaml.dump(min_device_cfg), dispatcher_cfg,
                               env_str, env_dut_str])
 
+    def logs_online(self):
+        """
+        Is lava-logs or every lava-logs shard online?
+        """
+        if not self.logs_shards:
+            return self.dispatchers["lava-logs"].online
+        for index in range(self.logs_shards):
+            shard = self.dispatchers.get("lava-logs.%d" % index)
+            if shard is None or not shard.online:
+                return False
+        return True
+
     def start_jobs(self, options):
         """
         Loop on all scheduled jobs and send the START message to the slave.
@@ -487,11 +604,19 @@ class Command(LAVADaemonCommand):
         query = query.exclude(actual_device=None)
         # TODO: find a way to lock actual_device
 
+        with TRACER.span("job queryset"):
+            jobs = list(query)
+
         # Loop on all jobs
-        for job in query:
+        for job in jobs:
             msg = None
             try:
-                self.start_job(job, options)
+                # The device type name is the primary key: the spans are
+                # labelled like the scheduler ones without loading the
+                # device type.
+                with TRACER.span("start job", job=job.id,
+                                 device_type=job.requested_device_type_id):
+                    self.start_job(job, options)
             except jinja2.TemplateNotFound as exc:
                 self.logger.error("[%d] Template not found: '%s'",
                                   job.id, exc.message)
@@ -517,11 +642,24 @@ class Command(LAVADaemonCommand):
                             "error_msg": msg,
                             "result": "fail"}
                 suite, _ = TestSuite.objects.get_or_create(name="lava", job=job)
-                TestCase.objects.create(name="job", suite=suite, result=TestCase.RESULT_FAIL,
-                                        metadata=yaml.dump(metadata))
+                test_case = TestCase.objects.create(name="job", suite=suite, result=TestCase.RESULT_FAIL,
+                                                    metadata_json=metadata)
+                TestSuite.update_counters([test_case])
+                LavaResult.index([test_case])
                 job.go_state_finished(TestJob.HEALTH_INCOMPLETE, True)
                 job.save()
 
+    def dump_traces(self, options):
+        if not TRACER.enabled:
+            self.logger.warning("[TRACE] Tracing is disabled, use --trace-passes")
+            return
+        self.logger.info("[TRACE] Dumping %d passes in %s",
+                         len(TRACER.passes), options["trace_file"])
+        try:
+            TRACER.write(options["trace_file"])
+        except IOError as exc:
+            self.logger.error("[TRACE] Unable to dump the traces: %s", exc)
+
     def cancel_jobs(self, partial=False):
         query = TestJob.objects.filter(state=TestJob.STATE_CANCELING)
         if partial:
@@ -544,6 +682,14 @@ class Command(LAVADaemonCommand):
             self.logger.error("[INIT] Unable to drop privileges")
             return
 
+        self.setup_metrics(options)
+        if options["trace_passes"] > 0:
+            self.logger.info("[INIT] Tracing the last %d passes, dumped in %s on SIGUSR1",
+                             options["trace_passes"], options["trace_file"])
+            TRACER.enable(options["trace_passes"])
+        DISPATCHERS_ONLINE.set_function(
+            lambda: len([d for d in list(self.dispatchers.values()) if d.online]))
+
         self.logger.info("[INIT] Marking all workers as offline")
         with transaction.atomic():
             for worker in Worker.objects.select_for_update().all():
@@ -599,11 +745,24 @@ class Command(LAVADaemonCommand):
         self.poller.register(self.controler, zmq.POLLIN)
         self.poller.register(self.event_socket, zmq.POLLIN)
         if self.inotify_fd is not None:
-            self.poller.register(os.fdopen(self.inotify_fd), zmq.POLLIN)
+            self.poller.register(self.inotify_fd, zmq.POLLIN)
+
+        # Watch the dispatcher configuration files
+        for directory in set([os.path.dirname(options["env"]),
+                              os.path.dirname(options["env_dut"]),
+                              options["dispatchers_config"]]):
+            self.logger.debug("[INIT] Watching %s", directory)
+            config_fd = self.config.watch(directory)
+            if config_fd is None:
+                self.logger.warning("[INIT] Unable to watch %s: configuration files won't be cached", directory)
+            else:
+                self.poller.register(config_fd, zmq.POLLIN)
 
         # Translate signals into zmq messages
-        (self.pipe_r, _) = self.setup_zmq_signal_handler()
+        (self.pipe_r, pipe_w) = self.setup_zmq_signal_handler()
         self.poller.register(self.pipe_r, zmq.POLLIN)
+        # SIGUSR1 dumps the traces instead of stopping the daemon
+        signal.signal(signal.SIGUSR1, lambda signum, _: os.write(pipe_w, chr(signum).encode("utf-8")))
 
         self.logger.info("[INIT] LAVA master has started.")
         self.logger.info("[INIT] Using protocol version %d", PROTOCOL_VERSION)
@@ -624,6 +783,7 @@ class Command(LAVADaemonCommand):
 
     def main_loop(self, options):
         last_schedule = last_dispatcher_check = time.time()
+        loop_start = None
 
         while True:
             try:
@@ -637,13 +797,21 @@ class Command(LAVADaemonCommand):
                         timeout = min(timeout, 1)
                     # Wait at least for 1ms
                     timeout = max(timeout * 1000, 1)
+                    poll_start = time.time()
 
                     # Wait for data or a timeout
                     sockets = dict(self.poller.poll(timeout))
+                    # Time spent handling the previous iteration
+                    if loop_start is not None:
+                        LOOP_DURATION.observe(poll_start - loop_start)
+                    loop_start = time.time()
                 except zmq.error.ZMQError:
                     continue
 
                 if sockets.get(self.pipe_r) == zmq.POLLIN:
+                    if ord(os.read(self.pipe_r, 1)) == signal.SIGUSR1:
+                        self.dump_traces(options)
+                        continue
                     self.logger.info("[POLL] Received a signal, leaving")
                     break
 
@@ -671,13 +839,19 @@ class Command(LAVADaemonCommand):
                                       options['slaves_certs'])
                     self.auth.configure_curve(domain='*', location=options['slaves_certs'])
 
+                # Configuration files
+                for config_fd in set(self.config.directories.values()):
+                    if config_fd is not None and sockets.get(config_fd) == zmq.POLLIN:
+                        self.logger.debug("[CONFIG] Configuration files changed, dropping the cache")
+                        self.config.invalidate(config_fd)
+
                 # Check dispatchers status
                 now = time.time()
                 if now - last_dispatcher_check > PING_INTERVAL:
                     for hostname, dispatcher in self.dispatchers.items():
                         if dispatcher.online and now - dispatcher.last_msg > DISPATCHER_TIMEOUT:
-                            if hostname == "lava-logs":
-                                self.logger.error("[STATE] lava-logs goes OFFLINE")
+                            if is_lava_logs(hostname):
+                                self.logger.error("[STATE] %s goes OFFLINE", hostname)
                             else:
                                 self.logger.error("[STATE] Dispatcher <%s> goes OFFLINE", hostname)
                             self.dispatchers[hostname].go_offline()
@@ -686,11 +860,11 @@ class Command(LAVADaemonCommand):
                 # Limit accesses to the database. This will also limit the rate of
                 # CANCEL and START messages
                 if time.time() - last_schedule > SCHEDULE_INTERVAL:
-                    if self.dispatchers["lava-logs"].online:
+                    if self.logs_online():
                         schedule(self.logger)
 
                         # Dispatch scheduled jobs
-                        with transaction.atomic():
+                        with START_DURATION.time(), TRACER.trace("start_jobs"), transaction.atomic():
                             self.start_jobs(options)
                     else:
                         self.logger.warning("lava-logs is offline: can't schedule jobs")
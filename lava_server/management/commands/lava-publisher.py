@@ -22,11 +22,23 @@ import zmq
 
 from django.conf import settings
 
+from lava_scheduler_app.events import EventBuffer, MappedEventBuffer, with_sequence
+from lava_server import metrics
 from lava_server.cmdutils import LAVADaemonCommand
 
 
 FORMAT = "%(asctime)-15s %(levelname)7s %(message)s"
 
+# Maximum number of events sent in one replay reply
+REPLAY_LIMIT = 1000
+
+# Metrics
+FORWARDED = metrics.counter("lava_publisher_events_total", "Events published")
+FORWARD_FAILURES = metrics.counter("lava_publisher_forward_failures_total",
+                                   "Events dropped by the additional sockets", ["socket"])
+REPLAYS = metrics.counter("lava_publisher_replays_total", "Replay requests")
+SEQUENCE = metrics.gauge("lava_publisher_sequence", "Sequence number of the last event")
+
 
 class Command(LAVADaemonCommand):
     help = "LAVA event publisher"
@@ -41,6 +53,8 @@ class Command(LAVADaemonCommand):
             self.logger.error("Unable to drop privileges")
             return
 
+        self.setup_metrics(options)
+
         if not settings.EVENT_NOTIFICATION:
             self.logger.error("'EVENT_NOTIFICATION' is set to False, "
                               "LAVA won't generated any events")
@@ -73,6 +87,22 @@ class Command(LAVADaemonCommand):
             sock.connect(url)
             additional_sockets.append(sock)
 
+        # Keep the last events for the subscribers that missed them
+        if settings.EVENT_BUFFER_FILE:
+            self.logger.info("Keeping the last %d events in %s",
+                             settings.EVENT_BUFFER_SIZE, settings.EVENT_BUFFER_FILE)
+            buf = MappedEventBuffer(settings.EVENT_BUFFER_FILE, settings.EVENT_BUFFER_SIZE)
+        else:
+            self.logger.info("Keeping the last %d events", settings.EVENT_BUFFER_SIZE)
+            buf = EventBuffer(settings.EVENT_BUFFER_SIZE)
+        replay = None
+        if settings.EVENT_REPLAY_SOCKET:
+            self.logger.info("Creating the replay socket at %s",
+                             settings.EVENT_REPLAY_SOCKET)
+            replay = context.socket(zmq.REP)
+            replay.bind(settings.EVENT_REPLAY_SOCKET)
+            poller.register(replay, zmq.POLLIN)
+
         self.logger.info("Starting the proxy")
         while True:
             try:
@@ -85,8 +115,15 @@ class Command(LAVADaemonCommand):
                 self.logger.info("Received a signal, leaving")
                 break
 
+            if replay is not None and sockets.get(replay) == zmq.POLLIN:
+                self.replay(replay, buf)
+
             if sockets.get(pull) == zmq.POLLIN:
-                msg = pull.recv_multipart()
+                # Add the sequence number to the data of the event
+                msg = with_sequence(pull.recv_multipart(), buf.sequence + 1)
+                sequence = buf.append(msg)
+                FORWARDED.inc()
+                SEQUENCE.set(sequence)
                 self.logger.debug("Forwarding: %s", msg)
                 pub.send_multipart(msg)
                 for (i, sock) in enumerate(additional_sockets):
@@ -97,3 +134,32 @@ class Command(LAVADaemonCommand):
                         sock.send_multipart(msg, flags=zmq.DONTWAIT)
                     except zmq.error.Again:
                         self.logger.warning("Fail to forward to socket %d", i)
+                        FORWARD_FAILURES.labels(i).inc()
+
+        buf.close()
+
+    def replay(self, sock, buf):
+        """
+        Answer a replay request: [b"REPLAY", b"<sequence>"] with
+        [b"EVENTS", b"<oldest>", b"<latest>"] followed by the five frames of
+        each event published after <sequence>.
+        """
+        msg = sock.recv_multipart()
+        REPLAYS.inc()
+        try:
+            (command, sequence) = msg
+            if command != b"REPLAY":
+                raise ValueError(command)
+            sequence = int(sequence)
+        except ValueError:
+            self.logger.error("Invalid replay request: %s", msg)
+            sock.send_multipart([b"ERROR", b"Invalid request"])
+            return
+
+        reply = [b"EVENTS", str(buf.oldest).encode("utf-8"),
+                 str(buf.sequence).encode("utf-8")]
+        events = buf.since(sequence, REPLAY_LIMIT)
+        for (_, frames) in events:
+            reply.extend(frames)
+        self.logger.debug("Replaying %d events after %d", len(events), sequence)
+        sock.send_multipart(reply)
@@ -0,0 +1,106 @@
+# Copyright (C) 2018 Linaro Limited
+#
+# This file is part of LAVA Server.
+#
+# LAVA Server is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# LAVA Server is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along
+# with this program; if not, see <http://www.gnu.org/licenses>.
+
+import datetime
+import os
+import random
+import simplejson
+import tempfile
+import time
+import yaml
+import zmq
+
+from django.core.management.base import BaseCommand
+
+from lava_scheduler_app.logutils import parse_log_message
+
+
+LEVELS = ["debug", "info", "target", "input", "feedback"]
+
+
+class Command(BaseCommand):
+    help = "Compare the throughput of lava-logs for the YAML and the " \
+           "multi-frame log formats"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", default=100000, type=int,
+                            help="Number of log messages. Default: 100000")
+        parser.add_argument("--results", default=0.01, type=float,
+                            help="Ratio of results messages. Default: 0.01")
+        parser.add_argument("--repeat", default=3, type=int,
+                            help="Number of runs for each format. Default: 3")
+
+    def handle(self, *_, **options):
+        messages = self.generate(options["messages"], options["results"])
+        context = zmq.Context.instance()
+        for (name, index) in [("yaml", 0), ("frames", 1)]:
+            timings = [self.measure(context, [m[index] for m in messages])
+                       for _ in range(options["repeat"])]
+            elapsed = sorted(timings)[len(timings) // 2]
+            self.stdout.write("%-8s %8.2fs  %10.0f msg/s" % (name, elapsed, len(messages) / elapsed))
+        context.term()
+
+    def generate(self, count, ratio):  # pylint: disable=no-self-use
+        """
+        Return the same log messages in both formats
+        """
+        rand = random.Random(42)
+        now = datetime.datetime.utcnow()
+        messages = []
+        for index in range(count):
+            dt = (now + datetime.timedelta(milliseconds=index)).isoformat()
+            if rand.random() < ratio:
+                (lvl, msg) = ("results", {"definition": "smoke", "case": "case-%d" % index,
+                                          "result": rand.choice(["pass", "fail"])})
+            else:
+                (lvl, msg) = (rand.choice(LEVELS),
+                              "line %d: %s" % (index, "x" * rand.randint(10, 120)))
+            line = yaml.dump({"dt": dt, "lvl": lvl, "msg": msg},
+                             default_flow_style=True, width=10 ** 6).rstrip("\n")
+            messages.append(([b"1", line.encode("utf-8")],
+                             [b"1", lvl.encode("utf-8"), dt.encode("utf-8"),
+                              simplejson.dumps(msg).encode("utf-8")]))
+        return messages
+
+    def measure(self, context, messages):  # pylint: disable=no-self-use
+        """
+        Send the messages through a zmq socket and time the reception,
+        parsing and writing to disk, as done by lava-logs
+        """
+        pull = context.socket(zmq.PULL)
+        pull.setsockopt(zmq.RCVHWM, 0)
+        pull.bind("inproc://logs-benchmark")
+        push = context.socket(zmq.PUSH)
+        push.setsockopt(zmq.SNDHWM, 0)
+        push.connect("inproc://logs-benchmark")
+        for msg in messages:
+            push.send_multipart(msg)
+
+        (fd, filename) = tempfile.mkstemp()
+        start = time.time()
+        with os.fdopen(fd, "w") as output:
+            for _ in range(len(messages)):
+                (_, _, _, line) = parse_log_message(pull.recv_multipart())
+                output.write(line)
+                output.write("\n")
+        elapsed = time.time() - start
+
+        os.unlink(filename)
+        push.close(linger=0)
+        pull.close(linger=0)
+        return elapsed
@@ -0,0 +1,64 @@
+# Copyright (C) 2018 Linaro Limited
+#
+# This file is part of LAVA Server.
+#
+# LAVA Server is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# LAVA Server is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along
+# with this program; if not, see <http://www.gnu.org/licenses>.
+
+import simplejson
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from lava_server.querystats import TOP_SHAPES, load
+
+
+class Command(BaseCommand):
+    help = "Show the SQL statistics of the views and XML-RPC methods"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--directory", default=settings.QUERY_STATS_DIRECTORY,
+                            help="Directory of the statistics. Default: QUERY_STATS_DIRECTORY")
+        parser.add_argument("--sort", default="queries",
+                            choices=["calls", "queries", "max_queries", "sql_time"],
+                            help="Sort the endpoints. Default: queries")
+        parser.add_argument("--shapes", default=3, type=int,
+                            help="Number of repeated queries to show by endpoint. Default: 3")
+        parser.add_argument("--json", default=False, action="store_true",
+                            help="Print the statistics as json")
+
+    def handle(self, *_, **options):
+        if not options["directory"]:
+            raise CommandError("QUERY_STATS_DIRECTORY is not set")
+        try:
+            endpoints = load(options["directory"])
+        except OSError as exc:
+            raise CommandError("Unable to read the statistics: %s" % exc)
+
+        if options["json"]:
+            self.stdout.write(simplejson.dumps({name: stats.as_dict()
+                                                for (name, stats) in endpoints.items()},
+                                               indent=2, sort_keys=True))
+            return
+
+        shapes = min(options["shapes"], TOP_SHAPES)
+        self.stdout.write("%-40s %8s %10s %8s %10s %10s" % (
+            "endpoint", "calls", "queries", "max", "per call", "sql (ms)"))
+        for (name, stats) in sorted(endpoints.items(), key=lambda item: getattr(item[1], options["sort"]),
+                                    reverse=True):
+            self.stdout.write("%-40s %8d %10d %8d %10.1f %10.1f" % (
+                name, stats.calls, stats.queries, stats.max_queries,
+                float(stats.queries) / max(stats.calls, 1), stats.sql_time * 1000))
+            for (shape, count) in stats.shapes.most_common(shapes):
+                self.stdout.write("    %8d x %s" % (count, shape[:160]))
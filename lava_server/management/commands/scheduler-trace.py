@@ -0,0 +1,67 @@
+# Copyright (C) 2018 Linaro Limited
+#
+# This file is part of LAVA Server.
+#
+# LAVA Server is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# LAVA Server is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along
+# with this program; if not, see <http://www.gnu.org/licenses>.
+
+import collections
+import logging
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from lava_scheduler_app.scheduler import schedule
+from lava_server.tracing import TRACER
+
+
+class Command(BaseCommand):
+    help = "Trace scheduling passes and dump them in the Chrome trace format"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--passes", default=1, type=int,
+                            help="Number of scheduling passes. Default: 1")
+        parser.add_argument("--output", default="scheduler-trace.json",
+                            help="Trace file. Default: scheduler-trace.json")
+        parser.add_argument("--commit", default=False, action="store_true",
+                            help="Commit the scheduling decisions. By default, "
+                                 "every pass is rolled back.")
+
+    def handle(self, *_, **options):
+        logger = logging.getLogger("lava-scheduler-trace")
+        logger.addHandler(logging.NullHandler())
+
+        TRACER.enable(options["passes"])
+        for _ in range(options["passes"]):
+            with transaction.atomic():
+                schedule(logger)
+                if not options["commit"]:
+                    transaction.set_rollback(True)
+        TRACER.disable()
+
+        TRACER.write(options["output"], "scheduler-trace")
+        self.stdout.write("Trace written to %s" % options["output"])
+
+        # Summary of the phases over all the passes
+        phases = collections.OrderedDict()
+        for event in sorted((e for p in TRACER.passes for e in p), key=lambda e: e["ts"]):
+            phase = phases.setdefault(event["name"], [0, 0, 0, 0])
+            phase[0] += 1
+            phase[1] += event["dur"]
+            phase[2] += event["args"]["queries"]
+            phase[3] += event["args"]["sql_time"]
+        self.stdout.write("%-24s %8s %10s %8s %10s" % ("phase", "count", "time (ms)", "queries", "sql (ms)"))
+        for (name, (count, duration, queries, sql_time)) in phases.items():
+            self.stdout.write("%-24s %8d %10.1f %8d %10.1f" % (name, count, duration / 1000.0,
+                                                               queries, sql_time * 1000))
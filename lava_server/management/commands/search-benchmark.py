@@ -0,0 +1,111 @@
+# Copyright (C) 2018 Linaro Limited
+#
+# This file is part of LAVA Dispatcher.
+#
+# LAVA Dispatcher is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# LAVA Dispatcher is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along
+# with this program; if not, see <http://www.gnu.org/licenses>.
+
+import random
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Q
+
+from lava.utils.search import document_filter
+from lava_scheduler_app.models import DeviceType, TestJob
+
+
+WORDS = ["boot", "smoke", "kselftest", "ltp", "lkft", "health", "check",
+         "android", "cts", "vts", "network", "usb", "mmc", "suspend", "stress"]
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Compare the latency of the job table search box with and " \
+           "without the search document index"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--jobs", default=100000, type=int,
+                            help="Number of synthetic jobs to create. "
+                                 "Default: 100000")
+        parser.add_argument("--repeat", default=5, type=int,
+                            help="Number of runs for each search. Default: 5")
+        parser.add_argument("--keep", default=False, action="store_true",
+                            help="Keep the synthetic jobs in the database")
+        parser.add_argument("terms", nargs="*",
+                            default=["kselftest", "bench-user-3", "bench-dt-1", "smoke check"],
+                            help="Search terms")
+
+    def handle(self, *_, **options):
+        try:
+            with transaction.atomic():
+                self.populate(options["jobs"])
+                for term in options["terms"]:
+                    self.compare(term, options["repeat"])
+                if not options["keep"]:
+                    raise Rollback()
+        except Rollback:
+            self.stdout.write("Removing the synthetic jobs")
+
+    def populate(self, count):
+        self.stdout.write("Creating %d synthetic jobs" % count)
+        users = [User.objects.get_or_create(username="bench-user-%d" % index)[0]
+                 for index in range(10)]
+        device_types = [DeviceType.objects.get_or_create(name="bench-dt-%d" % index)[0]
+                        for index in range(5)]
+        rand = random.Random(42)
+        batch = []
+        for _ in range(count):
+            job = TestJob(submitter=rand.choice(users),
+                          requested_device_type=rand.choice(device_types),
+                          description=" ".join(rand.sample(WORDS, 3)),
+                          definition="", original_definition="")
+            job.search_document = job.build_search_document()
+            batch.append(job)
+            if len(batch) == 1000:
+                TestJob.objects.bulk_create(batch)
+                batch = []
+        TestJob.objects.bulk_create(batch)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE lava_scheduler_app_testjob")
+
+    def measure(self, query, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.time()
+            jobs = TestJob.objects.filter(query).order_by("-submit_time")
+            jobs.count()
+            list(jobs[:25])
+            timings.append((time.time() - start) * 1000)
+        return sorted(timings)[len(timings) // 2]
+
+    def legacy_query(self, term):  # pylint: disable=no-self-use
+        """
+        Query built by the search box before the search document
+        """
+        return (Q(id__contains=term) | Q(sub_id__contains=term) |
+                Q(description__contains=term) |
+                Q(actual_device__hostname__contains=term) |
+                Q(submitter__in=User.objects.filter(username__contains=term)) |
+                Q(state__in=[p[0] for p in TestJob.STATE_CHOICES if term in p[1]]))
+
+    def compare(self, term, repeat):
+        legacy = self.measure(self.legacy_query(term), repeat)
+        indexed = self.measure(document_filter("search_document", term), repeat)
+        self.stdout.write("%-20s legacy: %8.2fms  document: %8.2fms" % (term, legacy, indexed))
@@ -0,0 +1,114 @@
+# Copyright (C) 2018 Linaro Limited
+#
+# This file is part of LAVA Server.
+#
+# LAVA Server is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# LAVA Server is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along
+# with this program; if not, see <http://www.gnu.org/licenses>.
+
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+
+from lava_scheduler_app.synthetic import SyntheticLab
+
+
+class Command(BaseCommand):
+    help = "Manage a synthetic lab used by the benchmarks"
+
+    def add_arguments(self, parser):
+        cmd = self
+
+        class SubParser(CommandParser):
+            """
+            Sub-parsers constructor that mimic Django constructor.
+            See http://stackoverflow.com/a/37414551
+            """
+            def __init__(self, **kwargs):
+                super(SubParser, self).__init__(cmd, **kwargs)
+
+        sub = parser.add_subparsers(dest="sub_command", help="Sub commands", parser_class=SubParser)
+        sub.required = True
+
+        create_parser = sub.add_parser("create", help="Create a synthetic lab")
+        create_parser.add_argument("--prefix", default="synthetic",
+                                   help="Prefix of the objects names. Default: synthetic")
+        create_parser.add_argument("--device-types", default=10, type=int,
+                                   help="Number of device types. Default: 10")
+        create_parser.add_argument("--devices", default=100, type=int,
+                                   help="Number of devices. Default: 100")
+        create_parser.add_argument("--workers", default=10, type=int,
+                                   help="Number of workers. Default: 10")
+        create_parser.add_argument("--tags", default=20, type=int,
+                                   help="Number of tags. Default: 20")
+        create_parser.add_argument("--queued-jobs", default=1000, type=int,
+                                   help="Number of jobs waiting for a device. Default: 1000")
+        create_parser.add_argument("--finished-jobs", default=10000, type=int,
+                                   help="Number of finished jobs. Default: 10000")
+        create_parser.add_argument("--test-cases", default=100000, type=int,
+                                   help="Number of test cases. Default: 100000")
+        create_parser.add_argument("--seed", default=42, type=int,
+                                   help="Seed of the random generator. Default: 42")
+        create_parser.add_argument("--config-path", default=None,
+                                   help="Where to write the device dictionaries. "
+                                        "Default: the lava-server device dictionaries directory")
+
+        delete_parser = sub.add_parser("delete", help="Remove a synthetic lab")
+        delete_parser.add_argument("--prefix", default="synthetic",
+                                   help="Prefix of the objects names. Default: synthetic")
+        delete_parser.add_argument("--config-path", default=None,
+                                   help="Where the device dictionaries were written")
+
+        show_parser = sub.add_parser("show", help="Count the objects of a synthetic lab")
+        show_parser.add_argument("--prefix", default="synthetic",
+                                 help="Prefix of the objects names. Default: synthetic")
+
+    def handle(self, *args, **options):
+        """ Forward to the right sub-handler """
+        if options["sub_command"] == "create":
+            self.handle_create(options)
+        elif options["sub_command"] == "delete":
+            self.handle_delete(options)
+        elif options["sub_command"] == "show":
+            self.handle_show(options)
+
+    def handle_create(self, options):
+        lab = SyntheticLab(prefix=options["prefix"],
+                           device_types=options["device_types"],
+                           devices=options["devices"],
+                           workers=options["workers"],
+                           tags=options["tags"],
+                           queued_jobs=options["queued_jobs"],
+                           finished_jobs=options["finished_jobs"],
+                           test_cases=options["test_cases"],
+                           seed=options["seed"],
+                           config_path=options["config_path"],
+                           output=self.stdout.write)
+        if lab.exists():
+            raise CommandError("A synthetic lab named '%s' already exists" % options["prefix"])
+        for name in ["device_types", "devices", "workers"]:
+            if lab.counts[name] < 1:
+                raise CommandError("The number of %s should be a positive integer" % name.replace("_", " "))
+        lab.create()
+        self.handle_show(options)
+
+    def handle_delete(self, options):
+        lab = SyntheticLab(prefix=options["prefix"],
+                           config_path=options["config_path"],
+                           output=self.stdout.write)
+        if not lab.exists():
+            raise CommandError("Unable to find a synthetic lab named '%s'" % options["prefix"])
+        lab.delete()
+
+    def handle_show(self, options):
+        lab = SyntheticLab(prefix=options["prefix"])
+        for (name, value) in sorted(lab.summary().items()):
+            self.stdout.write("%-14s: %s" % (name.replace("_", " "), value))
@@ -0,0 +1,308 @@
+# Copyright (C) 2018 Linaro Limited
+#
+# This file is part of LAVA Server.
+#
+# LAVA Server is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# LAVA Server is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along
+# with this program; if not, see <http://www.gnu.org/licenses>.
+
+"""
+Minimal metrics registry for the LAVA daemons, rendered in the Prometheus
+text format.
+
+The metrics are module level objects:
+
+    MESSAGES = metrics.counter("lava_logs_messages_total",
+                               "Log messages received", ["level"])
+    MESSAGES.labels("info").inc()
+
+and are exported by LAVADaemonCommand.setup_metrics() over HTTP or in a
+file read by the node exporter textfile collector.
+"""
+
+from __future__ import unicode_literals
+
+import bisect
+import contextlib
+import os
+import tempfile
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (name, value.replace("\\", "\\\\").replace('"', '\\"'))
+                             for (name, value) in pairs)
+
+
+class Metric(object):
+    kind = None
+    # Class of the values of the metric, one for each set of label values
+    child_class = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self.children = {}
+        self.lock = threading.Lock()
+
+    def labels(self, *values):
+        if len(values) != len(self.label_names):
+            raise ValueError("%s expects %d labels" % (self.name, len(self.label_names)))
+        key = tuple(str(value) for value in values)
+        child = self.children.get(key)
+        if child is None:
+            with self.lock:
+                child = self.children.get(key)
+                if child is None:
+                    child = self.children[key] = self.new_child()
+        return child
+
+    def new_child(self):
+        return self.child_class()  # pylint: disable=not-callable
+
+    def samples(self):
+        """
+        Return the (suffix, label values, extra label, value) of the metric
+        """
+        if not self.label_names:
+            self.labels()
+        with self.lock:
+            children = list(self.children.items())
+        for (key, child) in sorted(children, key=lambda item: item[0]):
+            for (suffix, extra, value) in child.samples():
+                yield (suffix, key, extra, value)
+
+    def render(self):
+        lines = ["# HELP %s %s" % (self.name, self.documentation),
+                 "# TYPE %s %s" % (self.name, self.kind)]
+        for (suffix, key, extra, value) in self.samples():
+            lines.append("%s%s%s %s" % (self.name, suffix,
+                                        format_labels(self.label_names, key, extra),
+                                        format_value(value)))
+        return "\n".join(lines)
+
+
+class CounterChild(object):
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self):
+        return [("", None, self.value)]
+
+
+class GaugeChild(object):
+
+    def __init__(self):
+        self.value = 0
+        self.function = None
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set_function(self, function):
+        """
+        Compute the value when the metrics are exported
+        """
+        self.function = function
+
+    def samples(self):
+        return [("", None, self.value if self.function is None else self.function())]
+
+
+class HistogramChild(object):
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    @contextlib.contextmanager
+    def time(self):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(time.time() - start)
+
+    def samples(self):
+        samples = []
+        total = 0
+        for (bound, count) in zip(list(self.buckets) + [float("inf")], self.counts):
+            total += count
+            samples.append(("_bucket", ("le", format_value(float(bound))), total))
+        samples.append(("_sum", None, self.sum))
+        samples.append(("_count", None, total))
+        return samples
+
+
+class Counter(Metric):
+    kind = "counter"
+    child_class = CounterChild
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Gauge(Metric):
+    kind = "gauge"
+    child_class = GaugeChild
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+
+    def set_function(self, function):
+        self.labels().set_function(function)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+    child_class = HistogramChild
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def new_child(self):
+        return HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+
+class Registry(object):
+
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        current = self.metrics.setdefault(metric.name, metric)
+        if type(current) is not type(metric):
+            raise ValueError("%s is already registered as a %s" % (metric.name, current.kind))
+        return current
+
+    def render(self):
+        return "".join(self.metrics[name].render() + "\n"
+                       for name in sorted(self.metrics))
+
+
+REGISTRY = Registry()
+
+
+def counter(name, documentation, labels=()):
+    return REGISTRY.register(Counter(name, documentation, labels))
+
+
+def gauge(name, documentation, labels=()):
+    return REGISTRY.register(Gauge(name, documentation, labels))
+
+
+def histogram(name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram(name, documentation, labels, buckets))
+
+
+def write_textfile(filename, registry=REGISTRY):
+    """
+    Atomically write the metrics in filename
+    """
+    (fd, tmp) = tempfile.mkstemp(dir=os.path.dirname(filename) or ".",
+                                 prefix=".%s." % os.path.basename(filename))
+    try:
+        with os.fdopen(fd, "w") as f_out:
+            f_out.write(registry.render())
+        os.chmod(tmp, 0o644)
+        os.rename(tmp, filename)
+    except OSError:
+        os.unlink(tmp)
+        raise
+
+
+def start_textfile_exporter(filename, interval, registry=REGISTRY):
+    def export():
+        while True:
+            try:
+                write_textfile(filename, registry)
+            except (IOError, OSError):
+                pass
+            time.sleep(interval)
+
+    thread = threading.Thread(target=export, name="metrics-textfile")
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def start_http_exporter(address, port, registry=REGISTRY):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):  # pylint: disable=invalid-name
+            if self.path.split("?")[0] not in ["/", "/metrics"]:
+                self.send_error(404)
+                return
+            data = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):  # pylint: disable=arguments-differ
+            pass
+
+    server = HTTPServer((address, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name="metrics-http")
+    thread.daemon = True
+    thread.start()
+    return server
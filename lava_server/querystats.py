@@ -0,0 +1,278 @@
+# Copyright (C) 2018 Linaro Limited
+#
+# This file is part of LAVA Server.
+#
+# LAVA Server is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# LAVA Server is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along
+# with this program; if not, see <http://www.gnu.org/licenses>.
+
+"""
+Per request SQL query statistics.
+
+Every view (named after its url name) and every XML-RPC method is an
+endpoint. For each call, the number and the duration of the SQL queries
+are recorded along with the queries that were run more than once with
+only different parameters. Such repeated query shapes are usually the sign
+of a N+1 pattern.
+
+The statistics are aggregated by endpoint, exported in the metrics
+registry and, when QUERY_STATS_DIRECTORY is set, dumped by every process
+in that directory. "lava-server manage query-stats" reads the dumps.
+
+An endpoint listed in QUERY_BUDGETS that runs more queries than its
+budget is logged or, when QUERY_BUDGETS_STRICT is set (as in the test
+suite), raises QueryBudgetExceeded.
+"""
+
+from __future__ import unicode_literals
+
+import collections
+import contextlib
+import logging
+import os
+import re
+import simplejson
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.utils.deprecation import MiddlewareMixin
+
+from lava_server import metrics
+from linaro_django_xmlrpc.models import Dispatcher
+
+
+# Number of query shapes kept by endpoint
+MAX_SHAPES = 200
+# Number of shapes displayed and dumped by endpoint
+TOP_SHAPES = 10
+
+SHAPE_PATTERNS = [
+    (re.compile(r"'(?:[^']|'')*'"), "?"),
+    (re.compile(r"\b\d+(?:\.\d+)?\b"), "?"),
+    (re.compile(r"\((?:\?, )+\?\)"), "(?, ...)"),
+    (re.compile(r"\s+"), " "),
+]
+
+CALLS = metrics.counter("lava_server_endpoint_calls_total",
+                        "Calls of the views and XML-RPC methods", ["endpoint"])
+QUERIES = metrics.histogram("lava_server_endpoint_queries",
+                            "SQL queries per call of the views and XML-RPC methods", ["endpoint"],
+                            buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000))
+SQL_TIME = metrics.counter("lava_server_endpoint_sql_seconds_total",
+                           "Time spent in SQL queries by the views and XML-RPC methods", ["endpoint"])
+OVER_BUDGET = metrics.counter("lava_server_endpoint_over_budget_total",
+                              "Calls that ran more queries than the endpoint budget", ["endpoint"])
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def query_shape(sql):
+    """
+    Replace the literals of the query by placeholders
+    """
+    for (pattern, replacement) in SHAPE_PATTERNS:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+class EndpointStats(object):
+
+    def __init__(self):
+        self.calls = 0
+        self.queries = 0
+        self.max_queries = 0
+        self.sql_time = 0.0
+        # Repeated queries (after the first one) by shape
+        self.shapes = collections.Counter()
+
+    def add(self, queries):
+        self.calls += 1
+        self.queries += len(queries)
+        self.max_queries = max(self.max_queries, len(queries))
+        self.sql_time += sum(float(query["time"]) for query in queries)
+        shapes = collections.Counter(query_shape(query["sql"]) for query in queries)
+        for (shape, count) in shapes.items():
+            if count > 1:
+                self.shapes[shape] += count - 1
+        if len(self.shapes) > MAX_SHAPES:
+            self.shapes = collections.Counter(dict(self.shapes.most_common(MAX_SHAPES // 2)))
+
+    def as_dict(self):
+        return {"calls": self.calls,
+                "queries": self.queries,
+                "max_queries": self.max_queries,
+                "sql_time": round(self.sql_time, 6),
+                "repeated": self.shapes.most_common(TOP_SHAPES)}
+
+
+class QueryStats(object):
+
+    def __init__(self):
+        self.endpoints = collections.defaultdict(EndpointStats)
+        self.lock = threading.Lock()
+
+    def add(self, endpoint, queries):
+        with self.lock:
+            self.endpoints[endpoint].add(queries)
+        CALLS.labels(endpoint).inc()
+        QUERIES.labels(endpoint).observe(len(queries))
+        SQL_TIME.labels(endpoint).inc(sum(float(query["time"]) for query in queries))
+
+    def as_dict(self):
+        with self.lock:
+            return {name: stats.as_dict() for (name, stats) in self.endpoints.items()}
+
+    def reset(self):
+        with self.lock:
+            self.endpoints.clear()
+
+
+STATS = QueryStats()
+
+
+def check_budget(endpoint, queries):
+    budget = settings.QUERY_BUDGETS.get(endpoint)
+    if budget is None or len(queries) <= budget:
+        return
+    OVER_BUDGET.labels(endpoint).inc()
+    shapes = collections.Counter(query_shape(query["sql"]) for query in queries)
+    (shape, count) = shapes.most_common(1)[0]
+    msg = "%s ran %d queries (budget: %d), most repeated (%d times): %s" % (
+        endpoint, len(queries), budget, count, shape)
+    if settings.QUERY_BUDGETS_STRICT:
+        raise QueryBudgetExceeded(msg)
+    logging.getLogger("lava_server").warning(msg)
+
+
+@contextlib.contextmanager
+def capture_queries():
+    """
+    Record every query run in the block, even when DEBUG is False.
+    The queries are then appended to the current log so nested and outer
+    captures (like assertNumQueries) are not disturbed.
+    """
+    (debug_cursor, queries_log) = (connection.force_debug_cursor, connection.queries_log)
+    queries = []
+    connection.force_debug_cursor = True
+    connection.queries_log = queries
+    try:
+        yield queries
+    finally:
+        connection.force_debug_cursor = debug_cursor
+        connection.queries_log = queries_log
+        if debug_cursor or settings.DEBUG:
+            queries_log.extend(queries)
+
+
+@contextlib.contextmanager
+def record(endpoint):
+    with capture_queries() as queries:
+        yield queries
+    STATS.add(endpoint, queries)
+    check_budget(endpoint, queries)
+
+
+def xmlrpc_hook(call, method_name, context):  # pylint: disable=unused-argument
+    with record(method_name):
+        return call()
+
+
+def dump(directory):
+    """
+    Dump the statistics of this process in directory
+    """
+    filename = os.path.join(directory, "lava-server-%d.json" % os.getpid())
+    tmp = filename + ".tmp"
+    with open(tmp, "w") as f_out:
+        simplejson.dump({"pid": os.getpid(), "time": time.time(),
+                         "endpoints": STATS.as_dict()}, f_out)
+    os.rename(tmp, filename)
+    metrics.write_textfile(os.path.join(directory, "lava-server-%d.prom" % os.getpid()))
+
+
+def start_dumper(directory, interval):
+    def export():
+        while True:
+            time.sleep(interval)
+            try:
+                dump(directory)
+            except (IOError, OSError):
+                pass
+
+    thread = threading.Thread(target=export, name="querystats-dump")
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def load(directory):
+    """
+    Aggregate the statistics dumped by every process
+    """
+    endpoints = collections.defaultdict(EndpointStats)
+    for name in sorted(os.listdir(directory)):
+        if not (name.startswith("lava-server-") and name.endswith(".json")):
+            continue
+        try:
+            with open(os.path.join(directory, name), "r") as f_in:
+                data = simplejson.load(f_in)
+        except (IOError, OSError, ValueError):
+            continue
+        for (endpoint, values) in data["endpoints"].items():
+            stats = endpoints[endpoint]
+            stats.calls += values["calls"]
+            stats.queries += values["queries"]
+            stats.max_queries = max(stats.max_queries, values["max_queries"])
+            stats.sql_time += values["sql_time"]
+            stats.shapes.update(dict(values["repeated"]))
+    return dict(endpoints)
+
+
+class QueryStatsMiddleware(MiddlewareMixin):
+    """
+    Record the SQL queries of every request, by view name. The XML-RPC
+    methods are recorded separately by a dispatcher hook.
+    """
+
+    started = False
+
+    def __init__(self, get_response=None):
+        if not settings.QUERY_STATS:
+            raise MiddlewareNotUsed()
+        super(QueryStatsMiddleware, self).__init__(get_response)
+        if xmlrpc_hook not in Dispatcher.hooks:
+            Dispatcher.hooks.append(xmlrpc_hook)
+        if settings.QUERY_STATS_DIRECTORY and not QueryStatsMiddleware.started:
+            QueryStatsMiddleware.started = True
+            start_dumper(settings.QUERY_STATS_DIRECTORY, settings.QUERY_STATS_INTERVAL)
+
+    def process_request(self, request):  # pylint: disable=no-self-use
+        request.querystats = capture_queries()
+        request.querystats_queries = request.querystats.__enter__()
+
+    def process_response(self, request, response):  # pylint: disable=no-self-use
+        capture = getattr(request, "querystats", None)
+        if capture is None:
+            return response
+        del request.querystats
+        capture.__exit__(None, None, None)
+        match = getattr(request, "resolver_match", None)
+        endpoint = match.view_name if match is not None else "unknown"
+        STATS.add(endpoint, request.querystats_queries)
+        check_budget(endpoint, request.querystats_queries)
+        return response
@@ -58,6 +58,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE_CLASSES = [
+    'lava_server.querystats.QueryStatsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -188,6 +189,24 @@ USE_DEBUG_TOOLBAR = False
 # Template caching
 USE_TEMPLATE_CACHE = False
 
+# Per view and XML-RPC method SQL statistics
+QUERY_STATS = False
+# Directory where every process dumps its statistics
+QUERY_STATS_DIRECTORY = None
+QUERY_STATS_INTERVAL = 60
+# Maximum number of queries by view name or XML-RPC method name. The
+# tables and lists should run the same number of queries whatever the
+# number of rows.
+QUERY_BUDGETS = {
+    "lava.scheduler": 30,
+    "lava.scheduler.queue": 25,
+    "lava.scheduler.alldevices": 25,
+    "lava.scheduler.job.list": 25,
+    "scheduler.devices.list": 10,
+}
+# Raise an exception instead of logging a warning
+QUERY_BUDGETS_STRICT = False
+
 # LDAP support
 AUTH_LDAP_SERVER_URI = None
 AUTH_LDAP_BIND_DN = None
@@ -17,6 +17,7 @@
 # along with LAVA Server.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import sys
 from lava_server.settings.config_file import ConfigFile
 from lava_server.settings.common import *
 
@@ -87,6 +88,11 @@ except ImportError:
 
 USE_DEBUG_TOOLBAR = False
 
+# Record the SQL queries of every view and XML-RPC method and, when running
+# the test suite, fail on the endpoints going over their budget.
+QUERY_STATS = True
+QUERY_BUDGETS_STRICT = "test" in sys.argv
+
 # Any emails that would normally be sent are redirected to stdout.
 # This setting is only used for django 1.2 and newer.
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
@@ -148,6 +148,11 @@ LOGGING = {
             'level': 'INFO',
             'propagate': True,
         },
+        'lava_server': {
+            'handlers': ['logfile'],
+            'level': 'INFO',
+            'propagate': True,
+        },
         'lava_results_app': {
             'handlers': ['logfile'],
             'level': 'INFO',
@@ -0,0 +1,159 @@
+# Copyright (C) 2018 Linaro Limited
+#
+# This file is part of LAVA Server.
+#
+# LAVA Server is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# LAVA Server is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along
+# with this program; if not, see <http://www.gnu.org/licenses>.
+
+"""
+Opt-in tracing of the scheduling passes.
+
+A pass is recorded with TRACER.trace() and split into phases with
+TRACER.span(). Each span records its wall time along with the number and
+the duration of the SQL queries. When tracing is disabled, both context
+managers do nothing.
+
+The last passes are kept in a ring buffer and dumped in the Chrome trace
+event format, that can be loaded in chrome://tracing or
+https://ui.perfetto.dev
+"""
+
+from __future__ import unicode_literals
+
+import collections
+import contextlib
+import itertools
+import os
+import simplejson
+import time
+
+from django.db import connection
+
+
+DEFAULT_PASSES = 100
+DEFAULT_MAX_EVENTS = 50000
+
+
+class Tracer(object):
+
+    def __init__(self):
+        self.enabled = False
+        self.passes = collections.deque(maxlen=DEFAULT_PASSES)
+        self.max_events = DEFAULT_MAX_EVENTS
+        # Events of the pass being recorded
+        self.events = None
+        self.dropped = 0
+
+    def enable(self, passes=DEFAULT_PASSES, max_events=DEFAULT_MAX_EVENTS):
+        """
+        Keep the last 'passes' passes, each one being limited to
+        'max_events' spans.
+        """
+        self.enabled = True
+        self.passes = collections.deque(self.passes, maxlen=passes)
+        self.max_events = max_events
+
+    def disable(self):
+        self.enabled = False
+
+    @contextlib.contextmanager
+    def trace(self, name, category="scheduler", **args):
+        """
+        Record a pass. Nested passes are recorded as spans of the outer one.
+        """
+        if not self.enabled or self.events is not None:
+            with self.span(name, category, **args) as event:
+                yield event
+            return
+
+        self.events = []
+        self.dropped = 0
+        # Record every query of the pass, even when DEBUG is False
+        (debug_cursor, queries_log) = (connection.force_debug_cursor, connection.queries_log)
+        connection.force_debug_cursor = True
+        connection.queries_log = []
+        root = self.new_event(name, category, args)
+        try:
+            yield root
+        finally:
+            self.finish_event(root, 0)
+            connection.force_debug_cursor = debug_cursor
+            connection.queries_log = queries_log
+            (events, self.events) = (self.events, None)
+            root["args"]["device_types"] = self.breakdown(events)
+            if self.dropped:
+                root["args"]["dropped"] = self.dropped
+            events.append(root)
+            self.passes.append(events)
+
+    @contextlib.contextmanager
+    def span(self, name, category="scheduler", **args):
+        """
+        Record a phase of the current pass. The spans with a "device_type"
+        argument are summed up by device type in the pass arguments.
+        """
+        if self.events is None:
+            yield None
+            return
+
+        first_query = len(connection.queries_log)
+        event = self.new_event(name, category, args)
+        try:
+            yield event
+        finally:
+            self.finish_event(event, first_query)
+            if len(self.events) < self.max_events:
+                self.events.append(event)
+            else:
+                self.dropped += 1
+
+    def new_event(self, name, category, args):  # pylint: disable=no-self-use
+        return {"name": name, "cat": category, "ph": "X",
+                "pid": os.getpid(), "tid": 1,
+                "ts": int(time.time() * 1000000), "args": args}
+
+    def finish_event(self, event, first_query):  # pylint: disable=no-self-use
+        queries = connection.queries_log[first_query:]
+        event["dur"] = int(time.time() * 1000000) - event["ts"]
+        event["args"]["queries"] = len(queries)
+        event["args"]["sql_time"] = round(sum(float(q["time"]) for q in queries), 6)
+
+    def breakdown(self, events):  # pylint: disable=no-self-use
+        device_types = collections.defaultdict(lambda: {"duration": 0, "queries": 0, "sql_time": 0})
+        for event in events:
+            device_type = event["args"].get("device_type")
+            if device_type is None:
+                continue
+            total = device_types[device_type]
+            total["duration"] += event["dur"]
+            total["queries"] += event["args"]["queries"]
+            total["sql_time"] = round(total["sql_time"] + event["args"]["sql_time"], 6)
+        return dict(device_types)
+
+    def dump(self, process_name="lava-master"):
+        """
+        Return the recorded passes in the Chrome trace event format
+        """
+        events = [{"name": "process_name", "ph": "M", "pid": os.getpid(),
+                   "args": {"name": process_name}}]
+        events.extend(sorted(itertools.chain.from_iterable(self.passes),
+                             key=lambda event: (event["ts"], -event["dur"])))
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write(self, filename, process_name="lava-master"):
+        with open(filename, "w") as f_out:
+            simplejson.dump(self.dump(process_name), f_out)
+
+
+TRACER = Tracer()
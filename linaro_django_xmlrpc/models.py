@@ -22,6 +22,7 @@ Empty module for Django to pick up this package as Django application
 
 from __future__ import unicode_literals
 
+import functools
 import inspect
 import logging
 import pydoc
@@ -373,8 +374,14 @@ class Dispatcher(object):
 
     Subclasses may want to override handle_internal_error() that currently
     uses logging.exception to print as short message.
+
+    Every method call goes through the functions listed in hooks, called
+    with the next callable, the method name and the call context, like a
+    middleware.
     """
 
+    hooks = []
+
     def __init__(self, mapper, allow_none=True):
         self.mapper = mapper
         self.allow_none = allow_none
@@ -440,7 +447,10 @@ class Dispatcher(object):
                 raise xmlrpclib.Fault(FaultCodes.ServerError.REQUESTED_METHOD_NOT_FOUND,
                                       "No such method: %r" % method_name)
             # TODO: check parameter types before calling
-            return impl(*params)
+            call = functools.partial(impl, *params)
+            for hook in reversed(self.hooks):
+                call = functools.partial(hook, call, method_name, context)
+            return call()
         except xmlrpclib.Fault:
             # Forward XML-RPC Faults to the client
             raise
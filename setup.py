@@ -93,11 +93,13 @@ setup(
          ['etc/lava-server.conf']),
         ('/etc/logrotate.d',
          ['etc/logrotate.d/django-log',
+          'etc/logrotate.d/lava-live-log',
           'etc/logrotate.d/lava-master-log',
           'etc/logrotate.d/lava-publisher-log',
           'etc/logrotate.d/lava-server-gunicorn-log']),
         ('/usr/share/lava-server',
-         ['etc/lava-master.service',
+         ['etc/lava-live.service',
+          'etc/lava-master.service',
           'etc/lava-publisher.service',
           'etc/lava-logs.service',
           'etc/instance.conf.template',